@@ -84,7 +84,7 @@ export default function Home() {
             headers: {
               'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ placeName }),
+            body: JSON.stringify({ placeName, sessionId: ideasData.session_id }),
           });
 
           if (!response.ok) return null;
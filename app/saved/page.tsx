@@ -92,8 +92,12 @@ export default function Saved() {
       const { data: { user }, error: userError } = await supabase.auth.getUser();
       if (userError || !user) throw new Error('User not authenticated');
 
-      // Extract place names for the itinerary
+      // Extract place names and coordinates for the itinerary
       const placeNames = savedPlaces.map(place => place.name);
+      const locations = savedPlaces.map(place => ({
+        latitude: place.latitude,
+        longitude: place.longitude,
+      }));
       
       // Call the itinerary API
       const response = await fetch('/api/getItinerary', {
@@ -101,7 +105,7 @@ export default function Saved() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ places: placeNames }),
+        body: JSON.stringify({ places: placeNames, locations }),
       });
 
       if (!response.ok) {
@@ -0,0 +1,169 @@
+import asyncio
+import datetime
+import json
+import os
+import traceback
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from deadline import (IDEAS_CHECKPOINTS, IDEAS_DEADLINE, ITINERARY_CHECKPOINTS, ITINERARY_DEADLINE, TRIP_CHECKPOINTS,
+                      TRIP_DEADLINE, budget, is_partial)
+from generate_itinerary import get_itinerary_sub_async
+from helper import get_description_and_reviews_async, get_travel_ideas_async
+from http_session import close_async_session
+from photo_service import IMAGE_MAX_UPLOAD_BYTES, prepare_upload
+from session_store import SessionNotFound
+from streaming import sse_response_async, wants_stream
+from tracing import render_metrics, trace
+from trip_planner import TRIP_OPTIONS, InvalidTrip, get_trip_plan_async
+
+# The API of main.py served from an event loop: one worker keeps every
+# in-flight request as a coroutine instead of holding a thread per request
+# while it waits on the search, scraping, LLM and Maps calls. Run it with
+#   gunicorn -b :$PORT --timeout 300 --worker-class aiohttp.GunicornWebWorker async_main:app
+# or `python async_main.py` locally.
+load_dotenv()
+
+print("SERVER STARTED")
+
+
+def error_response(e):
+    return web.json_response({"error": str(e), "stack_trace": traceback.format_exc()}, status=500)
+
+
+async def test(request):
+    return web.json_response({
+        "message": "Hello, World!",
+        "timestamp": datetime.datetime.now().isoformat(),
+        "status": "ok",
+    })
+
+
+async def metrics(request):
+    return web.Response(body=render_metrics().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def get_ideas(request):
+    form = await request.post()
+    description = form.get('prompt')
+    image = form.get('image')
+    if isinstance(image, web.FileField):
+        try:
+            photo = await asyncio.to_thread(prepare_upload, image.file)
+        except ValueError as e:
+            return web.json_response({"error": str(e)}, status=400)
+    else:
+        photo = None
+
+    print(description)
+    use_cache = (str(form.get("no_cache", "")).lower() not in ("1", "true")
+                 and "no-cache" not in request.headers.get("Cache-Control", ""))
+    if wants_stream(request.query, form, accept=request.headers.get("Accept", "")):
+        async def run(emit):
+            with trace("/get_ideas"), budget("/get_ideas", IDEAS_DEADLINE, IDEAS_CHECKPOINTS):
+                place_details, session_id = await get_travel_ideas_async(description, photo, on_event=emit,
+                                                                         use_cache=use_cache)
+                return {"place_details": place_details, "session_id": session_id, "partial": is_partial()}
+        return await sse_response_async(request, run)
+    try:
+        with trace("/get_ideas"), budget("/get_ideas", IDEAS_DEADLINE, IDEAS_CHECKPOINTS):
+            place_details, session_id = await get_travel_ideas_async(description, photo, use_cache=use_cache)
+            partial = is_partial()
+        return web.json_response({
+            "place_details": place_details,
+            "session_id": session_id,
+            "partial": partial,
+        })
+    except Exception as e:
+        return error_response(e)
+
+
+async def get_detail(request):
+    form = await request.post()
+    place = form.get('place')
+    session_id = form.get('session_id')
+    if not session_id:
+        return web.json_response({"error": "session_id is required"}, status=400)
+    try:
+        with trace("/get_detail"):
+            description, review_summary = await get_description_and_reviews_async(place, session_id)
+        return web.json_response({
+            "description": description,
+            "review_summary": review_summary
+        })
+    except SessionNotFound as e:
+        return web.json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        return error_response(e)
+
+
+async def get_itinerary(request):
+    data = json.loads(await request.read())
+    places = data.get('places')
+    print("PLACES: ", places)
+    options = {
+        "stay_times": data.get('stay_times'),
+        "end": data.get('end'),
+        "optimizer": data.get('optimizer', 'auto'),
+        "locations": data.get('locations'),
+    }
+    if wants_stream(request.query, data, accept=request.headers.get("Accept", "")):
+        async def run(emit):
+            with trace("/get_itinerary"), budget("/get_itinerary", ITINERARY_DEADLINE, ITINERARY_CHECKPOINTS):
+                return dict(await get_itinerary_sub_async(places, on_event=emit, **options), partial=is_partial())
+        return await sse_response_async(request, run)
+    try:
+        with trace("/get_itinerary"), budget("/get_itinerary", ITINERARY_DEADLINE, ITINERARY_CHECKPOINTS):
+            itinerary = dict(await get_itinerary_sub_async(places, **options), partial=is_partial())
+        return web.json_response(itinerary)
+    except Exception as e:
+        return error_response(e)
+
+
+async def plan_trip(request):
+    data = json.loads(await request.read())
+
+    async def run_trip(trip, emit=None):
+        print("TRIP PLACES: ", trip.get('places'))
+        options = {key: trip[key] for key in TRIP_OPTIONS if key in trip}
+        with trace("/plan_trip"), budget("/plan_trip", TRIP_DEADLINE, TRIP_CHECKPOINTS):
+            return dict(await get_trip_plan_async(trip.get('places'), on_event=emit, **options), partial=is_partial())
+
+    if "trips" not in data and wants_stream(request.query, data, accept=request.headers.get("Accept", "")):
+        return await sse_response_async(request, lambda emit: run_trip(data, emit))
+    try:
+        if "trips" in data:
+            # One after the other, so trips over the same places reuse the first one's matrix
+            return web.json_response({"trips": [await run_trip(trip) for trip in data["trips"]]})
+        return web.json_response(await run_trip(data))
+    except InvalidTrip as e:
+        return web.json_response({"error": str(e)}, status=400)
+    except Exception as e:
+        return error_response(e)
+
+
+async def on_cleanup(app):
+    await close_async_session()
+
+
+def create_app():
+    # Rejects oversized uploads before the form is parsed
+    app = web.Application(client_max_size=IMAGE_MAX_UPLOAD_BYTES + 1024 * 1024)
+    app.add_routes([
+        web.get("/test", test),
+        web.get("/metrics", metrics),
+        web.post("/get_ideas", get_ideas),
+        web.post("/get_detail", get_detail),
+        web.post("/get_itinerary", get_itinerary),
+        web.post("/plan_trip", plan_trip),
+    ])
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    web.run_app(app, host="127.0.0.1", port=int(os.getenv("PORT", "8080")))
@@ -0,0 +1,61 @@
+# Build and query time of every chunk index kind from 100 to 100k chunks,
+# with all place-name queries answered by one batched search. Indexes are
+# built per request, so build + batched query is the cost that matters.
+#
+#   python benchmarks/bench_chunk_index.py [dim]
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_index import ChunkIndex  # noqa: E402
+
+DIM = int(sys.argv[1]) if len(sys.argv) > 1 else 384
+SIZES = [100, 1000, 10000, 100000]
+KINDS = ["flat", "ivf", "hnsw"]
+NUM_QUERIES = 10  # Places per /get_ideas request
+TOP_K = 2
+
+
+def recall(chunk_index, vectors, queries, k):
+    # Agreement with exact search, for the approximate index kinds
+    exact = ChunkIndex.from_vectors([None] * len(vectors), vectors, kind="flat")
+    found = chunk_index.search(queries, k)
+    expected = exact.search(queries, k)
+    hits = sum(len({i for _, i in a} & {i for _, i in b}) for a, b in zip(found, expected))
+    return hits / (len(queries) * k)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"dim {DIM}, {NUM_QUERIES} queries, top {TOP_K}")
+    print(f"{'chunks':>7} {'kind':>5} {'build':>9} {'batched query':>14} {'one by one':>11} {'total':>10} "
+          f"{'recall':>7}")
+    for n in SIZES:
+        # Embeddings of scraped pages cluster by topic, so draw chunks around
+        # a few hundred topic centres rather than uniformly
+        centres = rng.standard_normal((200, DIM), dtype=np.float32)
+        vectors = centres[rng.integers(0, len(centres), n)] + 0.5 * rng.standard_normal((n, DIM), dtype=np.float32)
+        queries = vectors[rng.choice(n, NUM_QUERIES, replace=False)] + 0.1 * rng.standard_normal(
+            (NUM_QUERIES, DIM), dtype=np.float32)
+        for kind in KINDS:
+            start = time.perf_counter()
+            chunk_index = ChunkIndex.from_vectors([None] * n, vectors, kind=kind)
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            chunk_index.search(queries, TOP_K)
+            batched = time.perf_counter() - start
+            start = time.perf_counter()
+            for query in queries:
+                chunk_index.search(query[None, :], TOP_K)
+            single = time.perf_counter() - start
+            score = recall(chunk_index, vectors, queries, TOP_K) if chunk_index.kind != "flat" else 1.0
+            print(f"{n:>7} {chunk_index.kind:>5} {build * 1000:>7.1f}ms {batched * 1000:>12.2f}ms "
+                  f"{single * 1000:>9.2f}ms {(build + batched) * 1000:>8.1f}ms {score:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
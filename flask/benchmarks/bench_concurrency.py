@@ -0,0 +1,165 @@
+# Concurrency of the sync Flask server (main.py under gunicorn, as deployed
+# by app.yaml) against the aiohttp server (async_main.py) with every external
+# API replaced by fake_apis.py. Each server runs as a gunicorn subprocess and
+# gets the same load at increasing numbers of concurrent clients; reports
+# p50/p95 latency, throughput and errors per server, endpoint and level,
+# along with the hedged calls that timed out and the partial responses the
+# servers counted; any of those fails the run, since the fake APIs answer
+# well within every deadline.
+#
+#   python benchmarks/bench_concurrency.py --concurrency 1,8,32 --latency-scale 0.5
+#   python benchmarks/bench_concurrency.py --servers sync-threads,async --sync-threads 32
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_endpoints import MEDIAN_LATENCIES, PROMPTS, percentile  # noqa: E402
+from fake_apis import PLACE_NAMES, LatencyModel, start_fake_apis  # noqa: E402
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ITINERARY_PLACES = ["Union Station"] + [name for name, _ in PLACE_NAMES[:5]]
+DEADLINE_METRICS = {"timeouts": r'voya_hedged_calls_total\{[^}]*result="timed_out"\} (\S+)',
+                    "partial": r"voya_partial_responses_total\{[^}]*\} (\S+)"}
+
+
+def get_server_command(kind, port, args):
+    command = [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "--timeout", "300"]
+    if kind == "sync":
+        # app.yaml's entrypoint: one worker, one request at a time
+        return command + ["main:app"]
+    if kind == "sync-threads":
+        return command + ["--worker-class", "gthread", "--threads", str(args.sync_threads), "main:app"]
+    if kind == "async":
+        return command + ["--worker-class", "aiohttp.GunicornWebWorker", "async_main:app"]
+    raise ValueError(f"Unknown server: {kind}")
+
+
+def get_server_env(fake_env):
+    env = dict(os.environ, **fake_env)
+    for key in ["GROQ_API_KEY", "NEBIUS_API_KEY", "OPENAI_API_KEY", "BRAVE_API_KEY", "GOOGLE_API_KEY"]:
+        env[key] = "fake-key"
+    env["NEBIUS_REQUESTS_PER_MINUTE"] = "100000"
+    env["NEBIUS_TOKENS_PER_MINUTE"] = "100000000"
+    env["CACHE_DIR"] = tempfile.mkdtemp(prefix="voya_bench_")
+    env["TRACE_LOG_ENABLED"] = "0"
+    # Every request has to do the full work, so nothing is cached
+    for flag in ["DIRECTIONS_CACHE_ENABLED", "PAGE_CACHE_ENABLED", "EMBEDDING_CACHE_ENABLED", "PHOTO_CACHE_ENABLED",
+                 "RESULT_CACHE_ENABLED", "PLACES_CACHE_ENABLED"]:
+        env[flag] = "0"
+    return env
+
+
+def start_server(kind, port, args, fake_env):
+    process = subprocess.Popen(get_server_command(kind, port, args), cwd=FLASK_DIR, env=get_server_env(fake_env),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{kind} server exited with {process.returncode}")
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/test", timeout=5).read()
+            return process
+        except OSError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def get_deadline_errors(base_url):
+    metrics = urllib.request.urlopen(base_url + "/metrics", timeout=10).read().decode()
+    return {name: sum(float(value) for value in re.findall(pattern, metrics))
+            for name, pattern in DEADLINE_METRICS.items()}
+
+
+async def post(session, url, data=None, json_body=None):
+    start = time.perf_counter()
+    try:
+        async with session.post(url, data=data, json=json_body) as response:
+            await response.read()
+            ok = response.status == 200
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def run_level(base_url, endpoint, concurrency, total):
+    import aiohttp
+    semaphore = asyncio.Semaphore(concurrency)
+    timeout = aiohttp.ClientTimeout(total=600)
+
+    async def one(i):
+        async with semaphore:
+            if endpoint == "/get_ideas":
+                return await post(session, base_url + endpoint, data={"prompt": PROMPTS[i % len(PROMPTS)]})
+            return await post(session, base_url + endpoint, json_body={"places": ITINERARY_PLACES})
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(total)))
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", default="sync,async", help="Any of sync, sync-threads and async")
+    parser.add_argument("--concurrency", default="1,8,32", help="Concurrent clients per level")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="Requests per level (default: twice the concurrency)")
+    parser.add_argument("--endpoints", default="/get_ideas,/get_itinerary")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on the fake API latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--sync-threads", type=int, default=16, help="Threads of the sync-threads server")
+    parser.add_argument("--port", type=int, default=8190)
+    args = parser.parse_args()
+
+    latencies = {name: LatencyModel(median=median * args.latency_scale, error_rate=args.error_rate)
+                 for name, median in MEDIAN_LATENCIES.items()}
+    apis, fake_env = start_fake_apis(latencies)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    rows = []
+    for port, kind in enumerate(args.servers.split(","), start=args.port):
+        process = start_server(kind, port, args, fake_env)
+        try:
+            for endpoint in args.endpoints.split(","):
+                for concurrency in levels:
+                    total = args.requests or 2 * concurrency
+                    base_url = f"http://127.0.0.1:{port}"
+                    before = get_deadline_errors(base_url)
+                    results, elapsed = asyncio.run(run_level(base_url, endpoint, concurrency, total))
+                    after = get_deadline_errors(base_url)
+                    deadline_errors = {name: int(after[name] - before[name]) for name in after}
+                    times = [duration for duration, ok in results if ok]
+                    errors = sum(1 for _, ok in results if not ok)
+                    rows.append((kind, endpoint, concurrency, times, errors, deadline_errors, len(times) / elapsed))
+                    print(f"{kind} {endpoint} x{concurrency}: {elapsed:.1f}s", file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+    for api in apis.values():
+        api.stop()
+
+    print(f"\nlatency x{args.latency_scale}, error rate {args.error_rate}")
+    print(f"{'server':<14} {'endpoint':<16} {'clients':>7} {'n':>5} {'p50 s':>8} {'p95 s':>8} {'errors':>6} "
+          f"{'timeouts':>8} {'partial':>7} {'req/s':>8}")
+    failed = []
+    for kind, endpoint, concurrency, times, errors, deadline_errors, throughput in rows:
+        print(f"{kind:<14} {endpoint:<16} {concurrency:>7} {len(times):>5} {percentile(times, 50):>8.3f} "
+              f"{percentile(times, 95):>8.3f} {errors:>6} {deadline_errors['timeouts']:>8} "
+              f"{deadline_errors['partial']:>7} {throughput:>8.2f}")
+        if any(deadline_errors.values()):
+            failed.append(f"{kind} {endpoint} x{concurrency}")
+    if failed:
+        print(f"\nDeadline errors at: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Count LLM and embedding calls per request for the description stage: the
+# previous retrieve + RetrieverQueryEngine flow against description_service.
+# Both run against a local index with counting stand-ins for the models.
+#
+#   python benchmarks/bench_descriptions.py
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core import VectorStoreIndex  # noqa: E402
+from llama_index.core.embeddings import MockEmbedding  # noqa: E402
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata  # noqa: E402
+from llama_index.core.llms.callbacks import llm_completion_callback  # noqa: E402
+from llama_index.core.query_engine import RetrieverQueryEngine  # noqa: E402
+from llama_index.core.schema import TextNode  # noqa: E402
+
+import description_service  # noqa: E402
+from chunk_index import ChunkIndex  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+
+LLM_LATENCY = 0.05  # In seconds
+EMBED_LATENCY = 0.01  # In seconds
+PLACES = [f"Place {i}" for i in range(6)]
+COUNTS = {"llm": 0, "embedding": 0}
+
+
+class CountingEmbedding(MockEmbedding):
+    def _get_query_embedding(self, query):
+        COUNTS["embedding"] += 1
+        time.sleep(EMBED_LATENCY)
+        return super()._get_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        COUNTS["embedding"] += 1
+        time.sleep(EMBED_LATENCY)
+        return super()._get_text_embedding(text)
+
+
+class CountingLLM(CustomLLM):
+    @property
+    def metadata(self):
+        return LLMMetadata()
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        COUNTS["llm"] += 1
+        time.sleep(LLM_LATENCY)
+        if "json object mapping" in prompt:
+            names = re.findall(r'Spot: "(.+)"', prompt)
+            return CompletionResponse(text=json.dumps({name: "A short description." for name in names}))
+        return CompletionResponse(text="A description.")
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        yield self.complete(prompt)
+
+
+def previous_flow(index, llm):
+    retriever = index["vector_index"].as_retriever(similarity_top_k=2)
+    query_engine = RetrieverQueryEngine.from_args(retriever, llm=llm)
+    # /get_ideas: short description per place
+    for place in PLACES:
+        retriever.retrieve(place)
+        query_engine.query(f"Give descriptions for the spot: \"{place}\". Give a description in ten words.")
+    # /get_detail for every place
+    for place in PLACES:
+        retriever.retrieve(place)
+        query_engine.query(f"Give descriptions for the spot: \"{place}\". Give a description in one paragraph.")
+        query_engine.query(f"Give a summary of the reviews for the spot: {place}.")
+
+
+def service_flow(index, llm):
+    contexts = description_service.retrieve_contexts(index["chunk_index"], PLACES)
+    description_service.get_short_descriptions(llm, "prompt", "English", contexts)
+    for place in PLACES:
+        description_service.get_description_and_review_summary(
+            llm, "prompt", "English", place, contexts[place], ["Great place."])
+
+
+def measure(flow, index, llm):
+    COUNTS.update(llm=0, embedding=0)
+    start = time.perf_counter()
+    flow(index, llm)
+    return dict(COUNTS), time.perf_counter() - start
+
+
+def main():
+    description_service.nebius_limiter = RateLimiter(10 ** 6, 10 ** 9)
+    embed_model = CountingEmbedding(embed_dim=64)
+    nodes = [TextNode(text=f"{place} is a lovely spot. " * 20) for place in PLACES for _ in range(5)]
+    index = {
+        "vector_index": VectorStoreIndex(nodes, embed_model=embed_model),
+        "chunk_index": ChunkIndex.build([node.text for node in nodes], embed_model),
+    }
+    llm = CountingLLM()
+    print(f"{len(PLACES)} places, /get_detail called for each")
+    print(f"{'flow':>10} {'LLM calls':>10} {'embeddings':>11} {'time':>8}")
+    for name, flow in [("previous", previous_flow), ("service", service_flow)]:
+        counts, elapsed = measure(flow, index, llm)
+        print(f"{name:>10} {counts['llm']:>10} {counts['embedding']:>11} {elapsed:>7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+# End-to-end latency of /get_ideas, /get_detail and /get_itinerary with every
+# external API (Groq, Nebius, OpenAI embeddings, Brave, scraped pages, Places,
+# Directions) replaced by a local server from fake_apis.py. Reports
+# p50/p95/p99 per endpoint and per pipeline stage, plus throughput.
+#
+#   python benchmarks/bench_endpoints.py --clients 4 --requests 8
+#   python benchmarks/bench_endpoints.py --latency-scale 0.1 --error-rate 0.02
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_apis import LatencyModel, start_fake_apis  # noqa: E402
+
+MEDIAN_LATENCIES = {  # In seconds
+    "groq": 0.4,
+    "nebius": 0.8,
+    "openai": 0.15,
+    "brave": 0.3,
+    "pages": 0.2,
+    "places": 0.15,
+    "directions": 0.2,
+}
+STAGES = {
+    "helper": ["analyze_query", "scrape_websites", "build_vector_index", "extract_spots", "get_place_details",
+               "retrieve_contexts", "get_short_descriptions", "get_description_and_review_summary"],
+    "generate_itinerary": ["build_travel_matrix", "optimize_route", "get_stay_descriptions"],
+}
+PROMPTS = ["Local ramen spots in Toronto", "Hidden parks in Toronto", "Quiet museums in Toronto",
+           "Street art and markets in Toronto"]
+
+stage_times = {}
+stage_lock = threading.Lock()
+
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def timed(name, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with stage_lock:
+                stage_times.setdefault(name, []).append(time.perf_counter() - start)
+    return wrapper
+
+
+def instrument(modules):
+    for module_name, names in STAGES.items():
+        module = modules[module_name]
+        for name in names:
+            setattr(module, name, timed(name, getattr(module, name)))
+
+
+def configure_env(args, fake_env):
+    os.environ.update(fake_env)
+    for key in ["GROQ_API_KEY", "NEBIUS_API_KEY", "OPENAI_API_KEY", "BRAVE_API_KEY", "GOOGLE_API_KEY"]:
+        os.environ[key] = "fake-key"
+    os.environ["NEBIUS_REQUESTS_PER_MINUTE"] = "100000"
+    os.environ["NEBIUS_TOKENS_PER_MINUTE"] = "100000000"
+    os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="voya_bench_")
+    if not args.warm:
+        for flag in ["DIRECTIONS_CACHE_ENABLED", "PAGE_CACHE_ENABLED", "EMBEDDING_CACHE_ENABLED", "PHOTO_CACHE_ENABLED",
+                     "RESULT_CACHE_ENABLED", "PLACES_CACHE_ENABLED"]:
+            os.environ[flag] = "0"
+
+
+def run_concurrently(clients, jobs):
+    # jobs are zero-argument callables returning (ok, result)
+    results = []
+    start = time.perf_counter()
+
+    def run(job):
+        job_start = time.perf_counter()
+        ok, result = job()
+        return time.perf_counter() - job_start, ok, result
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(run, jobs))
+    return results, time.perf_counter() - start
+
+
+def format_row(name, times, errors=0, elapsed=None):
+    row = (f"{name:<36} {len(times):>5} {percentile(times, 50):>8.3f} {percentile(times, 95):>8.3f} "
+           f"{percentile(times, 99):>8.3f} {errors:>6}")
+    if elapsed:
+        row += f" {len(times) / elapsed:>8.2f}"
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=8, help="Requests per endpoint")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on the fake API latencies")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--warm", action="store_true", help="Keep the on-disk caches enabled")
+    args = parser.parse_args()
+
+    latencies = {name: LatencyModel(median=median * args.latency_scale, error_rate=args.error_rate)
+                 for name, median in MEDIAN_LATENCIES.items()}
+    apis, fake_env = start_fake_apis(latencies)
+    configure_env(args, fake_env)
+
+    import generate_itinerary  # noqa: E402
+    import helper  # noqa: E402
+    import main as server  # noqa: E402
+
+    instrument({"helper": helper, "generate_itinerary": generate_itinerary})
+    client = server.app.test_client()
+    endpoint_results = {}
+
+    def ideas_job(prompt):
+        def job():
+            response = client.post("/get_ideas", data={"prompt": prompt})
+            return response.status_code == 200, response.get_json()
+        return job
+
+    prompts = [PROMPTS[i % len(PROMPTS)] for i in range(args.requests)]
+    endpoint_results["/get_ideas"] = run_concurrently(args.clients, [ideas_job(p) for p in prompts])
+    ideas = [result for _, ok, result in endpoint_results["/get_ideas"][0] if ok and result["place_details"]]
+    if not ideas:
+        print("No successful /get_ideas responses; nothing to follow up on")
+        return
+
+    def detail_job(session_id, place):
+        def job():
+            response = client.post("/get_detail", data={"place": place, "session_id": session_id})
+            return response.status_code == 200, response.get_json()
+        return job
+
+    def itinerary_job(place_details):
+        places = [details["name"] for details in place_details.values()]
+        locations = [details["location"] for details in place_details.values()]
+        body = json.dumps({"places": ["Union Station"] + places[:5],
+                           "locations": [{"latitude": 43.645, "longitude": -79.38}] + locations[:5]})
+
+        def job():
+            response = client.post("/get_itinerary", data=body, content_type="application/json")
+            return response.status_code == 200, response.get_json()
+        return job
+
+    detail_jobs = []
+    for i in range(args.requests):
+        idea = ideas[i % len(ideas)]
+        names = list(idea["place_details"].keys())
+        detail_jobs.append(detail_job(idea["session_id"], names[i % len(names)]))
+    endpoint_results["/get_detail"] = run_concurrently(args.clients, detail_jobs)
+    itinerary_jobs = [itinerary_job(ideas[i % len(ideas)]["place_details"]) for i in range(args.requests)]
+    endpoint_results["/get_itinerary"] = run_concurrently(args.clients, itinerary_jobs)
+
+    header = f"{'':<36} {'n':>5} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'errors':>6}"
+    print(f"\n{args.clients} clients, {args.requests} requests per endpoint, "
+          f"latency x{args.latency_scale}, error rate {args.error_rate}")
+    print(header + f" {'req/s':>8}")
+    for endpoint, (results, elapsed) in endpoint_results.items():
+        times = [duration for duration, _, _ in results]
+        errors = sum(1 for _, ok, _ in results if not ok)
+        print(format_row(endpoint, times, errors, elapsed))
+    print("\nPipeline stages")
+    print(header)
+    for names in STAGES.values():
+        for name in names:
+            print(format_row(name, stage_times.get(name, [])))
+    print("\nFake APIs")
+    print(header)
+    for name, api in apis.items():
+        print(format_row(name, api.served, api.errors))
+    for api in apis.values():
+        api.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Compare Directions API calls, latency and plan quality of the k-nearest
+# haversine pre-filter against routing the full travel matrix. Calls and
+# latency are end to end: the matrix build plus the legs of the chosen order
+# that were only estimated, which get_leg routes while rendering. Every
+# simulated Directions call takes LATENCY seconds.
+#
+#   python benchmarks/bench_haversine_prefilter.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("DIRECTIONS_CACHE_ENABLED", "0")
+
+import travel_matrix  # noqa: E402
+from geo import DEFAULT_ESTIMATION_MODEL, haversine_matrix  # noqa: E402
+from route_optimizer import optimize_route, route_cost  # noqa: E402
+
+SIZES = [6, 10, 20, 30]
+K_VALUES = [0, 2, 3, 5]
+TRIALS = 5
+LATENCY = 0.02  # In seconds
+
+
+def synthetic_city(n, rng):
+    # Places scattered around downtown Toronto, with "true" transit times
+    # that follow distance but include line-dependent noise.
+    locations = [
+        {"latitude": 43.65 + rng.uniform(-0.08, 0.08), "longitude": -79.38 + rng.uniform(-0.12, 0.12)}
+        for _ in range(n)
+    ]
+    distances = haversine_matrix(locations)
+    true_times = [
+        [0 if i == j else int(300 + distances[i][j] / rng.uniform(3.5, 8.0)) for j in range(n)]
+        for i in range(n)
+    ]
+    return locations, true_times
+
+
+def main():
+    rng = random.Random(7)
+    model = DEFAULT_ESTIMATION_MODEL
+    print(f"estimation model: {model}")
+    print(f"{'stops':>5} {'k':>3} {'matrix calls':>13} {'leg calls':>10} {'total calls':>12} {'latency':>10} "
+          f"{'travel vs full':>15}")
+    calls = [0]
+    for n in SIZES:
+        # matrix calls, on-demand leg calls, seconds, travel time
+        results = {k: [0, 0, 0.0, 0] for k in K_VALUES}
+        for _ in range(TRIALS):
+            locations, true_times = synthetic_city(n, rng)
+            places = [f"place {i}" for i in range(n)]
+
+            def fake_dir_data(origin, destination, start_datetime, session=None):
+                calls[0] += 1
+                time.sleep(LATENCY)
+                i, j = places.index(origin), places.index(destination)
+                return {"overall_duration": true_times[i][j], "steps": []}
+
+            travel_matrix.get_dir_data = fake_dir_data
+            for k in K_VALUES:
+                start = time.perf_counter()
+                calls[0] = 0
+                matrix = travel_matrix.build_travel_matrix(
+                    places, 0, locations=locations, k_nearest=k, estimation_model=model
+                )
+                matrix_calls = calls[0]
+                order = optimize_route(matrix["durations"])["order"]
+                for i, j in zip(order, order[1:]):
+                    travel_matrix.get_leg(matrix, i, j)
+                results[k][0] += matrix_calls
+                results[k][1] += calls[0] - matrix_calls
+                results[k][2] += time.perf_counter() - start
+                results[k][3] += route_cost(true_times, order)
+        full_cost = results[0][3]
+        for k, (matrix_calls, leg_calls, seconds, cost) in results.items():
+            print(f"{n:>5} {k if k else 'all':>3} {matrix_calls / TRIALS:>13.0f} {leg_calls / TRIALS:>10.1f} "
+                  f"{(matrix_calls + leg_calls) / TRIALS:>12.1f} {seconds / TRIALS * 1000:>8.0f}ms "
+                  f"{cost / full_cost:>14.1%}")
+
+
+if __name__ == "__main__":
+    main()
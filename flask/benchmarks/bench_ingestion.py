@@ -0,0 +1,112 @@
+# Parsing time and chunk, embedding and extraction token counts for the
+# previous ingestion (BeautifulSoup get_text, then splitting every page twice)
+# against ingestion.py (main-content extraction, one chunking pass and
+# duplicate removal). The pages are synthetic travel guides wrapped in the
+# usual menus, cookie banners and footers, some of them syndicating the same
+# articles with small edits.
+#
+#   python benchmarks/bench_ingestion.py [pages]
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from langchain.text_splitter import RecursiveCharacterTextSplitter  # noqa: E402
+from llama_index.core.node_parser import LangchainNodeParser  # noqa: E402
+from llama_index.core.readers import StringIterableReader  # noqa: E402
+
+from embedding_cache import EMBED_BATCH_SIZE  # noqa: E402
+from ingestion import extract_main_text, get_extraction_tokens, ingest_pages  # noqa: E402
+
+NUM_PAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+USER_PROMPT = "Local ramen spots in Toronto"
+WORDS = ("broth noodles pork queue counter seating lunch dinner neighbourhood market street menu spicy miso "
+         "shoyu tonkotsu chashu egg scallion chef owner visit weekend crowded cozy downtown transit").split()
+BOILERPLATE = """
+<header class="site-header"><div class="logo">Travel Guide</div></header>
+<nav class="main-nav"><ul>{links}</ul></nav>
+<div id="cookie-consent">We use cookies to improve your experience. Accept all cookies or manage preferences.</div>
+<aside class="sidebar"><h3>Popular posts</h3><ul>{links}</ul></aside>
+<div class="newsletter-signup">Subscribe to our newsletter for weekly travel tips and deals.</div>
+<footer class="site-footer"><p>Copyright 2024 Travel Guide. All rights reserved.</p><ul>{links}</ul></footer>
+<script>window.dataLayer = window.dataLayer || []; function gtag(){{dataLayer.push(arguments);}}</script>
+"""
+
+
+def make_article(rng, n_paragraphs=12):
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(60, 120))).capitalize() + "."
+            for _ in range(n_paragraphs)]
+
+
+def edit(rng, paragraph):
+    # Syndicated copies change a word here and there
+    words = paragraph.split()
+    for _ in range(2):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return " ".join(words)
+
+
+def make_pages(n):
+    rng = random.Random(0)
+    syndicated = make_article(rng)
+    links = "".join(f"<li><a href='/p/{i}'>Top 10 things to do in city {i}</a></li>" for i in range(30))
+    pages = []
+    for i in range(n):
+        own = make_article(rng)
+        shared = [edit(rng, p) if i % 2 else p for p in syndicated] if i % 3 != 2 else []
+        body = "".join(f"<p>{p}</p>" for p in own + shared)
+        pages.append(f"<html><head><title>Guide {i}</title><style>body {{margin: 0}}</style></head><body>"
+                     f"{BOILERPLATE.format(links=links)}<main><article><h1>Ramen guide {i}</h1>{body}</article>"
+                     f"</main></body></html>")
+    return pages
+
+
+def previous_ingestion(pages):
+    # scraper.html_to_text and helper.chunk_contents before ingestion.py
+    contents = []
+    for page in pages:
+        text = BeautifulSoup(page.encode("utf-8"), "html.parser", from_encoding="utf-8").get_text()
+        contents.append("\n".join(line.strip() for line in text.splitlines() if line.strip()))
+    parse = time.perf_counter()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=32)
+    chunks_text = [splitter.split_text(content) for content in contents]
+    nodes = LangchainNodeParser(splitter).get_nodes_from_documents(StringIterableReader().load_data(texts=contents))
+    return chunks_text, [node.text for node in nodes], parse
+
+
+def main():
+    pages = make_pages(NUM_PAGES)
+    print(f"{NUM_PAGES} pages, {sum(len(page) for page in pages) / NUM_PAGES / 1024:.0f} KiB each")
+
+    start = time.perf_counter()
+    chunks_text, chunk_texts, parsed = previous_ingestion(pages)
+    previous = (parsed - start, time.perf_counter() - parsed)
+
+    start = time.perf_counter()
+    contents = [extract_main_text(page.encode("utf-8")) for page in pages]
+    parsed = time.perf_counter()
+    new_chunks_text, new_chunk_texts, report = ingest_pages(contents, USER_PROMPT)
+    current = (parsed - start, time.perf_counter() - parsed)
+
+    rows = [
+        ("parse ms", previous[0] * 1000, current[0] * 1000),
+        ("chunk + dedup ms", previous[1] * 1000, current[1] * 1000),
+        ("chunks embedded", len(chunk_texts), len(new_chunk_texts)),
+        ("embedding calls", math.ceil(len(chunk_texts) / EMBED_BATCH_SIZE),
+         math.ceil(len(new_chunk_texts) / EMBED_BATCH_SIZE)),
+        ("embedding tokens", sum(len(c) for c in chunk_texts) // 4, sum(len(c) for c in new_chunk_texts) // 4),
+        ("extraction tokens", get_extraction_tokens(USER_PROMPT, chunks_text),
+         get_extraction_tokens(USER_PROMPT, new_chunks_text)),
+    ]
+    print(f"\n{'':<18} {'previous':>10} {'ingestion':>10} {'change':>8}")
+    for name, before, after in rows:
+        print(f"{name:<18} {before:>10.0f} {after:>10.0f} {(after - before) / before:>+8.0%}")
+    print(f"\nduplicates dropped: {report['exact_duplicates']} exact, {report['near_duplicates']} near")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# Compare the route optimizers against the greedy planner on synthetic
+# travel-time matrices.
+#
+#   python benchmarks/bench_route_optimizer.py
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from route_optimizer import EXACT_MAX_STOPS, optimize_route, route_cost  # noqa: E402
+
+SIZES = [5, 8, 10, 12, 20, 30, 50]
+TRIALS = 5
+
+
+def synthetic_matrix(n, rng):
+    # Stops scattered over a 15 km square, 20 km/h average transit speed,
+    # plus asymmetric waiting time at the stop.
+    points = [(rng.uniform(0, 15000), rng.uniform(0, 15000)) for _ in range(n)]
+    durations = []
+    for i, (xi, yi) in enumerate(points):
+        row = []
+        for j, (xj, yj) in enumerate(points):
+            if i == j:
+                row.append(0)
+            else:
+                distance = ((xi - xj) ** 2 + (yi - yj) ** 2) ** 0.5
+                row.append(int(distance / 5.5 + rng.uniform(60, 600)))
+        durations.append(row)
+    return durations
+
+
+def run_method(durations, method, end):
+    start = time.perf_counter()
+    result = optimize_route(durations, end=end, method=method)
+    return route_cost(durations, result["order"]), time.perf_counter() - start
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'stops':>5} {'end':>5} {'method':>12} {'travel vs greedy':>17} {'runtime':>10}")
+    for n in SIZES:
+        for end_kind, end in (("open", None), ("fixed", n - 1), ("round", 0)):
+            methods = ["local_search"] + (["exact"] if n <= EXACT_MAX_STOPS else [])
+            totals = {method: [0.0, 0.0] for method in ["greedy"] + methods}
+            for _ in range(TRIALS):
+                durations = synthetic_matrix(n, rng)
+                for method in totals:
+                    cost, elapsed = run_method(durations, method, end)
+                    totals[method][0] += cost
+                    totals[method][1] += elapsed
+            greedy_cost = totals["greedy"][0]
+            for method, (cost, elapsed) in totals.items():
+                print(
+                    f"{n:>5} {end_kind:>5} {method:>12} {cost / greedy_cost:>16.1%} "
+                    f"{elapsed / TRIALS * 1000:>8.1f}ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# Measure cold start: time to import the Flask app and to serve the first
+# /test response, each in a fresh interpreter like a new App Engine instance.
+#
+#   python benchmarks/bench_startup.py [runs]
+import os
+import statistics
+import subprocess
+import sys
+import json
+
+FLASK_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+response = main.app.test_client().get("/test")
+assert response.status_code == 200
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_response": done - start}))
+"""
+
+
+def main():
+    env = dict(os.environ)
+    # The app must start without reaching any external API
+    for key in ["GROQ_API_KEY", "NEBIUS_API_KEY", "OPENAI_API_KEY", "BRAVE_API_KEY", "GOOGLE_API_KEY"]:
+        env.setdefault(key, "benchmark")
+    results = []
+    for _ in range(RUNS):
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD], cwd=FLASK_DIR, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    for key in ["import", "first_response"]:
+        values = [result[key] for result in results]
+        print(f"{key:>15}: median {statistics.median(values):.2f}s, min {min(values):.2f}s, max {max(values):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
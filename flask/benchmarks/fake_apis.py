@@ -0,0 +1,305 @@
+# Local stand-ins for every external API the Flask service calls, with
+# configurable latency and error rates. Payloads are shaped like the real
+# responses that helper.py and generate_itinerary.py parse.
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PLACE_NAMES = [
+    ("Kinton Ramen", "restaurant"),
+    ("Sansotei Ramen", "restaurant"),
+    ("Ramen Isshin", "restaurant"),
+    ("Kensington Market", "market"),
+    ("Allan Gardens Conservatory", "park"),
+    ("Aga Khan Museum", "museum"),
+    ("Evergreen Brick Works", "park"),
+    ("Bata Shoe Museum", "museum"),
+    ("Graffiti Alley", "street art"),
+    ("Tommy Thompson Park", "park"),
+    ("Cheese Boutique", "shop"),
+    ("Toronto Islands", "park"),
+]
+EMBEDDING_DIM = 1536
+
+
+class LatencyModel:
+    # Log-normal latency around a median, plus a probability of failing
+
+    def __init__(self, median=0.05, sigma=0.4, error_rate=0.0):
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    def sample(self, rng):
+        return self.median * math.exp(self.sigma * rng.gauss(0, 1))
+
+
+def _seeded(text):
+    return random.Random(hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+
+def _prompt_text(messages):
+    content = messages[-1]["content"]
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content
+
+
+def _chat_completion(model, content, prompt):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        },
+    }
+
+
+def groq_handler(method, path, query, body):
+    request = json.loads(body)
+    prompt = _prompt_text(request["messages"])
+    json_mode = request.get("response_format", {}).get("type") == "json_object"
+    if json_mode and "search_query" in prompt:
+        content = json.dumps({
+            "search_query": "Toronto local ramen restaurants",
+            "search_query_short": "Toronto local ramen",
+            "user_language": "English",
+            "language_code": "en",
+            "country_code": "CA",
+            "country_name": "Canada",
+        })
+    elif json_mode and "day_titles" in prompt:
+        plan = json.loads(re.search(r"(\{.*\})", prompt).group(1))
+        content = json.dumps({
+            "title": "A few days in Toronto",
+            "day_titles": {date: f"Toronto on {date}" for date in plan},
+            "descriptions": {place: f"{place} is worth the visit." for places in plan.values() for place in places},
+        })
+    elif json_mode and "descriptions" in prompt:
+        places = json.loads(re.search(r"(\[.*\])", prompt).group(1))
+        content = json.dumps({
+            "title": "Itinerary for a day trip to Toronto",
+            "descriptions": {place: f"{place} is worth the visit." for place in places},
+        })
+    elif "photo" in prompt:
+        content = "A steaming bowl of ramen with pork, egg and scallions."
+    else:
+        content = "Toronto local ramen restaurants"
+    return 200, _chat_completion(request["model"], content, prompt)
+
+
+def nebius_handler(method, path, query, body):
+    request = json.loads(body)
+    prompt = _prompt_text(request["messages"])
+    if "Extract at most 5 recommended travel spots" in prompt:
+        spots = _seeded(prompt).sample(PLACE_NAMES, 5)
+        content = repr(spots)
+    elif "json object mapping each spot name" in prompt:
+        names = re.findall(r'Spot: "(.+?)"', prompt)
+        content = json.dumps({name: f"Cozy local favourite, {name.split()[0]} style." for name in names})
+    elif "get only the name that are relevant" in prompt:
+        content = json.dumps(re.findall(r'"name": "(.+?)"', prompt))
+    else:
+        content = "A well-loved local spot with friendly staff and great food."
+    return 200, _chat_completion(request["model"], content, prompt)
+
+
+def openai_handler(method, path, query, body):
+    request = json.loads(body)
+    inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+    data = []
+    for i, text in enumerate(inputs):
+        rng = _seeded(str(text))
+        vector = [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIM)]
+        if request.get("encoding_format") == "base64":
+            embedding = base64.b64encode(struct.pack(f"{EMBEDDING_DIM}f", *vector)).decode()
+        else:
+            embedding = vector
+        data.append({"object": "embedding", "index": i, "embedding": embedding})
+    tokens = sum(len(str(text)) // 4 for text in inputs)
+    return 200, {"object": "list", "data": data, "model": request["model"],
+                 "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+
+def make_brave_handler(pages_base):
+    def brave_handler(method, path, query, body):
+        count = int(query.get("count", ["5"])[0])
+        return 200, {"web": {"results": [
+            {"title": f"Result {i}", "url": f"{pages_base}/page/{i}"} for i in range(count)
+        ]}}
+    return brave_handler
+
+
+def pages_handler(method, path, query, body):
+    rng = _seeded(path)
+    names = rng.sample(PLACE_NAMES, 6)
+    paragraphs = "".join(
+        f"<p>{name} is a {category} locals love. " + "Plenty to say about the food and the neighbourhood. " * 8 + "</p>"
+        for name, category in names
+    )
+    html = f"<html><head><title>Guide</title></head><body><nav>Home | About</nav>{paragraphs}<footer>(c)</footer></body></html>"
+    return 200, html.encode("utf-8")
+
+
+def places_handler(method, path, query, body):
+    if path.endswith("/media"):
+        return 200, {"name": path[len("/v1/"):-len("/media")], "photoUri": "https://example.invalid/photo.jpg"}
+    text_query = parse_qs(body.decode("utf-8")).get("textQuery", [""])[0] if body else ""
+    name = text_query.split(",")[0] or "Unknown place"
+    rng = _seeded(name)
+    place_id = hashlib.md5(name.encode()).hexdigest()[:16]
+    return 200, {"places": [{
+        "name": f"places/{place_id}",
+        "displayName": {"text": name},
+        "primaryTypeDisplayName": {"text": "Restaurant"},
+        "formattedAddress": f"{rng.randint(1, 999)} Queen St W, Toronto, ON, Canada",
+        "location": {"latitude": 43.65 + rng.uniform(-0.05, 0.05), "longitude": -79.38 + rng.uniform(-0.08, 0.08)},
+        "rating": round(rng.uniform(3.8, 4.9), 1),
+        "googleMapsUri": f"https://maps.google.com/?cid={place_id}",
+        "websiteUri": "https://example.invalid",
+        "reviews": [{"rating": rng.randint(3, 5), "text": {"text": f"Review {i} of {name}."}} for i in range(5)],
+        "photos": [{"name": f"places/{place_id}/photos/p{i}"} for i in range(3)],
+    }]}
+
+
+def directions_handler(method, path, query, body):
+    origin = query["origin"][0]
+    destination = query["destination"][0]
+    departure = int(query["departure_time"][0])
+    duration = _seeded(origin + destination).randint(900, 3600)
+    transit_step = {
+        "travel_mode": "TRANSIT",
+        "transit_details": {
+            "departure_stop": {"name": f"{origin} Station"},
+            "departure_time": {"value": departure + 300},
+            "arrival_stop": {"name": f"{destination} Station"},
+            "arrival_time": {"value": departure + duration - 300},
+            "line": {"name": "Line 1 Yonge-University", "vehicle": {"name": "Subway"}},
+        },
+    }
+    walking_step = {"travel_mode": "WALKING"}
+    return 200, {"status": "OK", "routes": [{"legs": [{
+        "duration": {"value": duration},
+        "steps": [walking_step, transit_step, walking_step],
+    }]}]}
+
+
+class FakeServer(ThreadingHTTPServer):
+    # Concurrency benchmarks open hundreds of connections at once
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on hedged and abandoned calls
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeAPI:
+    def __init__(self, name, handler, latency=None, seed=0):
+        self.name = name
+        self.handler = handler
+        self.latency = latency or LatencyModel()
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.served = []
+        self.errors = 0
+        self.server = None
+
+    def respond(self, method, raw_path, body):
+        parsed = urlparse(raw_path)
+        with self.lock:
+            delay = self.latency.sample(self.rng)
+            fail = self.rng.random() < self.latency.error_rate
+        time.sleep(delay)
+        with self.lock:
+            self.served.append(delay)
+            if fail:
+                self.errors += 1
+        if fail:
+            return 503, {"error": {"message": "fake outage"}}
+        return self.handler(method, parsed.path, parse_qs(parsed.query), body)
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload = api.respond(self.command, self.path, body)
+                if isinstance(payload, bytes):
+                    data, content_type = payload, "text/html; charset=utf-8"
+                else:
+                    data, content_type = json.dumps(payload).encode("utf-8"), "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = FakeServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def start_fake_apis(latencies=None, error_rate=0.0):
+    # Starts one server per API and returns them with the environment
+    # variables that point the service at them
+    latencies = latencies or {}
+
+    def latency(name, median):
+        return latencies.get(name) or LatencyModel(median=median, error_rate=error_rate)
+
+    pages = FakeAPI("pages", pages_handler, latency("pages", 0.2))
+    pages.start()
+    apis = {
+        "groq": FakeAPI("groq", groq_handler, latency("groq", 0.4)),
+        "nebius": FakeAPI("nebius", nebius_handler, latency("nebius", 0.8)),
+        "openai": FakeAPI("openai", openai_handler, latency("openai", 0.15)),
+        "brave": FakeAPI("brave", make_brave_handler(pages.base_url), latency("brave", 0.3)),
+        "places": FakeAPI("places", places_handler, latency("places", 0.15)),
+        "directions": FakeAPI("directions", directions_handler, latency("directions", 0.2)),
+        "pages": pages,
+    }
+    for api in apis.values():
+        if api.server is None:
+            api.start()
+    env = {
+        "GROQ_BASE_URL": apis["groq"].base_url,
+        "NEBIUS_API_BASE": apis["nebius"].base_url + "/v1/",
+        "OPENAI_API_BASE": apis["openai"].base_url + "/v1",
+        "BRAVE_API_BASE": apis["brave"].base_url,
+        "GOOGLE_PLACES_API_BASE": apis["places"].base_url,
+        "GOOGLE_MAPS_API_BASE": apis["directions"].base_url,
+    }
+    return apis, env
@@ -0,0 +1,121 @@
+import asyncio
+import os
+
+import faiss
+import numpy as np
+
+from tracing import count_call, span
+
+# Indexes are built per request and queried a handful of times, so build
+# plus query cost is what counts, and exact search wins it at every size
+# (see benchmarks/bench_chunk_index.py): training an inverted-file index or
+# building an HNSW graph costs more than the searches it saves. Both can
+# still be requested explicitly, or through CHUNK_INDEX_KIND, for long-lived
+# indexes.
+CHUNK_INDEX_KIND = os.getenv("CHUNK_INDEX_KIND", "flat")
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "32"))
+IVF_TRAIN_PER_LIST = 64
+
+
+def normalize(vectors):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def create_faiss_index(vectors, kind="auto"):
+    n, dim = vectors.shape
+    if kind == "auto":
+        kind = CHUNK_INDEX_KIND
+    if kind == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif kind == "ivf":
+        nlist = max(1, int(np.sqrt(n)))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        sample = vectors[np.random.default_rng(0).choice(n, min(n, nlist * IVF_TRAIN_PER_LIST), replace=False)]
+        index.train(sample)
+        index.nprobe = IVF_NPROBE
+    else:
+        raise ValueError(f"Unknown index kind: {kind}")
+    index.add(vectors)
+    return index, kind
+
+
+class ChunkIndex:
+    # Cosine-similarity search over chunk texts: vectors are L2-normalized so
+    # an inner-product index ranks by cosine similarity.
+
+    def __init__(self, texts, index, kind, embed_model=None):
+        self.texts = texts
+        self.index = index
+        self.kind = kind
+        self.embed_model = embed_model
+
+    @classmethod
+    def from_vectors(cls, texts, vectors, kind="auto", embed_model=None):
+        index, kind = create_faiss_index(normalize(vectors), kind)
+        return cls(texts, index, kind, embed_model)
+
+    @classmethod
+    def build(cls, texts, embed_model, kind="auto"):
+        # The embedding model splits the texts into large API batches itself
+        if not texts:
+            return cls([], None, "empty", embed_model)
+        with span("embedding"):
+            vectors = embed_model.get_text_embedding_batch(texts)
+            count_call("embeddings")
+        with span("index_build"):
+            return cls.from_vectors(texts, np.asarray(vectors, dtype=np.float32), kind, embed_model)
+
+    @classmethod
+    async def build_async(cls, texts, embed_model, kind="auto"):
+        if not texts:
+            return cls([], None, "empty", embed_model)
+        with span("embedding"):
+            vectors = await embed_model.aget_text_embedding_batch(texts)
+            count_call("embeddings")
+        with span("index_build"):
+            return await asyncio.to_thread(
+                cls.from_vectors, texts, np.asarray(vectors, dtype=np.float32), kind, embed_model)
+
+    @property
+    def nbytes(self):
+        return self.index.ntotal * self.index.d * 4 if self.index is not None else 0
+
+    def search(self, query_vectors, k):
+        # One matrix search for all queries; returns (scores, ids) per query
+        if self.index is None:
+            return [[] for _ in query_vectors]
+        scores, ids = self.index.search(normalize(query_vectors), min(k, self.index.ntotal))
+        return [
+            [(float(score), int(i)) for score, i in zip(row_scores, row_ids) if i != -1]
+            for row_scores, row_ids in zip(scores, ids)
+        ]
+
+    def retrieve(self, queries, k):
+        # Place names are short, so they go through the text embedding path
+        # in a single batch like the chunks did
+        if not queries:
+            return {}
+        with span("embedding"):
+            query_vectors = np.asarray(self.embed_model.get_text_embedding_batch(queries), dtype=np.float32)
+            count_call("embeddings")
+        return self._match(queries, query_vectors, k)
+
+    async def retrieve_async(self, queries, k):
+        if not queries:
+            return {}
+        with span("embedding"):
+            query_vectors = np.asarray(await self.embed_model.aget_text_embedding_batch(queries), dtype=np.float32)
+            count_call("embeddings")
+        return self._match(queries, query_vectors, k)
+
+    def _match(self, queries, query_vectors, k):
+        results = self.search(query_vectors, k)
+        return {query: [self.texts[i] for _, i in result] for query, result in zip(queries, results)}
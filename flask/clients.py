@@ -0,0 +1,83 @@
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from deadline import CALL_TIMEOUT
+
+load_dotenv()
+
+# Clients are created on first use instead of at import time, so a new
+# instance can answer requests before any client library or network call
+# has been paid for.
+NEBIUS_MODEL_NAME = "meta-llama/Meta-Llama-3.1-70B-Instruct"
+NEBIUS_API_BASE = os.getenv("NEBIUS_API_BASE", "https://api.studio.nebius.ai/v1/")
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-ada-002")
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "1") == "1"
+
+_instances = {}
+_lock = threading.RLock()
+
+
+def _lazy(name, factory):
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = factory()
+                _instances[name] = instance
+    return instance
+
+
+def _create_groq_client():
+    from groq import Groq
+    print('creating groq client')
+    return Groq(api_key=os.getenv("GROQ_API_KEY"))
+
+
+def _create_async_groq_client():
+    from groq import AsyncGroq
+    return AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
+
+
+def _create_nebius_llm():
+    from llama_index.core import Settings
+    from llama_index.llms.openai_like import OpenAILike
+    llm = OpenAILike(
+        model=NEBIUS_MODEL_NAME,
+        is_chat_model=True,
+        api_base=NEBIUS_API_BASE,
+        api_key=os.environ.get("NEBIUS_API_KEY"),
+        temperature=0,
+        timeout=CALL_TIMEOUT,
+    )
+    Settings.llm = llm
+    return llm
+
+
+def _create_embeddings():
+    from llama_index.core import Settings
+    from llama_index.embeddings.openai import OpenAIEmbedding
+    from embedding_cache import EMBED_BATCH_SIZE, CachedEmbedding
+    embeddings = OpenAIEmbedding(model=EMBEDDING_MODEL_NAME, embed_batch_size=EMBED_BATCH_SIZE)
+    if EMBEDDING_CACHE_ENABLED:
+        embeddings = CachedEmbedding(embeddings)
+    Settings.embed_model = embeddings
+    return embeddings
+
+
+def get_groq_client():
+    return _lazy("groq", _create_groq_client)
+
+
+def get_async_groq_client():
+    return _lazy("async_groq", _create_async_groq_client)
+
+
+def get_nebius_llm():
+    return _lazy("nebius", _create_nebius_llm)
+
+
+def get_embeddings():
+    return _lazy("embeddings", _create_embeddings)
@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from tracing import increment, propagate
+
+# Every request gets a time budget when it starts. External calls take their
+# timeout from what is left of it, and the stages of a pipeline stop waiting
+# at checkpoints along the way, so a slow stage still leaves time for the
+# ones after it; whatever was resolved by then is returned as a partial
+# result.
+load_dotenv()
+DEADLINE_ENABLED = os.getenv("DEADLINE_ENABLED", "1") == "1"
+IDEAS_DEADLINE = float(os.getenv("IDEAS_DEADLINE", "45"))  # In seconds
+ITINERARY_DEADLINE = float(os.getenv("ITINERARY_DEADLINE", "30"))  # In seconds
+TRIP_DEADLINE = float(os.getenv("TRIP_DEADLINE", "60"))  # In seconds
+# Longest any single external call may take, whatever the budget
+CALL_TIMEOUT = float(os.getenv("CALL_TIMEOUT", "30"))  # In seconds
+# Fraction of the budget by which each stage has to be done
+IDEAS_CHECKPOINTS = {"scraping": 0.35, "spot_extraction": 0.6, "places": 0.75, "descriptions": 0.9}
+ITINERARY_CHECKPOINTS = {"travel_matrix": 0.6}
+TRIP_CHECKPOINTS = {"travel_matrix": 0.6}
+
+# Calls to idempotent APIs that are still running after the given percentile
+# of that API's recent latencies get a second, identical request; the first
+# answer wins. HEDGE_DELAY is used until enough latencies were seen.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "1") == "1"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "1.0"))  # In seconds
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))  # In seconds
+# Threads that send the duplicates; first attempts run on threads of their own
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "64"))
+# Threads that wait out calls made through call_with_deadline; separate
+# from the hedge pool so neither can starve the other
+DEADLINE_MAX_WORKERS = int(os.getenv("DEADLINE_MAX_WORKERS", "64"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 500
+
+_current = contextvars.ContextVar("budget", default=None)
+_latencies = {}
+_lock = threading.Lock()
+_executors = {}
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Budget:
+    def __init__(self, seconds, checkpoints=None):
+        self.start = time.monotonic()
+        self.seconds = seconds
+        self.checkpoints = checkpoints or {}
+        self.partial = []
+        self.lock = threading.Lock()
+
+    def remaining(self, stage=None):
+        expires_at = self.start + self.seconds
+        if stage in self.checkpoints:
+            expires_at = min(expires_at, self.start + self.seconds * self.checkpoints[stage])
+        return max(0.0, expires_at - time.monotonic())
+
+
+@contextmanager
+def budget(endpoint, seconds, checkpoints=None):
+    request_budget = Budget(seconds, checkpoints) if DEADLINE_ENABLED and seconds > 0 else None
+    token = _current.set(request_budget)
+    try:
+        yield request_budget
+    finally:
+        _current.reset(token)
+        if request_budget is not None and request_budget.partial:
+            increment("voya_partial_responses_total", (("endpoint", endpoint),))
+
+
+def remaining(stage=None):
+    # Seconds left for the stage (or the request), None without a budget
+    request_budget = _current.get()
+    return None if request_budget is None else request_budget.remaining(stage)
+
+
+def call_timeout(cap=CALL_TIMEOUT):
+    left = remaining()
+    if left is None:
+        return cap
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(cap, left)
+
+
+def async_call_timeout(cap=CALL_TIMEOUT):
+    import aiohttp
+    return aiohttp.ClientTimeout(total=call_timeout(cap))
+
+
+def mark_partial(stage):
+    print(f"Deadline reached during {stage}, continuing with what is done")
+    request_budget = _current.get()
+    if request_budget is not None:
+        with request_budget.lock:
+            if stage in request_budget.partial:
+                return
+            request_budget.partial.append(stage)
+    increment("voya_deadline_cutoffs_total", (("stage", stage),))
+
+
+def is_partial():
+    request_budget = _current.get()
+    return request_budget is not None and bool(request_budget.partial)
+
+
+def _get_executor(name, max_workers):
+    executor = _executors.get(name)
+    if executor is None:
+        with _lock:
+            if name not in _executors:
+                _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+            executor = _executors[name]
+    return executor
+
+
+def call_with_deadline(stage, default, func, *args, **kwargs):
+    # func's result, or default when the stage runs out of time first. The
+    # abandoned call finishes in the background and its result is dropped.
+    left = remaining(stage)
+    if left is None:
+        return func(*args, **kwargs)
+    future = _get_executor("deadline", DEADLINE_MAX_WORKERS).submit(propagate(func), *args, **kwargs)
+    try:
+        return future.result(timeout=left)
+    except FutureTimeout:
+        mark_partial(stage)
+        return default
+
+
+async def call_with_deadline_async(stage, default, coroutine):
+    try:
+        return await asyncio.wait_for(coroutine, remaining(stage))
+    except asyncio.TimeoutError:
+        mark_partial(stage)
+        return default
+
+
+def get_hedge_delay(api):
+    with _lock:
+        samples = sorted(_latencies.get(api, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DELAY
+    return max(HEDGE_MIN_DELAY, samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE / 100))])
+
+
+def _record_latency(api, elapsed):
+    with _lock:
+        _latencies.setdefault(api, deque(maxlen=HEDGE_WINDOW)).append(elapsed)
+
+
+def _timed(api, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    _record_latency(api, time.perf_counter() - start)
+    return result
+
+
+def _start(func, *args, **kwargs):
+    # func on a thread of its own, so it starts at once however busy the pools are
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=propagate(run), daemon=True).start()
+    return future
+
+
+def hedged(api, func, *args, **kwargs):
+    # func(*args) for an idempotent API call, with a duplicate sent if the
+    # first attempt is slower than usual. Returns the first successful
+    # result, or raises the last error.
+    if not HEDGE_ENABLED:
+        return _timed(api, func, *args, **kwargs)
+    # Only duplicates go through the shared pool: one queued behind other
+    # requests' calls just goes out later, while the first attempt never
+    # waits, so a busy pool cannot make a fast API look like a timeout
+    first = _start(_timed, api, func, *args, **kwargs)
+    pending = {first}
+    try:
+        try:
+            return first.result(timeout=get_hedge_delay(api))
+        except FutureTimeout:
+            pass
+        increment("voya_hedged_calls_total", (("api", api), ("result", "fired")))
+        second = _get_executor("hedge", HEDGE_MAX_WORKERS).submit(propagate(_timed), api, func, *args, **kwargs)
+        pending.add(second)
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=call_timeout(), return_when=FIRST_COMPLETED)
+            if not done:
+                increment("voya_hedged_calls_total", (("api", api), ("result", "timed_out")))
+                raise DeadlineExceeded(f"{api} call timed out")
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        increment("voya_hedged_calls_total", (("api", api), ("result", "won")))
+                    return future.result()
+                error = future.exception()
+        raise error
+    finally:
+        # A duplicate still queued when the other attempt answered is never sent
+        for future in pending:
+            future.cancel()
+
+
+async def _timed_async(api, make_call):
+    start = time.perf_counter()
+    result = await make_call()
+    _record_latency(api, time.perf_counter() - start)
+    return result
+
+
+async def hedged_async(api, make_call):
+    # hedged for coroutines; make_call() starts one attempt. The losing
+    # attempt is cancelled.
+    if not HEDGE_ENABLED:
+        return await _timed_async(api, make_call)
+    first = asyncio.ensure_future(_timed_async(api, make_call))
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=get_hedge_delay(api))
+        if done:
+            return first.result()
+        increment("voya_hedged_calls_total", (("api", api), ("result", "fired")))
+        second = asyncio.ensure_future(_timed_async(api, make_call))
+        pending.add(second)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=call_timeout(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                increment("voya_hedged_calls_total", (("api", api), ("result", "timed_out")))
+                raise DeadlineExceeded(f"{api} call timed out")
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        increment("voya_hedged_calls_total", (("api", api), ("result", "won")))
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
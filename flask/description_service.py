@@ -0,0 +1,167 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import estimate_tokens, nebius_limiter
+from tracing import propagate, record_llm_call
+
+# Retrieved context is fetched once per place and then reused for the short
+# description, the long description and by /get_detail, and goes straight
+# into the LLM prompt instead of through a second RAG query.
+SIMILARITY_TOP_K = 2
+
+
+def complete(llm, prompt, limiter=None):
+    (limiter or nebius_limiter).acquire(estimate_tokens(prompt))
+    response = llm.complete(prompt)
+    record_llm_call("nebius", response)
+    return str(response).strip()
+
+
+async def complete_async(llm, prompt, limiter=None):
+    await (limiter or nebius_limiter).acquire_async(estimate_tokens(prompt))
+    response = await llm.acomplete(prompt)
+    record_llm_call("nebius", response)
+    return str(response).strip()
+
+
+def retrieve_contexts(chunk_index, names, top_k=SIMILARITY_TOP_K):
+    return chunk_index.retrieve(list(names), top_k)
+
+
+async def retrieve_contexts_async(chunk_index, names, top_k=SIMILARITY_TOP_K):
+    return await chunk_index.retrieve_async(list(names), top_k)
+
+
+def format_context(docs):
+    return f"\n{'-' * 100}\n".join([f"Document {i + 1}:\n\n" + d for i, d in enumerate(docs)])
+
+
+def get_short_description_prompt(user_prompt, user_language, contexts):
+    spots = "\n\n".join(
+        f"Spot: \"{name}\"\nContext:\n{format_context(docs)}" for name, docs in contexts.items()
+    )
+    return f"""
+        User prompt:
+        {user_prompt}
+
+        {spots}
+
+        Give a description in ten words for every spot above, using its context. Translate to the user's language if necessary: {user_language}.
+        Return only a json object mapping each spot name, exactly as written above, to its description.
+    """
+
+
+def get_single_short_description_prompt(user_prompt, user_language, name, docs):
+    return f"""
+            User prompt:
+            {user_prompt}
+
+            Context prompt:
+            {format_context(docs)}
+
+            Give descriptions for the spot: "{name}". Give a description in ten words. Translate to the user's language if necessary: {user_language}. Display only the description and nothing else.
+        """
+
+
+def get_single_short_description(llm, user_prompt, user_language, name, docs):
+    return complete(llm, get_single_short_description_prompt(user_prompt, user_language, name, docs))
+
+
+def parse_json_object(res_str):
+    res_str = res_str.replace("```json", "").replace("```", "").strip()
+    start, end = res_str.find("{"), res_str.rfind("}")
+    if start == -1 or end == -1:
+        return {}
+    try:
+        res = json.loads(res_str[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    return res if isinstance(res, dict) else {}
+
+
+def get_short_descriptions(llm, user_prompt, user_language, contexts):
+    # One call for the whole result set; spots missing from the answer get
+    # the single-spot prompt, run concurrently
+    if not contexts:
+        return {}
+    res = parse_json_object(complete(llm, get_short_description_prompt(user_prompt, user_language, contexts)))
+    descriptions, missing = get_batched_descriptions(res, contexts)
+    if missing:
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = {
+                name: executor.submit(propagate(get_single_short_description), llm, user_prompt, user_language, name,
+                                      contexts[name])
+                for name in missing
+            }
+            for name, future in futures.items():
+                descriptions[name] = future.result()
+    return descriptions
+
+
+async def get_short_descriptions_async(llm, user_prompt, user_language, contexts):
+    if not contexts:
+        return {}
+    res = parse_json_object(await complete_async(llm, get_short_description_prompt(user_prompt, user_language,
+                                                                                    contexts)))
+    descriptions, missing = get_batched_descriptions(res, contexts)
+    singles = await asyncio.gather(*[
+        complete_async(llm, get_single_short_description_prompt(user_prompt, user_language, name, contexts[name]))
+        for name in missing
+    ])
+    descriptions.update(zip(missing, singles))
+    return descriptions
+
+
+def get_batched_descriptions(res, contexts):
+    descriptions = {name: str(res[name]).strip() for name in contexts if res.get(name)}
+    missing = [name for name in contexts if name not in descriptions]
+    if missing:
+        print(f"Batched description missing {missing}, describing them one by one")
+    return descriptions, missing
+
+
+def get_long_description_prompt(user_prompt, user_language, name, docs):
+    return f"""
+        User prompt:
+        {user_prompt}
+
+        Context prompt:
+        {format_context(docs)}
+
+        Give descriptions for the spot: "{name}". Give a description in one paragraph. Translate to the user's language if necessary: {user_language}. Display only the description and nothing else.
+    """
+
+
+def get_long_description(llm, user_prompt, user_language, name, docs):
+    return complete(llm, get_long_description_prompt(user_prompt, user_language, name, docs))
+
+
+def get_review_summary_prompt(user_language, name, reviews):
+    review_text = "\n\n".join([r for r in reviews])
+    return f"""
+        Reviews:
+        {review_text}
+
+        Give a summary of the reviews for the spot: {name}. Translate to the user's language: {user_language}. Display ONLY the summary and nothing else. Don't say "here's the summary" or anything similar.
+    """
+
+
+def get_review_summary(llm, user_language, name, reviews):
+    return complete(llm, get_review_summary_prompt(user_language, name, reviews))
+
+
+def get_description_and_review_summary(llm, user_prompt, user_language, name, docs, reviews):
+    # The two calls are independent, so they run side by side
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        description = executor.submit(propagate(get_long_description), llm, user_prompt, user_language, name, docs)
+        review_summary = executor.submit(propagate(get_review_summary), llm, user_language, name, reviews)
+        return description.result(), review_summary.result()
+
+
+async def get_description_and_review_summary_async(llm, user_prompt, user_language, name, docs, reviews):
+    description, review_summary = await asyncio.gather(
+        complete_async(llm, get_long_description_prompt(user_prompt, user_language, name, docs)),
+        complete_async(llm, get_review_summary_prompt(user_language, name, reviews)),
+    )
+    return description, review_summary
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+
+from dotenv import load_dotenv
+
+from deadline import async_call_timeout, call_timeout, hedged, hedged_async
+from http_session import get_async_session, get_session
+from tracing import count_call
+from ttl_cache import TTLCache
+
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GOOGLE_MAPS_API_BASE = os.getenv("GOOGLE_MAPS_API_BASE", "https://maps.googleapis.com")
+DIRECTIONS_URL = f"{GOOGLE_MAPS_API_BASE}/maps/api/directions/json"
+
+# Routes departing within the same bucket share one cache entry.
+DIRECTIONS_CACHE_BUCKET = int(os.getenv("DIRECTIONS_CACHE_BUCKET", "900"))  # In seconds
+DIRECTIONS_CACHE_TTL = int(os.getenv("DIRECTIONS_CACHE_TTL", str(7 * 24 * 3600)))  # In seconds
+DIRECTIONS_CACHE_SIZE = int(os.getenv("DIRECTIONS_CACHE_SIZE", "4096"))
+DIRECTIONS_CACHE_ENABLED = os.getenv("DIRECTIONS_CACHE_ENABLED", "1") == "1"
+
+directions_cache = TTLCache(
+    "directions",
+    ttl=DIRECTIONS_CACHE_TTL,
+    max_entries=DIRECTIONS_CACHE_SIZE,
+    persistent=DIRECTIONS_CACHE_ENABLED,
+)
+
+
+def get_step_data(transit_step):
+    return {
+        "departure_stop": transit_step["transit_details"]["departure_stop"]["name"],
+        "departure_time": transit_step["transit_details"]["departure_time"]["value"],
+        "arrival_stop": transit_step["transit_details"]["arrival_stop"]["name"],
+        "arrival_time": transit_step["transit_details"]["arrival_time"]["value"],
+        "line_name": transit_step["transit_details"]["line"]["name"],
+        "vehicle_type": transit_step["transit_details"]["line"]["vehicle"]["name"],
+    }
+
+
+def get_directions_cache_key(origin, destination, start_datetime, mode):
+    bucket = int(start_datetime) // DIRECTIONS_CACHE_BUCKET * DIRECTIONS_CACHE_BUCKET
+    return json.dumps([origin.strip().lower(), destination.strip().lower(), mode, bucket])
+
+
+def get_dir_data(origin, destination, start_datetime, session=None, mode="transit"):
+    if not DIRECTIONS_CACHE_ENABLED:
+        return hedged("directions", fetch_dir_data, origin, destination, start_datetime, session, mode)
+    key = get_directions_cache_key(origin, destination, start_datetime, mode)
+    dir_data = directions_cache.get(key)
+    if dir_data is None:
+        dir_data = hedged("directions", fetch_dir_data, origin, destination, start_datetime, session, mode)
+        # Failed lookups are not cached so they are retried on the next request
+        if dir_data is not None:
+            directions_cache.set(key, dir_data)
+    return dir_data
+
+
+async def get_dir_data_async(origin, destination, start_datetime, mode="transit"):
+    def fetch():
+        return fetch_dir_data_async(origin, destination, start_datetime, mode)
+
+    if not DIRECTIONS_CACHE_ENABLED:
+        return await hedged_async("directions", fetch)
+    key = get_directions_cache_key(origin, destination, start_datetime, mode)
+    # The disk tier is SQLite; keep it off the event loop
+    dir_data = await asyncio.to_thread(directions_cache.get, key)
+    if dir_data is None:
+        dir_data = await hedged_async("directions", fetch)
+        if dir_data is not None:
+            await asyncio.to_thread(directions_cache.set, key, dir_data)
+    return dir_data
+
+
+def get_directions_params(origin, destination, start_datetime, mode):
+    return {
+        "origin": origin,
+        "destination": destination,
+        "departure_time": start_datetime,
+        "mode": mode,
+        "key": GOOGLE_API_KEY,
+    }
+
+
+def parse_dir_data(data, origin, destination):
+    count_call("directions", data["status"] in ("OK", "ZERO_RESULTS"))
+    if data["status"] == "OK":
+        leg = data["routes"][0]["legs"][0]
+        return {
+            "overall_duration": leg["duration"]["value"],
+            "steps": [step for step in leg["steps"] if step["travel_mode"] == "TRANSIT"]
+        }
+    else:
+        print(f"Error: {data['status']} for route {origin} -> {destination}")
+        print(json.dumps(data))
+        return None
+
+
+def fetch_dir_data(origin, destination, start_datetime, session=None, mode="transit"):
+    session = session or get_session()
+    response = session.get(DIRECTIONS_URL, params=get_directions_params(origin, destination, start_datetime, mode),
+                           timeout=call_timeout())
+    return parse_dir_data(response.json(), origin, destination)
+
+
+async def fetch_dir_data_async(origin, destination, start_datetime, mode="transit"):
+    params = get_directions_params(origin, destination, start_datetime, mode)
+    async with get_async_session().get(DIRECTIONS_URL, params=params, timeout=async_call_timeout()) as response:
+        data = await response.json(content_type=None)
+    return parse_dir_data(data, origin, destination)
+
+
+def get_travel_time(origin, destination, start_datetime):
+    dir_data = get_dir_data(origin, destination, start_datetime)
+    if dir_data is not None:
+        return dir_data["overall_duration"]
+    else:
+        return None
@@ -0,0 +1,196 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+from ttl_cache import CACHE_DIR
+
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(CACHE_DIR, "embeddings"))
+# Texts per embedding API request for cache misses (OpenAI accepts up to 2048)
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "512"))
+
+
+def chunk_hash(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # Content-addressed vectors for one embedding model. Vectors are appended
+    # to a float32 file that is read through a memory map; the index file
+    # lists "hash row" per line, with the row of the key's vector. Appends
+    # take a file lock so several workers can share the same cache.
+
+    def __init__(self, model_name, directory=EMBEDDING_CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.model_name = model_name
+        base = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name))
+        self.vectors_path = base + ".f32"
+        self.index_path = base + ".idx"
+        self.meta_path = base + ".json"
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.index_offset = 0
+        self.dim = None
+        self.vectors = None
+        self.stats = {"hits": 0, "misses": 0}
+        for path in (self.vectors_path, self.index_path):
+            open(path, "ab").close()
+        self._reload()
+
+    def _load_dim(self):
+        # Written once, by the first worker to store a vector
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        return self.dim
+
+    def _reload(self):
+        # Pick up rows appended since the last read, by us or another worker.
+        # The offset only moves past lines that were recorded (or are
+        # malformed), so nothing is skipped for good.
+        if self._load_dim() is None:
+            return
+        num_rows = self._count_rows()
+        with open(self.index_path, "rb") as f:
+            f.seek(self.index_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                parts = line.decode().split()
+                if len(parts) == 2 and parts[1].isdigit():
+                    if int(parts[1]) >= num_rows:
+                        # Vectors are written before their keys, so this one
+                        # is read again once its vector shows up
+                        break
+                    self.rows[parts[0]] = int(parts[1])
+                else:
+                    print(f"Skipping malformed embedding cache index line: {line!r}")
+                self.index_offset += len(line)
+        if self.rows and (self.vectors is None or len(self.vectors) < num_rows):
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(num_rows, self.dim))
+
+    def _count_rows(self):
+        # Complete vectors in the vectors file; a torn append leaves a partial one
+        if not self.dim:
+            return 0
+        return os.path.getsize(self.vectors_path) // (self.dim * 4)
+
+    def get_many(self, keys):
+        with self.lock:
+            if any(key not in self.rows for key in keys):
+                self._reload()
+            found = {}
+            for key in keys:
+                row = self.rows.get(key)
+                if row is not None:
+                    found[key] = self.vectors[row].tolist()
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(keys) - len(found)
+            return found
+
+    def put_many(self, items):
+        if not items:
+            return
+        with self.lock:
+            if self._load_dim() is None:
+                self.dim = len(items[0][1])
+                # Write then rename so other workers never read a partial file
+                tmp_path = f"{self.meta_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump({"model": self.model_name, "dim": self.dim}, f)
+                os.replace(tmp_path, self.meta_path)
+            with open(self.index_path, "ab") as index_file, open(self.vectors_path, "ab") as vectors_file:
+                fcntl.flock(index_file, fcntl.LOCK_EX)
+                try:
+                    self._reload()
+                    new_items = [(key, vector) for key, vector in dict(items).items() if key not in self.rows]
+                    if new_items:
+                        # Drop what is left of a torn append, then flush the
+                        # vectors before their keys so a key never points
+                        # past the end of the vectors file
+                        first_row = self._count_rows()
+                        vectors_file.truncate(first_row * self.dim * 4)
+                        vectors = np.asarray([vector for _, vector in new_items], dtype=np.float32)
+                        vectors_file.write(vectors.tobytes())
+                        vectors_file.flush()
+                        index_file.write("".join(f"{key} {first_row + k}\n"
+                                                 for k, (key, _) in enumerate(new_items)).encode())
+                        index_file.flush()
+                finally:
+                    fcntl.flock(index_file, fcntl.LOCK_UN)
+            self._reload()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.rows)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["bytes_stored"] = os.path.getsize(self.vectors_path) + os.path.getsize(self.index_path)
+        return stats
+
+
+class CachedEmbedding(BaseEmbedding):
+    # Wraps an embedding model so that chunks embedded before are read from
+    # the EmbeddingCache and only new chunks are sent to the API.
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner, cache=None, **kwargs):
+        super().__init__(model_name=inner.model_name, embed_batch_size=2048, **kwargs)
+        self._inner = inner
+        self._cache = cache or EmbeddingCache(inner.model_name)
+
+    @classmethod
+    def class_name(cls):
+        return "CachedEmbedding"
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def _get_query_embedding(self, query):
+        return self._inner.get_query_embedding(query)
+
+    async def _aget_query_embedding(self, query):
+        return await self._inner.aget_query_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts):
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            self._store(found, missing, self._inner.get_text_embedding_batch(list(missing.values())))
+        print(f"Embedded {len(missing)} new chunks, {len(texts) - len(missing)} from cache")
+        return [found[key] for key in keys]
+
+    async def _aget_text_embedding(self, text):
+        return (await self._aget_text_embeddings([text]))[0]
+
+    async def _aget_text_embeddings(self, texts):
+        # Cache reads and appends take a file lock; run them in a worker thread
+        keys, found, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            vectors = await self._inner.aget_text_embedding_batch(list(missing.values()))
+            await asyncio.to_thread(self._store, found, missing, vectors)
+        print(f"Embedded {len(missing)} new chunks, {len(texts) - len(missing)} from cache")
+        return [found[key] for key in keys]
+
+    def _lookup(self, texts):
+        keys = [chunk_hash(self.model_name, text) for text in texts]
+        found = self._cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        return keys, found, missing
+
+    def _store(self, found, missing, vectors):
+        new_items = list(zip(missing.keys(), vectors))
+        self._cache.put_many(new_items)
+        found.update(new_items)
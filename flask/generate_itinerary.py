@@ -1,8 +1,7 @@
 #%%
-import pytz
+import asyncio
 # import datetime
 from datetime import datetime
-import requests
 import time
 # import networkx as nx
 import os
@@ -10,14 +9,20 @@ import os
 # from networkx.algorithms.approximation import traveling_salesman_problem
 from dotenv import load_dotenv
 import json
-from groq import Groq
-import ast
+
+from clients import get_async_groq_client, get_groq_client
+from deadline import call_timeout, call_with_deadline, call_with_deadline_async
+from directions import get_step_data
+from route_optimizer import optimize_route
+from tracing import record_llm_call, span
+from travel_matrix import (MATRIX_MAX_WORKERS, build_travel_matrix, build_travel_matrix_async, format_matrix_report,
+                           get_leg, prefetch_legs_async)
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 #%%
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
 model_name = "llama-3.2-90b-vision-preview"
+DEFAULT_STAY_TIME = 2  # In hours
 #%%
 def pretty_json(json_data):
 
@@ -26,135 +31,200 @@ def pretty_json(json_data):
 
     return formatted_json
 #%%
-def get_step_data(transit_step):
+
+
+def format_entry(timestamp, description, transit):
     return {
-        "departure_stop": transit_step["transit_details"]["departure_stop"]["name"],
-        "departure_time": transit_step["transit_details"]["departure_time"]["value"],
-        "arrival_stop": transit_step["transit_details"]["arrival_stop"]["name"],
-        "arrival_time": transit_step["transit_details"]["arrival_time"]["value"],
-        "line_name": transit_step["transit_details"]["line"]["name"],
-        "vehicle_type": transit_step["transit_details"]["line"]["vehicle"]["name"],
+        "Timestamp": time.strftime("%H:%M", time.localtime(timestamp)),
+        "Description": description,
+        "transit": "True" if transit else "False",
     }
-#%%
-def get_dir_data(origin, destination, start_datetime):
-    url = (
-        f"https://maps.googleapis.com/maps/api/directions/json?"
-        f"origin={origin}&destination={destination}&departure_time={start_datetime}&mode=transit&key={GOOGLE_API_KEY}"
-    )
-    response = requests.get(url)
-    data = response.json()
-    steps = [step for step in data["routes"][0]["legs"][0]["steps"] if step["travel_mode"] == "TRANSIT"]
-    # print(pretty_json(data))
-    if data["status"] == "OK":
-        return {
-            # "overall_departure_time": data["routes"][0]["legs"][0]["departure_time"]["value"],
-            # "overall_arrival_time": data["routes"][0]["legs"][0]["arrival_time"]["value"],
-            "overall_duration": data["routes"][0]["legs"][0]["duration"]["value"],
-            "steps": steps
-        }
-        # return data['rows'][0]['elements'][0]["duration_in_traffic"]["value"]  # Travel time in seconds
-    else:
-        print(f"Error: {data['status']} for route {origin} -> {destination}")
-        print(response.text)
-        return None
-#%%
-def get_travel_time(origin, destination, start_datetime):
-    dir_data = get_dir_data(origin, destination, start_datetime)
-    if dir_data is not None:
-        return dir_data["overall_duration"]
-    else:
-        return None
-#%%
 
 
-def get_itinerary_sub(chosen_places):
-    # chosen_places = ['Toronto International Airport', 'CN Tower', 'Casa Loma', 'Hockey Hall of Fame', 'St. Lawrence Market', 'Royal Ontario Museum']
-    stay_times = [0, 2, 2, 2, 2, 2]  # In hours
-    toronto_tz = pytz.timezone('America/Toronto')
-    departure_str = "2024-11-26 09:00:00"
-    departure_timestamp = int(datetime.strptime(departure_str, "%Y-%m-%d %H:%M:%S").timestamp())
-    print(departure_timestamp)
-    #%%
-    places_dict = {i: place for i, place in enumerate(chosen_places)}
-    curr_i = 0
+def build_itinerary_entries(chosen_places, order, matrix, stay_times, departure_timestamp):
+    # Renders the planned route into itinerary entries. Returns the entries
+    # and, for every stay, the index of its entry and of its place.
+    entries = [format_entry(departure_timestamp, f"Depart from {chosen_places[order[0]]}", False)]
+    stays = []
     curr_time = departure_timestamp
-    res = ""
-    while len(places_dict) > 1:
-        del places_dict[curr_i]
-        min_value = float('inf')
-        next_place = None
-        chosen_data = None
-        for place in places_dict.values():
-            dir_data = get_dir_data(chosen_places[curr_i], place, curr_time)
-            t = dir_data["overall_duration"]
-            if t < min_value:
-                min_value = t
-                next_place = place
-                chosen_data = dir_data
+    for curr_i, next_i in zip(order, order[1:]):
+        leg = get_leg(matrix, curr_i, next_i)
         curr_time += stay_times[curr_i] * 3600
-        for step in chosen_data["steps"]:
+        for step in leg["steps"]:
             step_data = get_step_data(step)
-            res += f"\tFrom {step_data['departure_stop']} to {step_data['arrival_stop']} on {step_data['line_name']}\n"
-        time_needed = chosen_data["overall_duration"]
-        curr_time_formatted = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(curr_time))
-        res += f"From {chosen_places[curr_i]} to {next_place} departing at {curr_time_formatted}\n"
-        curr_time += time_needed
-        curr_i = chosen_places.index(next_place)
-        res += f"Staying at {chosen_places[curr_i]} for {stay_times[curr_i]} hours\n"
-    print(res)
-    #%%
-    itinerary_prompt = f"""
-    Here's an example of an itinerary:
-    Itenerary for a day trip to Hong Kong on 2024-11-26
-    09:00 - Depart from Hong Kong International Airport
-        09:09 - Take the Airport Express From Airport to Tsing Yi Station
-        09:24 - Take Bus 41 From Tsing Yi Square to Kowloon Station
-    10:24 - Arrived at Elements shopping mall. Stay for 2 hours. You can do a lot here, including ...
-        12:24 - Walk to M+ Museum
-    12:30 - Arrive at M+ Museum. Stay for 2 hours. You can see the latest exhibitions and ...
-    etc.
-    
-    Here's the information needed for your itinerary: 
-    {res}
-
-    Make sure you include every single detail in the information provided, including every transit to take from the first to last stop, departure, arrival stops and departure time for each transit. For the timestamp, only include hour and minute. Create an itinerary with this information. For each attraction the user will stay for some time, include a one to two line description about the attraction. Only indent if the user walks or takes a transit."""
-    #%%
-    response = client.chat.completions.create(
-        model=model_name,
-        messages=[{"role": "user",
-                   "content": itinerary_prompt},],
-        temperature=0,
-    )
-    itineraray_res = response.choices[0].message.content
-    print(itineraray_res)
-    #%%
-    format_prompt = f"""
-    Here's the itinerary:
-    {itineraray_res}
-    
-    Format the itinerary into a json object with "itinerary" as the top key and the value as a list of dictionaries. Apart from "itinerary", the top key should also include "title", ie the first line. Each dictionary should have the following keys: "Timestamp", "Description" and "transit". Hint: the '-' in each line separates timestamp and description. The transit key is a "True" or "False" value indicating whether the user is taking a transit or not. If there is an indentation on that line, transit should be "True" otherwise "False". The timestamp should be in the format HH:MM. The description should be a string. The itinerary should be in chronological order.       
-    Return only a json object          
+            # Legs are routed for the matrix departure time, not for the time
+            # the traveller actually leaves. Each step keeps its offset into
+            # the leg and is moved to the planned departure, so lines and
+            # durations are those of the matrix departure and can be off for
+            # services that change over the day. Routing each used leg at its
+            # real time would take one Directions call per leg, one after the
+            # other, since every departure depends on the leg before it.
+            step_time = max(curr_time, curr_time + step_data["departure_time"] - matrix["departure_timestamp"])
+            entries.append(format_entry(
+                step_time,
+                f"Take {step_data['line_name']} from {step_data['departure_stop']} to {step_data['arrival_stop']}",
+                True,
+            ))
+        curr_time += leg["overall_duration"]
+        if next_i == order[0]:
+            # Round trips end back at the start, which is not a stay
+            entries.append(format_entry(curr_time, f"Return to {chosen_places[next_i]}.", False))
+            continue
+        stays.append((len(entries), next_i))
+        entries.append(format_entry(
+            curr_time, f"Arrive at {chosen_places[next_i]}. Stay for {stay_times[next_i]:g} hours.", False))
+    return entries, stays
+
+
+def get_stay_description_prompt(places, date_str):
+    return f"""
+    A traveller is visiting these attractions on {date_str}:
+    {json.dumps(places, ensure_ascii=False)}
+
+    Return a json object with two keys: "title", a one line title for the day trip such as "Itinerary for a day trip to Hong Kong on 2024-11-26", and "descriptions", an object mapping each attraction name, exactly as written above, to a one to two line description of the attraction.
     """
-    #%%
-    response = client.chat.completions.create(
-        model=model_name,
-        messages=[{"role": "user",
-                   "content": format_prompt},],
-        temperature=0,
-    )
-    format_res = response.choices[0].message.content
-    print(format_res)
-    print('\n---\n')
-    format_res = format_res.replace("```json",  "")
-    format_res = format_res.replace("```", "")
-    format_res = format_res.strip()
-    print(format_res)
-
-    output = ast.literal_eval(format_res)
-    print(output)
+
+
+def parse_stay_descriptions(response):
+    record_llm_call("groq", response)
+    print(response.usage)
+    res = json.loads(response.choices[0].message.content)
+    return res if isinstance(res, dict) else {}
+
+
+def complete_json(prompt):
+    # The only kind of LLM call of the itinerary: a JSON object for prompt.
+    # Any failure returns an empty object and leaves the entries as they are.
+    try:
+        response = get_groq_client().chat.completions.create(
+            model=model_name,
+            messages=[{"role": "user", "content": prompt},],
+            temperature=0,
+            response_format={"type": "json_object"},
+            timeout=call_timeout(),
+        )
+        return parse_stay_descriptions(response)
+    except Exception as e:
+        print(f"Stay descriptions failed: {e!r}")
+        return {}
+
+
+async def complete_json_async(prompt):
+    try:
+        response = await get_async_groq_client().chat.completions.create(
+            model=model_name,
+            messages=[{"role": "user", "content": prompt},],
+            temperature=0,
+            response_format={"type": "json_object"},
+            timeout=call_timeout(),
+        )
+        return parse_stay_descriptions(response)
+    except Exception as e:
+        print(f"Stay descriptions failed: {e!r}")
+        return {}
+
+
+def get_stay_descriptions(places, date_str):
+    # A title plus a short description per attraction
+    return complete_json(get_stay_description_prompt(places, date_str))
+
+
+async def get_stay_descriptions_async(places, date_str):
+    return await complete_json_async(get_stay_description_prompt(places, date_str))
+
+
+def get_stay_times(chosen_places, stay_times):
+    if stay_times is None:
+        stay_times = [0] + [DEFAULT_STAY_TIME] * (len(chosen_places) - 1)  # In hours
+    if len(stay_times) != len(chosen_places):
+        raise ValueError("stay_times must have one entry per place")
+    return stay_times
+
+
+def get_departure():
+    departure_str = "2024-11-26 09:00:00"
+    departure_timestamp = int(datetime.strptime(departure_str, "%Y-%m-%d %H:%M:%S").timestamp())
+    print(departure_timestamp)
+    return departure_str, departure_timestamp
+
+
+def plan_route(matrix, stay_times, end, optimizer):
+    print(format_matrix_report(matrix))
+    with span("route_optimization"):
+        route = optimize_route(matrix["durations"], stay_times, end=end, method=optimizer)
+    print(f"Route ({route['method']}): {route['order']}, travel time {route['travel_time']}s")
+    if not route["reachable"]:
+        raise ValueError("No transit route found between some of the chosen places")
+    return route["order"]
+
+
+def render_itinerary(chosen_places, order, matrix, stay_times, departure_str, on_event):
+    entries, stays = build_itinerary_entries(chosen_places, order, matrix, stay_times, matrix["departure_timestamp"])
+    date_str = departure_str.split(" ")[0]
+    output = {"title": f"Itinerary for a day trip on {date_str}", "itinerary": entries}
+    if on_event is not None:
+        on_event("title", {"title": output["title"]})
+        for entry in entries:
+            on_event("entry", entry)
+    stay_places = list(dict.fromkeys(chosen_places[i] for _, i in stays))
+    return output, stays, stay_places, date_str
+
+
+def apply_stay_descriptions(output, stays, chosen_places, res, on_event):
+    entries = output["itinerary"]
+    descriptions = res.get("descriptions") if isinstance(res.get("descriptions"), dict) else {}
+    if isinstance(res.get("title"), str) and res["title"].strip():
+        output["title"] = res["title"].strip()
+    for entry_i, place_i in stays:
+        description = descriptions.get(chosen_places[place_i])
+        if isinstance(description, str) and description.strip():
+            entries[entry_i]["Description"] += " " + description.strip()
+    if on_event is not None:
+        on_event("descriptions", {"title": output["title"], "descriptions": descriptions})
+    print(pretty_json(output))
     return output
 
 
+def get_itinerary_sub(chosen_places, stay_times=None, end=None, optimizer="auto", max_workers=MATRIX_MAX_WORKERS,
+                      locations=None, on_event=None):
+    # chosen_places = ['Toronto International Airport', 'CN Tower', 'Casa Loma', 'Hockey Hall of Fame', 'St. Lawrence Market', 'Royal Ontario Museum']
+    # The first place is the starting point; end optionally fixes the index of the last stop, and end=0
+    # plans a round trip back to it
+    # locations (Places API "location" dicts) let the matrix skip routing distant pairs
+    stay_times = get_stay_times(chosen_places, stay_times)
+    departure_str, departure_timestamp = get_departure()
+    #%%
+    with span("travel_matrix"):
+        matrix = build_travel_matrix(chosen_places, departure_timestamp, max_workers=max_workers, locations=locations,
+                                     round_trip=end == 0)
+    order = plan_route(matrix, stay_times, end, optimizer)
+    output, stays, stay_places, date_str = render_itinerary(chosen_places, order, matrix, stay_times, departure_str,
+                                                            on_event)
+    #%%
+    with span("stay_descriptions"):
+        res = call_with_deadline("stay_descriptions", {}, get_stay_descriptions, stay_places, date_str)
+    return apply_stay_descriptions(output, stays, chosen_places, res, on_event)
+
+
+async def get_itinerary_sub_async(chosen_places, stay_times=None, end=None, optimizer="auto",
+                                  max_workers=MATRIX_MAX_WORKERS, locations=None, on_event=None):
+    # Same as get_itinerary_sub on the event loop. The optimizer is CPU bound
+    # and runs on a worker thread; the legs it picked that were only
+    # estimated are routed before rendering.
+    stay_times = get_stay_times(chosen_places, stay_times)
+    departure_str, departure_timestamp = get_departure()
+    with span("travel_matrix"):
+        matrix = await build_travel_matrix_async(chosen_places, departure_timestamp, max_workers=max_workers,
+                                                 locations=locations, round_trip=end == 0)
+    order = await asyncio.to_thread(plan_route, matrix, stay_times, end, optimizer)
+    await prefetch_legs_async(matrix, order)
+    output, stays, stay_places, date_str = render_itinerary(chosen_places, order, matrix, stay_times, departure_str,
+                                                            on_event)
+    with span("stay_descriptions"):
+        res = await call_with_deadline_async("stay_descriptions", {}, get_stay_descriptions_async(stay_places, date_str))
+    return apply_stay_descriptions(output, stays, chosen_places, res, on_event)
+
+
 if __name__ == '__main__':
     chosen_places = ['Toronto International Airport', 'CN Tower', 'Casa Loma', 'Hockey Hall of Fame', 'St. Lawrence Market', 'Royal Ontario Museum']
     res = get_itinerary_sub(chosen_places)
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+
+EARTH_RADIUS = 6371000  # In metres
+
+# Straight-line travel time estimates: time = overhead + distance * detour / speed.
+# Speeds are in metres per second, overheads in seconds.
+ESTIMATION_MODELS = {
+    "transit": {"speed": 5.5, "detour": 1.3, "overhead": 600},
+    "walking": {"speed": 1.3, "detour": 1.25, "overhead": 0},
+    "driving": {"speed": 8.0, "detour": 1.4, "overhead": 120},
+}
+DEFAULT_ESTIMATION_MODEL = os.getenv("ESTIMATION_MODEL", "transit")
+
+
+def get_lat_lng(location):
+    # Accepts the Places API shape ({"latitude", "longitude"}) as well as
+    # the {"lat", "lng"} shape used by the Directions API and the frontend.
+    if "latitude" in location:
+        return location["latitude"], location["longitude"]
+    return location["lat"], location["lng"]
+
+
+def haversine_matrix(locations):
+    coords = np.radians(np.array([get_lat_lng(location) for location in locations], dtype=np.float64))
+    lat = coords[:, 0][:, None]
+    lng = coords[:, 1][:, None]
+    dlat = lat.T - lat
+    dlng = lng.T - lng
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(lat.T) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def estimate_travel_times(distances, model=DEFAULT_ESTIMATION_MODEL):
+    if isinstance(model, str):
+        model = ESTIMATION_MODELS[model]
+    estimates = model["overhead"] + distances * model["detour"] / model["speed"]
+    np.fill_diagonal(estimates, 0)
+    return estimates
+
+
+def k_nearest_pairs(distances, k, start=0):
+    # Origin -> destination legs for each place's k nearest neighbours,
+    # skipping legs that lead back to the starting point (if any).
+    masked = distances.astype(np.float64, copy=True)
+    np.fill_diagonal(masked, np.inf)
+    if start is not None:
+        masked[:, start] = np.inf
+    n = len(distances)
+    k = min(k, n - 1)
+    if k <= 0:
+        return []
+    nearest = np.argsort(masked, axis=1)[:, :k]
+    return [(i, int(j)) for i in range(n) for j in nearest[i] if np.isfinite(masked[i, j])]
+
+
+def project_locations(locations):
+    # Equirectangular projection to metres around the mean latitude; close
+    # enough for the extent of a city
+    coords = np.radians(np.array([get_lat_lng(location) for location in locations], dtype=np.float64))
+    lat = coords[:, 0]
+    lng = coords[:, 1]
+    return np.stack([lng * np.cos(lat.mean()), lat], axis=1) * EARTH_RADIUS
+
+
+def cluster_locations(locations, k, weights=None, capacity=None, iterations=20):
+    # Balanced k-means: groups the locations into k clusters of nearby
+    # places. With weights and a capacity, no cluster holds more than
+    # capacity worth of weight; places that fit in no cluster get -1.
+    # Deterministic, so the same places are always split the same way.
+    points = project_locations(locations)
+    n = len(points)
+    k = max(1, min(k, n))
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+    # Farthest-point initialisation, starting from the place farthest from the middle
+    centroids = [points[np.argmax(np.linalg.norm(points - points.mean(axis=0), axis=1))]]
+    while len(centroids) < k:
+        distances = np.min([np.linalg.norm(points - c, axis=1) for c in centroids], axis=0)
+        centroids.append(points[np.argmax(distances)])
+    centroids = np.array(centroids)
+    labels = None
+    for _ in range(iterations):
+        distances = np.linalg.norm(points[:, None, :] - centroids[None, :, :], axis=2)
+        new_labels = np.full(n, -1)
+        if capacity is None:
+            new_labels = np.argmin(distances, axis=1)
+        else:
+            # Places with the most to lose from not getting their nearest
+            # cluster are placed first
+            ranked = np.sort(distances, axis=1)
+            regret = ranked[:, 1] - ranked[:, 0] if k > 1 else np.zeros(n)
+            loads = np.zeros(k)
+            for i in np.argsort(-regret, kind="stable"):
+                for c in np.argsort(distances[i], kind="stable"):
+                    if loads[c] + weights[i] <= capacity:
+                        new_labels[i] = c
+                        loads[c] += weights[i]
+                        break
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            if np.any(labels == c):
+                centroids[c] = points[labels == c].mean(axis=0)
+    return [int(label) for label in labels]
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared, pooled HTTP session so repeated calls to the same API host reuse
+# keep-alive connections instead of paying a TLS handshake every time.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+# The async server keeps many requests in flight on one event loop, so its
+# connection pool is much larger
+HTTP_ASYNC_POOL_SIZE = int(os.getenv("HTTP_ASYNC_POOL_SIZE", "256"))
+
+_session = None
+_session_lock = threading.Lock()
+_async_sessions = {}
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def get_async_session():
+    # aiohttp sessions belong to the event loop they were created on
+    import aiohttp
+    loop = asyncio.get_running_loop()
+    session = _async_sessions.get(loop)
+    if session is None or session.closed:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=HTTP_ASYNC_POOL_SIZE))
+        _async_sessions[loop] = session
+    return session
+
+
+async def close_async_session():
+    session = _async_sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
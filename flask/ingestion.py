@@ -0,0 +1,239 @@
+import hashlib
+import math
+import os
+import re
+import time
+import zlib
+from html.parser import HTMLParser
+
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from embedding_cache import EMBED_BATCH_SIZE
+from rate_limiter import estimate_tokens
+from spot_extraction import get_spot_prompt
+from tracing import increment, span
+
+# Everything between the scraped HTML and the chunks that get embedded and
+# sent to spot extraction: main-content extraction, a single chunking pass
+# and removal of chunks that repeat, verbatim or nearly, across pages.
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "32"))
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") == "1"
+# Estimated Jaccard similarity of word shingles above which a chunk counts
+# as a near duplicate of an earlier one
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+DEDUP_SHINGLE_WORDS = int(os.getenv("DEDUP_SHINGLE_WORDS", "5"))
+# MinHash signature of DEDUP_BANDS * DEDUP_ROWS hashes; chunks sharing a
+# band are candidates, which catches pairs down to about
+# (1 / DEDUP_BANDS) ** (1 / DEDUP_ROWS) similarity
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "16"))
+DEDUP_ROWS = int(os.getenv("DEDUP_ROWS", "4"))
+# Text inside <main> or <article> replaces the whole page when it has at
+# least this share of the page's text
+MAIN_CONTENT_MIN_SHARE = float(os.getenv("MAIN_CONTENT_MIN_SHARE", "0.2"))
+
+# Subtrees that never hold the content of a page
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "iframe", "canvas", "form", "button", "select",
+                "nav", "header", "footer", "aside", "head"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd", "table", "tr", "td", "th",
+              "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "br", "hr", "figcaption", "address"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track",
+             "wbr"}
+MAIN_TAGS = {"main", "article"}
+# Never dropped for their id or class, which often describe the whole layout
+STRUCTURAL_TAGS = {"html", "body", "main", "article"}
+# id, class or role values of menus, cookie banners, share bars and the like
+BOILERPLATE_PATTERN = re.compile(
+    r"(^|[\s_-])(nav|navbar|menu|breadcrumbs?|cookies?|consent|gdpr|banner|footer|sidebar|share|social|"
+    r"newsletter|subscribe|signup|popup|modal|advert|ads?|promo|related|comments?)([\s_-]|$)", re.IGNORECASE)
+BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search", "dialog", "alertdialog"}
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.default_rng(0)
+_hash_a = _rng.integers(1, _MERSENNE_PRIME, DEDUP_BANDS * DEDUP_ROWS, dtype=np.uint64)
+_hash_b = _rng.integers(0, _MERSENNE_PRIME, DEDUP_BANDS * DEDUP_ROWS, dtype=np.uint64)
+_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+class MainTextParser(HTMLParser):
+    # Streams through the page once without building a tree, dropping
+    # boilerplate subtrees and keeping the text inside <main>/<article>
+    # apart from the rest.
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []  # (tag, skipped, main) of every open element
+        self.skipped = 0
+        self.main = 0
+        self.text = []
+        self.main_text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._newline()
+        if tag in VOID_TAGS:
+            return
+        if tag in SKIPPED_TAGS:
+            # An article's own header holds its title
+            skipped = not (tag == "header" and self.main)
+        else:
+            skipped = tag not in STRUCTURAL_TAGS and self._is_boilerplate(attrs)
+        main = tag in MAIN_TAGS
+        self.stack.append((tag, skipped, main))
+        self.skipped += skipped
+        self.main += main
+
+    def handle_endtag(self, tag):
+        if tag in BLOCK_TAGS:
+            self._newline()
+        # Unclosed elements inside tag are closed with it; stray end tags are ignored
+        for k in range(len(self.stack) - 1, -1, -1):
+            if self.stack[k][0] == tag:
+                for _, skipped, main in self.stack[k:]:
+                    self.skipped -= skipped
+                    self.main -= main
+                del self.stack[k:]
+                return
+
+    def handle_data(self, data):
+        if self.skipped:
+            return
+        self.text.append(data)
+        if self.main:
+            self.main_text.append(data)
+
+    def _newline(self):
+        if not self.skipped:
+            self.text.append("\n")
+            if self.main:
+                self.main_text.append("\n")
+
+    @staticmethod
+    def _is_boilerplate(attrs):
+        for name, value in attrs:
+            if not value:
+                continue
+            if name == "role" and value.lower() in BOILERPLATE_ROLES:
+                return True
+            if name in ("id", "class") and BOILERPLATE_PATTERN.search(value):
+                return True
+        return False
+
+
+def extract_main_text(content):
+    # The readable text of an HTML page (bytes or str), one block per line
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", errors="replace")
+    parser = MainTextParser()
+    parser.feed(content)
+    parser.close()
+    text = clean_lines("".join(parser.text))
+    main_text = clean_lines("".join(parser.main_text))
+    if main_text and len(main_text) >= MAIN_CONTENT_MIN_SHARE * len(text):
+        return main_text
+    return text
+
+
+def clean_lines(text):
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def normalize_chunk(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+
+def get_minhash(words):
+    # MinHash signature of the chunk's word shingles
+    n = DEDUP_SHINGLE_WORDS
+    shingles = {" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+    hashes %= _MERSENNE_PRIME
+    return ((_hash_a[:, None] * hashes[None, :] + _hash_b[:, None]) % _MERSENNE_PRIME).min(axis=1)
+
+
+def dedupe_chunks(chunks, threshold=DEDUP_THRESHOLD):
+    # Labels every chunk "kept", "exact" or "near"; the first of a group of
+    # duplicates is kept. Near duplicates are found with MinHash and
+    # locality-sensitive hashing over bands of the signature.
+    labels = []
+    seen = set()
+    buckets = {}
+    signatures = []
+    for chunk in chunks:
+        normalized = normalize_chunk(chunk)
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        if not normalized or digest in seen:
+            labels.append("exact")
+            continue
+        seen.add(digest)
+        signature = get_minhash(normalized.split())
+        bands = [(b, signature[b * DEDUP_ROWS:(b + 1) * DEDUP_ROWS].tobytes()) for b in range(DEDUP_BANDS)]
+        candidates = {k for band in bands for k in buckets.get(band, ())}
+        if any(np.mean(signatures[k] == signature) >= threshold for k in candidates):
+            labels.append("near")
+            continue
+        for band in bands:
+            buckets.setdefault(band, []).append(len(signatures))
+        signatures.append(signature)
+        labels.append("kept")
+    return labels
+
+
+def get_extraction_tokens(user_prompt, chunks_text):
+    return sum(estimate_tokens(get_spot_prompt(user_prompt, chunks)) for chunks in chunks_text if chunks)
+
+
+def ingest_pages(contents, user_prompt=""):
+    # Chunks every page once and drops repeated chunks. Returns the chunks
+    # of every page (for spot extraction), the flat list of chunk texts (for
+    # the vector index) and a report of what deduplication saved.
+    start = time.perf_counter()
+    with span("chunking"):
+        raw_chunks_text = [_splitter.split_text(content) for content in contents]
+        flat = [chunk for chunks in raw_chunks_text for chunk in chunks]
+        labels = dedupe_chunks(flat) if DEDUP_ENABLED else ["kept"] * len(flat)
+        kept = iter(label == "kept" for label in labels)
+        chunks_text = [[chunk for chunk in chunks if next(kept)] for chunks in raw_chunks_text]
+        chunk_texts = [chunk for chunks in chunks_text for chunk in chunks]
+    report = {
+        "pages": len(contents),
+        "chunks": len(flat),
+        "exact_duplicates": labels.count("exact"),
+        "near_duplicates": labels.count("near"),
+        "kept": len(chunk_texts),
+        "embedding_calls": math.ceil(len(flat) / EMBED_BATCH_SIZE),
+        "embedding_calls_kept": math.ceil(len(chunk_texts) / EMBED_BATCH_SIZE),
+        "embedding_tokens": sum(len(chunk) for chunk in flat) // 4,
+        "embedding_tokens_kept": sum(len(chunk) for chunk in chunk_texts) // 4,
+        "extraction_tokens": get_extraction_tokens(user_prompt, raw_chunks_text),
+        "extraction_tokens_kept": get_extraction_tokens(user_prompt, chunks_text),
+        "elapsed": time.perf_counter() - start,
+    }
+    record_ingestion(report)
+    return chunks_text, chunk_texts, report
+
+
+def record_ingestion(report):
+    for result, key in [("kept", "kept"), ("exact_duplicate", "exact_duplicates"),
+                        ("near_duplicate", "near_duplicates")]:
+        increment("voya_ingested_chunks_total", (("result", result),), report[key])
+    for kind in ["embedding", "extraction"]:
+        saved = report[f"{kind}_tokens"] - report[f"{kind}_tokens_kept"]
+        increment("voya_dedup_tokens_saved_total", (("kind", kind),), saved)
+    print(format_ingestion_report(report))
+
+
+def format_ingestion_report(report):
+    def reduction(before, after):
+        return f"{before} -> {after} ({1 - after / before:.0%} fewer)" if before else f"{before} -> {after}"
+
+    return "\n".join([
+        f"Ingested {report['pages']} pages in {report['elapsed'] * 1000:.0f} ms: "
+        f"{report['exact_duplicates']} exact and {report['near_duplicates']} near duplicate chunks dropped",
+        f"\tchunks: {reduction(report['chunks'], report['kept'])}",
+        f"\tembedding calls: {reduction(report['embedding_calls'], report['embedding_calls_kept'])}, "
+        f"tokens: {reduction(report['embedding_tokens'], report['embedding_tokens_kept'])}",
+        f"\textraction tokens: {reduction(report['extraction_tokens'], report['extraction_tokens_kept'])}",
+    ])
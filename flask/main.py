@@ -1,13 +1,21 @@
-import base64
 import datetime
 import traceback
 from io import BytesIO
 from dotenv import load_dotenv
 from flask import Flask, render_template, make_response, send_file, request, jsonify
 
+from deadline import (IDEAS_CHECKPOINTS, IDEAS_DEADLINE, ITINERARY_CHECKPOINTS, ITINERARY_DEADLINE, TRIP_CHECKPOINTS,
+                      TRIP_DEADLINE, budget, is_partial)
 from generate_itinerary import get_itinerary_sub
 from helper import *
+from photo_service import IMAGE_MAX_UPLOAD_BYTES, prepare_upload
+from session_store import SessionNotFound
+from streaming import sse_response, wants_stream
+from tracing import render_metrics, trace
+from trip_planner import TRIP_OPTIONS, InvalidTrip, get_trip_plan
 app = Flask(__name__)
+# Rejects oversized uploads before the form is parsed
+app.config["MAX_CONTENT_LENGTH"] = IMAGE_MAX_UPLOAD_BYTES + 1024 * 1024
 
 load_dotenv()
 
@@ -40,23 +48,40 @@ def test():
         "status": "ok",
     }
 
+@app.route("/metrics")
+def metrics():
+    return make_response(render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
 @app.route("/get_ideas", methods=['POST'])
 def get_ideas():
     description = request.form.get('prompt')
     if 'image' in request.files and request.files['image'] is not None:
-        image = request.files['image']
-        image_blob = image.read()
-        encoded_image = base64.b64encode(image_blob).decode('utf-8')
+        try:
+            photo = prepare_upload(request.files['image'].stream)
+        except ValueError as e:
+            return make_response(jsonify({"error": str(e)}), 400)
     else:
-        encoded_image = None
+        photo = None
 
     print(description)
-    print(encoded_image)
+    # no_cache=1 or Cache-Control: no-cache reruns the pipeline instead of
+    # answering from the result cache
+    use_cache = (str(request.form.get("no_cache", "")).lower() not in ("1", "true")
+                 and "no-cache" not in request.headers.get("Cache-Control", ""))
+    if wants_stream(request.args, request.form):
+        def run(emit):
+            with trace("/get_ideas"), budget("/get_ideas", IDEAS_DEADLINE, IDEAS_CHECKPOINTS):
+                place_details, session_id = get_travel_ideas(description, photo, on_event=emit, use_cache=use_cache)
+                return {"place_details": place_details, "session_id": session_id, "partial": is_partial()}
+        return sse_response(run)
     try:
-        place_details = get_travel_ideas(description, encoded_image)
+        with trace("/get_ideas"), budget("/get_ideas", IDEAS_DEADLINE, IDEAS_CHECKPOINTS):
+            place_details, session_id = get_travel_ideas(description, photo, use_cache=use_cache)
+            partial = is_partial()
         return {
             "place_details": place_details,
-
+            "session_id": session_id,
+            "partial": partial,
         }
     except Exception as e:
         error_stack = traceback.format_exc()
@@ -65,12 +90,18 @@ def get_ideas():
 @app.route("/get_detail", methods=['POST'])
 def get_detail():
     place = request.form.get('place')
+    session_id = request.form.get('session_id')
+    if not session_id:
+        return make_response(jsonify({"error": "session_id is required"}), 400)
     try:
-        description, review_summary = get_description_and_reviews(place)
+        with trace("/get_detail"):
+            description, review_summary = get_description_and_reviews(place, session_id)
         return {
             "description": description,
             "review_summary": review_summary
         }
+    except SessionNotFound as e:
+        return make_response(jsonify({"error": str(e)}), 400)
     except Exception as e:
         error_stack = traceback.format_exc()
         return make_response(jsonify({"error": str(e), "stack_trace": error_stack}), 500)
@@ -81,13 +112,49 @@ def get_itinerary():
     data = json.loads(raw_data)
     places = data.get('places')
     print("PLACES: ", places)
+    options = {
+        "stay_times": data.get('stay_times'),
+        "end": data.get('end'),
+        "optimizer": data.get('optimizer', 'auto'),
+        "locations": data.get('locations'),
+    }
+    if wants_stream(request.args, data):
+        def run(emit):
+            with trace("/get_itinerary"), budget("/get_itinerary", ITINERARY_DEADLINE, ITINERARY_CHECKPOINTS):
+                return dict(get_itinerary_sub(places, on_event=emit, **options), partial=is_partial())
+        return sse_response(run)
     try:
-        itinerary = get_itinerary_sub(places)
+        with trace("/get_itinerary"), budget("/get_itinerary", ITINERARY_DEADLINE, ITINERARY_CHECKPOINTS):
+            itinerary = dict(get_itinerary_sub(places, **options), partial=is_partial())
         return itinerary
     except Exception as e:
         error_stack = traceback.format_exc()
         return make_response(jsonify({"error": str(e), "stack_trace": error_stack}), 500)
 
+@app.route("/plan_trip", methods=['POST'])
+def plan_trip():
+    # One trip, or a batch of them under "trips"; trips over the same places
+    # share their travel matrix
+    data = json.loads(request.get_data())
+
+    def run_trip(trip, emit=None):
+        print("TRIP PLACES: ", trip.get('places'))
+        options = {key: trip[key] for key in TRIP_OPTIONS if key in trip}
+        with trace("/plan_trip"), budget("/plan_trip", TRIP_DEADLINE, TRIP_CHECKPOINTS):
+            return dict(get_trip_plan(trip.get('places'), on_event=emit, **options), partial=is_partial())
+
+    if "trips" not in data and wants_stream(request.args, data):
+        return sse_response(lambda emit: run_trip(data, emit))
+    try:
+        if "trips" in data:
+            return {"trips": [run_trip(trip) for trip in data["trips"]]}
+        return run_trip(data)
+    except InvalidTrip as e:
+        return make_response(jsonify({"error": str(e)}), 400)
+    except Exception as e:
+        error_stack = traceback.format_exc()
+        return make_response(jsonify({"error": str(e), "stack_trace": error_stack}), 500)
+
 if __name__ == "__main__":
     # This is used when running locally only. When deploying to Google App
     # Engine, a webserver process such as Gunicorn will serve the app. This
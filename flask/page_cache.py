@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from ttl_cache import CACHE_DIR
+
+PAGE_CACHE_ENABLED = os.getenv("PAGE_CACHE_ENABLED", "1") == "1"
+# Pages younger than this are served without contacting the site
+PAGE_CACHE_FRESH_SECONDS = int(os.getenv("PAGE_CACHE_FRESH_SECONDS", str(24 * 3600)))
+PAGE_CACHE_MAX_BYTES = int(os.getenv("PAGE_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+
+class PageCache:
+    # Cleaned page text, zlib-compressed in SQLite together with the
+    # validators needed for conditional GETs.
+
+    def __init__(self, path=None, fresh_seconds=PAGE_CACHE_FRESH_SECONDS, max_bytes=PAGE_CACHE_MAX_BYTES):
+        if path is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Renamed whenever the extracted text changes, so older extractions are not served
+            path = os.path.join(CACHE_DIR, "pages_main.sqlite3")
+        self.fresh_seconds = fresh_seconds
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "revalidated": 0, "changed": 0, "misses": 0, "evicted": 0}
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, text BLOB, etag TEXT, "
+            "last_modified TEXT, validated_at REAL, accessed_at REAL, size INTEGER)"
+        )
+        self.db.commit()
+
+    def get(self, url):
+        # Returns None or a dict with the text, validators and "fresh" flag
+        with self.lock:
+            row = self.db.execute(
+                "SELECT text, etag, last_modified, validated_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            text, etag, last_modified, validated_at = row
+            fresh = validated_at + self.fresh_seconds > time.time()
+            if fresh:
+                self.stats["hits"] += 1
+            self.db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self.db.commit()
+        return {
+            "text": zlib.decompress(text).decode("utf-8"),
+            "etag": etag,
+            "last_modified": last_modified,
+            "fresh": fresh,
+        }
+
+    def conditional_headers(self, cached):
+        headers = {}
+        if cached is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        return headers
+
+    def mark_revalidated(self, url):
+        # The site answered 304 Not Modified
+        with self.lock:
+            self.db.execute("UPDATE pages SET validated_at = ? WHERE url = ?", (time.time(), url))
+            self.db.commit()
+            self.stats["revalidated"] += 1
+
+    def put(self, url, text, etag=None, last_modified=None, changed=False):
+        data = zlib.compress(text.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO pages (url, text, etag, last_modified, validated_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, data, etag, last_modified, now, now, len(data)),
+            )
+            if changed:
+                self.stats["changed"] += 1
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used pages until a tenth below the bound
+        target = total - self.max_bytes * 0.9
+        freed = 0
+        for url, size in self.db.execute("SELECT url, size FROM pages ORDER BY accessed_at").fetchall():
+            if freed >= target:
+                break
+            self.db.execute("DELETE FROM pages WHERE url = ?", (url,))
+            freed += size
+            self.stats["evicted"] += 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["pages"], stats["bytes"] = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages"
+            ).fetchone()
+        return stats
+
+
+page_cache = PageCache() if PAGE_CACHE_ENABLED else None
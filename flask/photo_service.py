@@ -0,0 +1,225 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from deadline import call_timeout
+from tracing import increment, record_llm_call, span
+from ttl_cache import TTLCache
+
+# Llama 3.2 Vision looks at the photo as at most 2x2 tiles of 560px, so
+# anything above 1120px on the long side is upload and decode time the model
+# never sees.
+load_dotenv()
+IMAGE_MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1120"))  # In pixels
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+PHOTO_CACHE_TTL = int(os.getenv("PHOTO_CACHE_TTL", str(30 * 24 * 3600)))  # In seconds
+PHOTO_CACHE_SIZE = int(os.getenv("PHOTO_CACHE_SIZE", "1024"))
+PHOTO_CACHE_ENABLED = os.getenv("PHOTO_CACHE_ENABLED", "1") == "1"
+# Photos whose 64-bit difference hashes differ in at most this many bits are
+# treated as the same picture (re-encoded, resized or lightly edited)
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+PHASH_RECENT_SIZE = 512
+
+PHOTO_PROMPT = "Identify and name the main object in the photo and describe it in a short paragraph."
+
+photo_cache = TTLCache(
+    "photo_descriptions",
+    ttl=PHOTO_CACHE_TTL,
+    max_entries=PHOTO_CACHE_SIZE,
+    persistent=PHOTO_CACHE_ENABLED,
+)
+_recent_hashes = OrderedDict()
+_stats = {"photos": 0, "bytes_received": 0, "bytes_sent": 0, "vision_calls": 0, "vision_seconds": 0.0,
+          "exact_hits": 0, "near_hits": 0, "seconds_saved": 0.0}
+_lock = threading.Lock()
+
+
+def read_upload(stream, max_bytes=IMAGE_MAX_UPLOAD_BYTES):
+    # Reads the upload in chunks and gives up as soon as it is too large
+    body = bytearray()
+    while True:
+        chunk = stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return bytes(body)
+        body.extend(chunk)
+        if len(body) > max_bytes:
+            raise ValueError(f"Image is larger than {max_bytes / (1024 * 1024):.1f} MB")
+
+
+def difference_hash(image):
+    # 64-bit dHash: compares neighbouring pixels of a 9x8 grayscale thumbnail
+    pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def prepare_image(blob, max_side=IMAGE_MAX_SIDE, quality=IMAGE_JPEG_QUALITY):
+    # Downscales and recompresses the photo to what the model can use. Photos
+    # that need no resizing are sent as they are unless JPEG is smaller.
+    start = time.perf_counter()
+    try:
+        image = Image.open(io.BytesIO(blob))
+        original_format = image.format
+        # Whether the photo can be sent as is depends on its full size, not
+        # on the reduced size draft() decodes it at
+        fits = max(image.size) <= max_side
+        # JPEG can decode straight to a reduced scale, far cheaper than a
+        # full decode followed by a resize
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+    except Exception as e:
+        raise ValueError("Uploaded file is not a readable image") from e
+    if original_format == "JPEG" and fits:
+        data, mime_type = blob, MIME_TYPES["JPEG"]
+    else:
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+        data, mime_type = output.getvalue(), MIME_TYPES["JPEG"]
+        if fits and original_format in MIME_TYPES and len(blob) <= len(data):
+            data, mime_type = blob, MIME_TYPES[original_format]
+    return {
+        "encoded": base64.b64encode(data).decode("utf-8"),
+        "mime_type": mime_type,
+        "sha256": hashlib.sha256(blob).hexdigest(),
+        "dhash": f"{difference_hash(image):016x}",
+        "size": image.size,
+        "bytes_received": len(blob),
+        "bytes_sent": len(data),
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+def prepare_upload(stream):
+    with span("image_preprocessing"):
+        photo = prepare_image(read_upload(stream))
+    increment("voya_image_bytes_total", (("kind", "received"),), photo["bytes_received"])
+    increment("voya_image_bytes_total", (("kind", "sent"),), photo["bytes_sent"])
+    with _lock:
+        _stats["photos"] += 1
+        _stats["bytes_received"] += photo["bytes_received"]
+        _stats["bytes_sent"] += photo["bytes_sent"]
+    print(f"Photo: {photo['bytes_received'] / 1024:.0f} KB -> {photo['bytes_sent'] / 1024:.0f} KB "
+          f"at {photo['size'][0]}x{photo['size'][1]} in {photo['elapsed'] * 1000:.0f} ms")
+    return photo
+
+
+def _find_near_duplicate(dhash):
+    value = int(dhash, 16)
+    with _lock:
+        for other, description in reversed(_recent_hashes.items()):
+            distance = bin(value ^ int(other, 16)).count("1")
+            if distance <= PHASH_MAX_DISTANCE:
+                return description, distance
+    return None, None
+
+
+def _remember(photo, description):
+    photo_cache.set(f"sha256:{photo['sha256']}", description)
+    photo_cache.set(f"dhash:{photo['dhash']}", description)
+    with _lock:
+        _recent_hashes[photo["dhash"]] = description
+        _recent_hashes.move_to_end(photo["dhash"])
+        while len(_recent_hashes) > PHASH_RECENT_SIZE:
+            _recent_hashes.popitem(last=False)
+
+
+def _record_hit(kind):
+    increment("voya_photo_cache_total", (("result", kind),))
+    with _lock:
+        _stats[f"{kind}_hits"] += 1
+        if _stats["vision_calls"]:
+            _stats["seconds_saved"] += _stats["vision_seconds"] / _stats["vision_calls"]
+
+
+def get_cached_description(photo):
+    # Exact content first, then the same perceptual hash (shared across
+    # workers), then a near-identical photo seen recently by this process
+    if not PHOTO_CACHE_ENABLED:
+        return None
+    description = photo_cache.get(f"sha256:{photo['sha256']}")
+    if description is not None:
+        _record_hit("exact")
+        print("Photo description cache hit (same file)")
+        return description
+    description = photo_cache.get(f"dhash:{photo['dhash']}")
+    distance = 0
+    if description is None:
+        description, distance = _find_near_duplicate(photo["dhash"])
+    if description is not None:
+        _record_hit("near")
+        print(f"Photo description cache hit (near-identical photo, {distance} bits apart)")
+        photo_cache.set(f"sha256:{photo['sha256']}", description)
+    return description
+
+
+def get_photo_messages(photo):
+    image_url = f"data:{photo['mime_type']};base64,{photo['encoded']}"
+    return [{"role": "user",
+             "content": [
+                 {"type": "text", "text": PHOTO_PROMPT},
+                 {"type": "image_url", "image_url": {"url": image_url}}
+             ]}]
+
+
+def describe_photo(client, model_name, photo):
+    description = get_cached_description(photo)
+    if description is not None:
+        return description
+    increment("voya_photo_cache_total", (("result", "miss"),))
+    start = time.perf_counter()
+    with span("photo_description"):
+        response = client.chat.completions.create(model=model_name, messages=get_photo_messages(photo), temperature=0,
+                                                  timeout=call_timeout())
+    return finish_description(photo, response, start)
+
+
+async def describe_photo_async(client, model_name, photo):
+    # Same as describe_photo with an AsyncGroq client. The cache is SQLite,
+    # so its reads and writes run in a worker thread.
+    description = await asyncio.to_thread(get_cached_description, photo)
+    if description is not None:
+        return description
+    increment("voya_photo_cache_total", (("result", "miss"),))
+    start = time.perf_counter()
+    with span("photo_description"):
+        response = await client.chat.completions.create(model=model_name, messages=get_photo_messages(photo),
+                                                        temperature=0, timeout=call_timeout())
+    return await asyncio.to_thread(finish_description, photo, response, start)
+
+
+def finish_description(photo, response, start):
+    record_llm_call("groq", response)
+    with _lock:
+        _stats["vision_calls"] += 1
+        _stats["vision_seconds"] += time.perf_counter() - start
+    description = response.choices[0].message.content
+    if PHOTO_CACHE_ENABLED and description:
+        _remember(photo, description)
+    print("photo stats:", get_stats())
+    return description
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+    received = stats["bytes_received"]
+    stats["bytes_saved_ratio"] = 1 - stats["bytes_sent"] / received if received else 0.0
+    stats["seconds_saved"] = round(stats["seconds_saved"], 2)
+    stats["vision_seconds"] = round(stats["vision_seconds"], 2)
+    return stats
@@ -0,0 +1,364 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from dotenv import load_dotenv
+
+from deadline import async_call_timeout, call_timeout, hedged, hedged_async, mark_partial, remaining
+from http_session import get_async_session, get_session
+from tracing import count_call, propagate, span
+from ttl_cache import TTLCache
+
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+PLACES_MAX_WORKERS = int(os.getenv("PLACES_MAX_WORKERS", "10"))
+GOOGLE_PLACES_API_BASE = os.getenv("GOOGLE_PLACES_API_BASE", "https://places.googleapis.com")
+PLACES_SEARCH_URL = f"{GOOGLE_PLACES_API_BASE}/v1/places:searchText"
+PLACES_MEDIA_URL = GOOGLE_PLACES_API_BASE + "/v1/{photo_name}/media"
+
+# A text query resolves to a place ID, which maps to the place record and to
+# its photo URI. Place IDs are stable, while ratings and reviews change and
+# photo URIs eventually expire, so each layer has its own TTL. Queries that
+# found nothing are remembered for a shorter time.
+PLACES_CACHE_ENABLED = os.getenv("PLACES_CACHE_ENABLED", "1") == "1"
+PLACE_QUERY_CACHE_TTL = int(os.getenv("PLACE_QUERY_CACHE_TTL", str(30 * 24 * 3600)))  # In seconds
+PLACE_MISS_CACHE_TTL = int(os.getenv("PLACE_MISS_CACHE_TTL", str(24 * 3600)))  # In seconds
+PLACE_RECORD_CACHE_TTL = int(os.getenv("PLACE_RECORD_CACHE_TTL", str(3 * 24 * 3600)))  # In seconds
+PLACE_PHOTO_CACHE_TTL = int(os.getenv("PLACE_PHOTO_CACHE_TTL", str(12 * 3600)))  # In seconds
+PLACES_CACHE_SIZE = int(os.getenv("PLACES_CACHE_SIZE", "4096"))
+
+place_query_cache = TTLCache("place_queries", ttl=PLACE_QUERY_CACHE_TTL, max_entries=PLACES_CACHE_SIZE,
+                             persistent=PLACES_CACHE_ENABLED)
+place_record_cache = TTLCache("place_records", ttl=PLACE_RECORD_CACHE_TTL, max_entries=PLACES_CACHE_SIZE,
+                              persistent=PLACES_CACHE_ENABLED)
+place_photo_cache = TTLCache("place_photos", ttl=PLACE_PHOTO_CACHE_TTL, max_entries=PLACES_CACHE_SIZE,
+                             persistent=PLACES_CACHE_ENABLED)
+
+field_mask = "places.name,places.editorialSummary,places.formattedAddress,places.location,places.rating,places.googleMapsUri,places.websiteUri,places.reviews.rating,places.reviews.text.text,places.photos.name,places.displayName.text,places.primaryTypeDisplayName"
+
+
+def get_place_search_request(keyword, region_code, language_code):
+    params = {
+        "textQuery": keyword,
+        "regionCode": region_code,
+        "languageCode": language_code,
+        "rankPreference": "RELEVANCE",
+    }
+    headers = {
+        "X-Goog-Api-Key": GOOGLE_API_KEY,
+        "X-Goog-FieldMask": field_mask
+    }
+    return params, headers
+
+
+def get_google_map_place_id(keyword, region_code, language_code):
+    params, headers = get_place_search_request(keyword, region_code, language_code)
+    result = get_session().post(PLACES_SEARCH_URL, params, headers=headers, timeout=call_timeout())
+    count_call("places_search", result.status_code == 200)
+    if result.status_code != 200:
+        print(f"Error: {result.status_code}")
+        return {}
+    else:
+        return result.json()
+
+
+async def get_google_map_place_id_async(keyword, region_code, language_code):
+    params, headers = get_place_search_request(keyword, region_code, language_code)
+    async with get_async_session().post(PLACES_SEARCH_URL, data=params, headers=headers,
+                                        timeout=async_call_timeout()) as result:
+        count_call("places_search", result.status == 200)
+        if result.status != 200:
+            print(f"Error: {result.status}")
+            return {}
+        return await result.json(content_type=None)
+
+
+def process_reviews(reviews):
+    texts = []
+    ratings = []
+    for review in reviews:
+        if 'text' in review:
+            texts.append(review['text']['text'])
+        if 'rating' in review:
+            ratings.append(review['rating'])
+    return {
+        "review_texts": texts,
+        "local_ratings": sum(ratings) / len(ratings) if ratings else None
+    }
+
+
+def process_photos(photos):
+    photo_names = [photo['name'] for photo in photos]
+    return photo_names[0] if photo_names else ""
+
+
+def get_formatted_place_details(keyword, region_code, language_code, country_name, category_name):
+    keyword = keyword + ", " + category_name + ", " + country_name
+    return format_place_details(keyword, hedged("places_search", get_google_map_place_id, keyword, region_code,
+                                                language_code))
+
+
+async def get_formatted_place_details_async(keyword, region_code, language_code, country_name, category_name):
+    keyword = keyword + ", " + category_name + ", " + country_name
+    return format_place_details(keyword, await hedged_async(
+        "places_search", lambda: get_google_map_place_id_async(keyword, region_code, language_code)))
+
+
+def format_place_details(keyword, place_detail_):
+    if not place_detail_.get('places'):
+        print(f"No place found for {keyword}")
+        return None
+    place = place_detail_['places'][0]
+    formatted_reviews = process_reviews(place.get('reviews', []))
+    photo_names = process_photos(place.get('photos', []))
+    return {
+        "name": place['displayName']['text'],
+        "OrignalName": keyword,
+        "primaryType": place.get('primaryTypeDisplayName', {'text': ''})['text'],
+        "googleMapName": place['name'],
+        "address": place.get('formattedAddress', ''),
+        "location": place.get('location'),
+        "googleMapsUri": place.get('googleMapsUri', ''),
+        "websiteUri": place.get('websiteUri', ''),
+        "globalRating": place.get('rating'),
+        "localRating": formatted_reviews["local_ratings"],
+        "googleMapPhoto": photo_names,
+        "reviews": formatted_reviews["review_texts"],
+    }
+
+
+def get_photo_params():
+    return {
+        "maxHeightPx": 400,
+        "maxWidthPx": 400,
+        "key": GOOGLE_API_KEY,
+        "skipHttpRedirect": "true"
+    }
+
+
+def get_google_map_images(place):
+    result = get_session().get(PLACES_MEDIA_URL.format(photo_name=place), params=get_photo_params(),
+                               timeout=call_timeout())
+    count_call("places_photo", result.status_code == 200)
+    if result.status_code != 200:
+        print(f"Error: {result.status_code}")
+        print(result.text)
+        return {}
+    else:
+        return result.json()
+
+
+async def get_google_map_images_async(place):
+    async with get_async_session().get(PLACES_MEDIA_URL.format(photo_name=place), params=get_photo_params(),
+                                       timeout=async_call_timeout()) as result:
+        count_call("places_photo", result.status == 200)
+        if result.status != 200:
+            print(f"Error: {result.status}")
+            print(await result.text())
+            return {}
+        return await result.json(content_type=None)
+
+
+def get_place_query_key(keyword, region_code, language_code, country_name, category_name):
+    def normalize(value):
+        return " ".join(str(value or "").lower().split())
+    return json.dumps([normalize(keyword), normalize(category_name), normalize(country_name),
+                       normalize(region_code), normalize(language_code)], ensure_ascii=False)
+
+
+def get_cached_place(query_key, keyword, category_name, country_name):
+    # Returns (found, place detail); found is False when the query still has
+    # to be searched. Records are copied, since callers add their own fields.
+    place_id = place_query_cache.get(query_key)
+    if place_id == "":
+        return True, None
+    place_detail = place_record_cache.get(place_id) if place_id else None
+    if place_detail is not None:
+        return True, dict(place_detail, OrignalName=f"{keyword}, {category_name}, {country_name}")
+    return False, None
+
+
+def cache_place(query_key, place_detail):
+    if place_detail is None:
+        place_query_cache.set(query_key, "", ttl=PLACE_MISS_CACHE_TTL)
+        return
+    place_query_cache.set(query_key, place_detail["googleMapName"])
+    place_record_cache.set(place_detail["googleMapName"], dict(place_detail))
+
+
+def find_place(keyword, region_code, language_code, country_name, category_name):
+    # The place record for a query, from the caches when possible
+    if not PLACES_CACHE_ENABLED:
+        return get_formatted_place_details(keyword, region_code, language_code, country_name, category_name)
+    query_key = get_place_query_key(keyword, region_code, language_code, country_name, category_name)
+    found, place_detail = get_cached_place(query_key, keyword, category_name, country_name)
+    if not found:
+        place_detail = get_formatted_place_details(keyword, region_code, language_code, country_name, category_name)
+        cache_place(query_key, place_detail)
+    return place_detail
+
+
+async def find_place_async(keyword, region_code, language_code, country_name, category_name):
+    if not PLACES_CACHE_ENABLED:
+        return await get_formatted_place_details_async(keyword, region_code, language_code, country_name,
+                                                       category_name)
+    query_key = get_place_query_key(keyword, region_code, language_code, country_name, category_name)
+    found, place_detail = await asyncio.to_thread(get_cached_place, query_key, keyword, category_name, country_name)
+    if not found:
+        place_detail = await get_formatted_place_details_async(keyword, region_code, language_code, country_name,
+                                                               category_name)
+        await asyncio.to_thread(cache_place, query_key, place_detail)
+    return place_detail
+
+
+def get_cached_photo_uri(place_detail):
+    if not place_detail["googleMapPhoto"]:
+        return ""
+    if PLACES_CACHE_ENABLED:
+        return place_photo_cache.get(place_detail["googleMapName"])
+    return None
+
+
+def cache_photo_uri(place_detail, photo_uri):
+    # Failed lookups are not cached so they are retried on the next request
+    if PLACES_CACHE_ENABLED and photo_uri:
+        place_photo_cache.set(place_detail["googleMapName"], photo_uri)
+
+
+def get_photo_uri(place_detail):
+    photo_uri = get_cached_photo_uri(place_detail)
+    if photo_uri is not None:
+        return photo_uri
+    try:
+        with span("photo_resolution"):
+            photo_uri = hedged("places_photo", get_google_map_images, place_detail["googleMapPhoto"]).get("photoUri", "")
+    except Exception as e:
+        print(f"Photo lookup failed for {place_detail['name']}: {e!r}")
+        return ""
+    cache_photo_uri(place_detail, photo_uri)
+    return photo_uri
+
+
+async def get_photo_uri_async(place_detail):
+    photo_uri = await asyncio.to_thread(get_cached_photo_uri, place_detail)
+    if photo_uri is not None:
+        return photo_uri
+    try:
+        with span("photo_resolution"):
+            photo_uri = (await hedged_async(
+                "places_photo", lambda: get_google_map_images_async(place_detail["googleMapPhoto"]))).get("photoUri", "")
+    except Exception as e:
+        print(f"Photo lookup failed for {place_detail['name']}: {e!r}")
+        return ""
+    await asyncio.to_thread(cache_photo_uri, place_detail, photo_uri)
+    return photo_uri
+
+
+def resolve_place(keyword, region_code, language_code, country_name, category_name):
+    # Text search followed by the photo lookup for one extracted spot
+    place_detail = find_place(keyword, region_code, language_code, country_name, category_name)
+    if place_detail is None:
+        return None
+    place_detail["googleMapPhotoUri"] = get_photo_uri(place_detail)
+    return place_detail
+
+
+async def resolve_place_async(keyword, region_code, language_code, country_name, category_name):
+    place_detail = await find_place_async(keyword, region_code, language_code, country_name, category_name)
+    if place_detail is None:
+        return None
+    place_detail["googleMapPhotoUri"] = await get_photo_uri_async(place_detail)
+    return place_detail
+
+
+def get_places_cache_stats():
+    return {
+        "queries": place_query_cache.get_stats(),
+        "records": place_record_cache.get_stats(),
+        "photos": place_photo_cache.get_stats(),
+    }
+
+
+def get_place_details(extracted_places, region_code, language_code, country_name, max_workers=PLACES_MAX_WORKERS,
+                      on_place=None):
+    # Resolves every (spot name, category) concurrently. Spots that cannot be
+    # found, or are not resolved by the stage deadline, are left out; the
+    # rest keep the extraction order. on_place is called with each place as
+    # soon as it is resolved.
+    def resolve(i, keyword, category_name):
+        start = time.perf_counter()
+        try:
+            place_detail = resolve_place(keyword, region_code, language_code, country_name, category_name)
+        except Exception as e:
+            print(f"Places lookup failed for {keyword}: {e!r}")
+            place_detail = None
+        return i, place_detail, time.perf_counter() - start
+
+    results = {}
+    if not extracted_places:
+        return {}
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(extracted_places))))
+    try:
+        futures = [
+            executor.submit(propagate(resolve), i, keyword, category_name)
+            for i, (keyword, category_name) in enumerate(extracted_places)
+        ]
+        for future in as_completed(futures, timeout=remaining("places")):
+            i, place_detail, elapsed = future.result()
+            print(f"{extracted_places[i][0]}: {elapsed * 1000:.0f} ms")
+            if place_detail is not None:
+                results[i] = place_detail
+                if on_place is not None:
+                    on_place(place_detail)
+    except FutureTimeout:
+        mark_partial("places")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return collect_place_details(results)
+
+
+async def get_place_details_async(extracted_places, region_code, language_code, country_name,
+                                  max_workers=PLACES_MAX_WORKERS, on_place=None):
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def resolve(i, keyword, category_name):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                place_detail = await resolve_place_async(keyword, region_code, language_code, country_name,
+                                                         category_name)
+            except Exception as e:
+                print(f"Places lookup failed for {keyword}: {e!r}")
+                place_detail = None
+            return i, place_detail, time.perf_counter() - start
+
+    results = {}
+    tasks = [asyncio.create_task(resolve(i, keyword, category_name))
+             for i, (keyword, category_name) in enumerate(extracted_places)]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=remaining("places")):
+            i, place_detail, elapsed = await next_done
+            print(f"{extracted_places[i][0]}: {elapsed * 1000:.0f} ms")
+            if place_detail is not None:
+                results[i] = place_detail
+                if on_place is not None:
+                    on_place(place_detail)
+    except asyncio.TimeoutError:
+        mark_partial("places")
+    finally:
+        for task in tasks:
+            task.cancel()
+    return collect_place_details(results)
+
+
+def collect_place_details(results):
+    # Keeps the extraction order and the first place of each name
+    place_details = {}
+    for i in sorted(results):
+        place_details.setdefault(results[i]['name'], results[i])
+    if PLACES_CACHE_ENABLED:
+        print("places cache:", get_places_cache_stats())
+    return place_details
@@ -0,0 +1,193 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from deadline import call_timeout
+from tracing import propagate, record_llm_call
+
+LANGUAGE_CODES = ["en", "fr", "de", "es", "lang_it", "pt-pt", "pt-br", "th", "hi"]
+COUNTRY_CODES = ["GB", "US", "CA", "NZ", "AU", "BR", "FR", "DE", "ES", "IT", "PT", "IN"]
+QUERY_FIELDS = ["search_query", "search_query_short", "user_language", "language_code", "country_code", "country_name"]
+
+
+def _complete(client, model_name, prompt, **kwargs):
+    response = client.chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user",
+                   "content": prompt}, ],
+        timeout=call_timeout(),
+        **kwargs
+    )
+    record_llm_call("groq", response)
+    return response.choices[0].message.content
+
+
+async def _complete_async(client, model_name, prompt, **kwargs):
+    response = await client.chat.completions.create(
+        model=model_name,
+        messages=[{"role": "user",
+                   "content": prompt}, ],
+        timeout=call_timeout(),
+        **kwargs
+    )
+    record_llm_call("groq", response)
+    return response.choices[0].message.content
+
+
+def get_search_query_prompt(user_prompt, photo_description):
+    return f"""
+    User prompt:
+    {user_prompt}
+
+    Descriptions of uploaded photos:
+    {photo_description}
+
+    Instructions:
+    You are a travelling assistant. Find out what kind of places the user wants to visit by finding out keywords in the user prompt. If there are uploaded photos, try to find out how they relates to the user's intent and find key words in it. Next, create ONE concise query you'd put in a search engine to find suitable local places which are less-known to tourists for the user to visit according to the user's requests. For example, if the user wants to visit museums in London, the search query would be "London local museums". Output this ONE query in the language used in the user's travel destination. ONLY output the query and nothing else. DO NOT include your thought process. 
+    """
+
+
+def get_analysis_prompt(user_prompt, photo_description):
+    return f"""
+    User prompt:
+    {user_prompt}
+
+    Descriptions of uploaded photos:
+    {photo_description}
+
+    Instructions:
+    You are a travelling assistant. Analyse the user prompt and the uploaded photos and return a json object with exactly these keys:
+    - "search_query": ONE concise query you'd put in a search engine to find suitable local places which are less-known to tourists for the user to visit according to the user's requests. For example, if the user wants to visit museums in London, the search query would be "London local museums". Write it in the language used in the user's travel destination.
+    - "search_query_short": the search query shortened to around 6 keywords.
+    - "user_language": the language of the user prompt, as ONE word.
+    - "language_code": the language to find search results in, one of {", ".join(LANGUAGE_CODES)}.
+    - "country_code": the country to find search results in, one of {", ".join(COUNTRY_CODES)}.
+    - "country_name": the name of the country the user is interested in.
+    Return only the json object.
+    """
+
+
+def validate_analysis(analysis):
+    # Keep only the fields that are present and well formed
+    if not isinstance(analysis, dict):
+        return {}
+    valid = {}
+    for field in QUERY_FIELDS:
+        value = analysis.get(field)
+        if isinstance(value, str) and value.strip():
+            valid[field] = value.strip()
+    if valid.get("language_code", "").lower() not in LANGUAGE_CODES:
+        valid.pop("language_code", None)
+    if valid.get("country_code", "").upper() not in COUNTRY_CODES:
+        valid.pop("country_code", None)
+    else:
+        valid["country_code"] = valid["country_code"].upper()
+    return valid
+
+
+def get_search_queries(client, model_name, user_prompt, photo_description, search_query=None):
+    if search_query is None:
+        search_query = _complete(client, model_name, get_search_query_prompt(user_prompt, photo_description),
+                                 temperature=0)
+    p2 = f"Given this search query: {search_query}, locate keywords in it and shorten it to around 6 words. ONLY output the shortened search query and nothing else."
+    return search_query, _complete(client, model_name, p2)
+
+
+def get_user_language(client, model_name, user_prompt):
+    return _complete(client, model_name,
+                     f"User prompt:\n{user_prompt}\n\nGet the language of the user prompt. Return only this language and nothing else, so return ONE word.")
+
+
+def get_language_code(client, model_name, user_prompt):
+    search_prompt = f"""Given the list of languages choose one that you want to find search results in. ONLY provide the language code.
+
+    User prompt:
+    {user_prompt}
+
+    The list of languages:
+    - en
+    - fr
+    - de
+    - es
+    - lang_it
+    - pt-pt
+    - pt-br
+    - th
+    - hi
+    """
+    return _complete(client, model_name, search_prompt)
+
+
+def get_country_code(client, model_name, user_prompt):
+    coun_code_prompt = f"""Given the list of countries choose one that you want to find search results in. ONLY provide the countries.
+
+    User prompt:
+    {user_prompt}
+
+    The list of countries:
+    GB, US, CA, NZ, AU, BR, FR, DE, ES, IT, PT, BR, IN
+    """
+    return _complete(client, model_name, coun_code_prompt, temperature=0)
+
+
+def get_country_name(client, model_name, user_prompt):
+    return _complete(client, model_name,
+                     f"Here is user prompt: {user_prompt}\n\nWhich country is the user insterested in? Only output country name and nothing else.",
+                     temperature=0)
+
+
+def analyze_query(client, model_name, user_prompt, photo_description):
+    # One JSON-mode call for every field; whatever is missing or malformed is
+    # then filled in by the original single-purpose prompts, run concurrently.
+    try:
+        content = _complete(client, model_name, get_analysis_prompt(user_prompt, photo_description),
+                            temperature=0, response_format={"type": "json_object"})
+        analysis = validate_analysis(json.loads(content))
+    except Exception as e:
+        print(f"Query analysis failed, falling back to separate calls: {e!r}")
+        analysis = {}
+    return fill_missing_fields(client, model_name, user_prompt, photo_description, analysis)
+
+
+async def analyze_query_async(client, model_name, user_prompt, photo_description, fallback_client):
+    # The JSON-mode call goes through the AsyncGroq client. The fallbacks are
+    # rare, so they keep using the sync client on a worker thread.
+    try:
+        content = await _complete_async(client, model_name, get_analysis_prompt(user_prompt, photo_description),
+                                        temperature=0, response_format={"type": "json_object"})
+        analysis = validate_analysis(json.loads(content))
+    except Exception as e:
+        print(f"Query analysis failed, falling back to separate calls: {e!r}")
+        analysis = {}
+    if all(field in analysis for field in QUERY_FIELDS):
+        return analysis
+    return await asyncio.to_thread(fill_missing_fields, fallback_client, model_name, user_prompt, photo_description,
+                                   analysis)
+
+
+def fill_missing_fields(client, model_name, user_prompt, photo_description, analysis):
+    missing = [field for field in QUERY_FIELDS if field not in analysis]
+    if missing:
+        print(f"Query analysis missing {missing}, falling back to separate calls")
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            futures = {}
+            if "search_query_short" in missing:
+                futures["search_queries"] = executor.submit(
+                    propagate(get_search_queries), client, model_name, user_prompt, photo_description,
+                    analysis.get("search_query"))
+            elif "search_query" in missing:
+                futures["search_query"] = executor.submit(
+                    propagate(_complete), client, model_name, get_search_query_prompt(user_prompt, photo_description),
+                    temperature=0)
+            for field, fn in [("user_language", get_user_language),
+                              ("language_code", get_language_code),
+                              ("country_code", get_country_code),
+                              ("country_name", get_country_name)]:
+                if field in missing:
+                    futures[field] = executor.submit(propagate(fn), client, model_name, user_prompt)
+            for field, future in futures.items():
+                if field == "search_queries":
+                    analysis["search_query"], analysis["search_query_short"] = future.result()
+                else:
+                    analysis[field] = future.result()
+    return analysis
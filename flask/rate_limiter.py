@@ -0,0 +1,75 @@
+import asyncio
+import os
+import threading
+import time
+
+# Nebius AI Studio account limits; every Nebius call shares one limiter.
+NEBIUS_REQUESTS_PER_MINUTE = int(os.getenv("NEBIUS_REQUESTS_PER_MINUTE", "60"))
+NEBIUS_TOKENS_PER_MINUTE = int(os.getenv("NEBIUS_TOKENS_PER_MINUTE", "400000"))
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount=1):
+        # Returns 0 when the tokens were taken, otherwise how long to wait
+        amount = min(amount, self.capacity)
+        with self.lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+
+    def release(self, amount=1):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    # Blocks until both the request and the token budget allow a call.
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    def try_acquire(self, tokens=0):
+        wait = self.requests.try_acquire(1)
+        if wait == 0:
+            wait = self.tokens.try_acquire(tokens)
+            if wait == 0:
+                return 0
+            self.requests.release(1)
+        return wait
+
+    def acquire(self, tokens=0):
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=0):
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+
+def estimate_tokens(text, max_output_tokens=256):
+    # Roughly four characters per token for Latin scripts
+    return len(text) // 4 + max_output_tokens
+
+
+nebius_limiter = RateLimiter(NEBIUS_REQUESTS_PER_MINUTE, NEBIUS_TOKENS_PER_MINUTE)
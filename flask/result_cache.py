@@ -0,0 +1,156 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from clients import get_embeddings
+from tracing import count_call, increment
+
+# Finished /get_ideas results, reused in two steps. Before anything else
+# runs, a request whose normalized prompt and photo were seen recently gets
+# that result back. Once the query is analysed, a result is also reused for
+# a prompt of the same scope (destination and category, as in the short
+# search query, country and languages) whose embedding is close enough;
+# prompts that differ only by city embed very closely, so the similarity
+# alone never decides. Results point at their session, so entries only live
+# in this process and are dropped once the session is gone.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", str(3 * 3600)))  # In seconds
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+# Cosine similarity of the normalized prompts' embeddings, within a scope
+RESULT_CACHE_THRESHOLD = float(os.getenv("RESULT_CACHE_THRESHOLD", "0.92"))
+
+
+def normalize_prompt(prompt):
+    prompt = re.sub(r"[^\w\s]", " ", (prompt or "").lower())
+    return " ".join(prompt.split())
+
+
+def get_scope(analysis, photo_key=""):
+    return json.dumps([photo_key, normalize_prompt(analysis.get("search_query_short")),
+                       analysis.get("country_code"), analysis.get("language_code"),
+                       normalize_prompt(analysis.get("user_language"))], ensure_ascii=False)
+
+
+class ResultCache:
+    def __init__(self, embed, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_SIZE, threshold=RESULT_CACHE_THRESHOLD):
+        # embed(text) returns the embedding of a normalized prompt
+        self.embed = embed
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "exact_hits": 0, "misses": 0, "bypassed": 0, "expired": 0, "invalid": 0}
+
+    def probe(self, prompt, photo_key=""):
+        # The exact key of a request: its normalized prompt and photo. The
+        # scope and embedding are added by narrow once the query is analysed.
+        text = normalize_prompt(prompt)
+        return {"key": f"{photo_key}|{text}", "text": text, "photo_key": photo_key, "scope": None, "vector": None}
+
+    def narrow(self, probe, analysis):
+        # Adds the scope of the analysed query and the prompt's unit-length
+        # embedding (None for an empty prompt)
+        probe["scope"] = get_scope(analysis, probe["photo_key"])
+        if probe["text"]:
+            vector = np.asarray(self.embed(probe["text"]), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            probe["vector"] = vector
+        return probe
+
+    def lookup_exact(self, probe, is_valid=None):
+        # The live entry stored under the same prompt and photo, or None.
+        # Misses are only counted by lookup, which runs next.
+        with self.lock:
+            self._expire(time.time())
+            entry = self.entries.get(probe["key"])
+            if entry is None:
+                return None
+            if is_valid is not None and not is_valid(entry["value"]):
+                del self.entries[probe["key"]]
+                self.stats["invalid"] += 1
+                return None
+            self.entries.move_to_end(probe["key"])
+            self.stats["exact_hits"] += 1
+            increment("voya_result_cache_total", (("result", "hit"),))
+            return entry["value"]
+
+    def lookup(self, probe, is_valid=None):
+        # Returns (value, similarity) of the closest live entry of the
+        # probe's scope above the threshold, or (None, best similarity seen)
+        best_key, best_similarity = None, 0.0
+        with self.lock:
+            self._expire(time.time())
+            candidates = [(key, entry) for key, entry in self.entries.items() if entry["scope"] == probe["scope"]]
+            if probe["vector"] is None:
+                candidates = [(key, entry) for key, entry in candidates if entry["vector"] is None]
+                similarities = [1.0] * len(candidates)
+            else:
+                candidates = [(key, entry) for key, entry in candidates if entry["vector"] is not None]
+                similarities = (np.stack([entry["vector"] for _, entry in candidates]) @ probe["vector"]).tolist() \
+                    if candidates else []
+            for (key, entry), similarity in sorted(zip(candidates, similarities), key=lambda item: -item[1]):
+                if similarity < self.threshold:
+                    best_similarity = max(best_similarity, similarity)
+                    break
+                if is_valid is not None and not is_valid(entry["value"]):
+                    del self.entries[key]
+                    self.stats["invalid"] += 1
+                    continue
+                best_key, best_similarity = key, similarity
+                break
+            if best_key is None:
+                self.stats["misses"] += 1
+                increment("voya_result_cache_total", (("result", "miss"),))
+                return None, best_similarity
+            self.entries.move_to_end(best_key)
+            self.stats["hits"] += 1
+            increment("voya_result_cache_total", (("result", "hit"),))
+            return self.entries[best_key]["value"], best_similarity
+
+    def put(self, probe, value, ttl=None):
+        # Only narrowed probes are stored, so every entry has a scope
+        if probe["scope"] is None:
+            return
+        with self.lock:
+            self.entries[probe["key"]] = {
+                "vector": probe["vector"],
+                "scope": probe["scope"],
+                "value": value,
+                "expires_at": time.time() + (self.ttl if ttl is None else ttl),
+            }
+            self.entries.move_to_end(probe["key"])
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _expire(self, now):
+        for key in [k for k, entry in self.entries.items() if entry["expires_at"] <= now]:
+            del self.entries[key]
+            self.stats["expired"] += 1
+
+    def record_bypass(self):
+        with self.lock:
+            self.stats["bypassed"] += 1
+        increment("voya_result_cache_total", (("result", "bypass"),))
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self.entries)
+        hits = stats["hits"] + stats["exact_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+def embed_prompt(text):
+    count_call("embeddings")
+    return get_embeddings().get_text_embedding(text)
+
+
+result_cache = ResultCache(embed_prompt)
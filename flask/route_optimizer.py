@@ -0,0 +1,155 @@
+import itertools
+import os
+
+# Exact search is used up to this many stops; larger routes fall back to
+# greedy construction followed by 2-opt / or-opt improvement.
+EXACT_MAX_STOPS = int(os.getenv("EXACT_MAX_STOPS", "12"))
+# Cost used for legs the Directions API could not route.
+UNREACHABLE = 10 ** 9
+
+
+def _cost(durations, i, j):
+    t = durations[i][j]
+    return UNREACHABLE if t is None else t
+
+
+def route_cost(durations, order):
+    return sum(_cost(durations, a, b) for a, b in zip(order, order[1:]))
+
+
+# end fixes the last stop; end == start plans a round trip, with the start
+# appended again as the fixed last stop.
+
+
+def greedy_route(durations, start=0, end=None):
+    remaining = set(range(len(durations))) - {start}
+    if end is not None:
+        remaining.discard(end)
+    order = [start]
+    while remaining:
+        next_i = min(remaining, key=lambda j: _cost(durations, order[-1], j))
+        remaining.remove(next_i)
+        order.append(next_i)
+    if end is not None:
+        order.append(end)
+    return order
+
+
+def exact_route(durations, start=0, end=None):
+    # Held-Karp dynamic programming over subsets of the free stops.
+    n = len(durations)
+    free = [i for i in range(n) if i != start and i != end]
+    if not free:
+        return [start] if end is None else [start, end]
+    dp = {}
+    for k, i in enumerate(free):
+        dp[(1 << k, k)] = (_cost(durations, start, i), None)
+    for size in range(2, len(free) + 1):
+        for subset in itertools.combinations(range(len(free)), size):
+            mask = 0
+            for k in subset:
+                mask |= 1 << k
+            for k in subset:
+                prev_mask = mask & ~(1 << k)
+                best = None
+                for p in subset:
+                    if p == k:
+                        continue
+                    cost = dp[(prev_mask, p)][0] + _cost(durations, free[p], free[k])
+                    if best is None or cost < best[0]:
+                        best = (cost, p)
+                dp[(mask, k)] = best
+    full = (1 << len(free)) - 1
+    if end is None:
+        last = min(range(len(free)), key=lambda k: dp[(full, k)][0])
+    else:
+        last = min(range(len(free)), key=lambda k: dp[(full, k)][0] + _cost(durations, free[k], end))
+    order = []
+    mask, k = full, last
+    while k is not None:
+        order.append(free[k])
+        mask, k = mask & ~(1 << k), dp[(mask, k)][1]
+    order.append(start)
+    order.reverse()
+    if end is not None:
+        order.append(end)
+    return order
+
+
+def two_opt(durations, order, fixed_end=False):
+    # Transit times are asymmetric, so every candidate reversal is scored on
+    # the full route rather than with the symmetric four-edge delta.
+    best_cost = route_cost(durations, order)
+    last = len(order) - (1 if fixed_end else 0)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, last - 1):
+            for j in range(i + 1, last):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                cost = route_cost(durations, candidate)
+                if cost < best_cost:
+                    order, best_cost, improved = candidate, cost, True
+    return order
+
+
+def or_opt(durations, order, fixed_end=False, max_segment=3):
+    # Move segments of up to max_segment consecutive stops to a better position.
+    best_cost = route_cost(durations, order)
+    last = len(order) - (1 if fixed_end else 0)
+    improved = True
+    while improved:
+        improved = False
+        for size in range(1, max_segment + 1):
+            for i in range(1, last - size + 1):
+                segment = order[i:i + size]
+                rest = order[:i] + order[i + size:]
+                for j in range(1, last - size + 1):
+                    if j == i:
+                        continue
+                    candidate = rest[:j] + segment + rest[j:]
+                    cost = route_cost(durations, candidate)
+                    if cost < best_cost:
+                        order, best_cost, improved = candidate, cost, True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return order
+
+
+def local_search_route(durations, start=0, end=None):
+    order = greedy_route(durations, start, end)
+    fixed_end = end is not None
+    while True:
+        cost = route_cost(durations, order)
+        order = or_opt(durations, two_opt(durations, order, fixed_end), fixed_end)
+        if route_cost(durations, order) >= cost:
+            return order
+
+
+OPTIMIZERS = {
+    "greedy": greedy_route,
+    "exact": exact_route,
+    "local_search": local_search_route,
+}
+
+
+def optimize_route(durations, stay_times=None, start=0, end=None, method="auto"):
+    n = len(durations)
+    if method == "auto":
+        method = "exact" if n <= EXACT_MAX_STOPS else "local_search"
+    if method not in OPTIMIZERS:
+        raise ValueError(f"Unknown route optimizer: {method}")
+    order = OPTIMIZERS[method](durations, start, end)
+    travel_time = route_cost(durations, order)
+    stays = order[:-1] if end == start else order  # No stay after returning to the start
+    stay_time = sum(stay_times[i] for i in stays) * 3600 if stay_times else 0  # stay_times are in hours
+    return {
+        "order": order,
+        "method": method,
+        "travel_time": travel_time,
+        "total_time": travel_time + stay_time,
+        "reachable": travel_time < UNREACHABLE,
+    }
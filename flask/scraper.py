@@ -0,0 +1,221 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+from urllib.parse import urlparse
+
+from deadline import mark_partial, remaining
+from http_session import get_async_session, get_session
+from ingestion import extract_main_text
+from page_cache import page_cache
+from tracing import count_call, propagate
+
+SCRAPE_MAX_WORKERS = int(os.getenv("SCRAPE_MAX_WORKERS", "8"))
+SCRAPE_PER_HOST_LIMIT = int(os.getenv("SCRAPE_PER_HOST_LIMIT", "2"))
+SCRAPE_CONNECT_TIMEOUT = float(os.getenv("SCRAPE_CONNECT_TIMEOUT", "3"))  # In seconds
+SCRAPE_READ_TIMEOUT = float(os.getenv("SCRAPE_READ_TIMEOUT", "5"))  # In seconds
+# Wall-clock cap per page, so a server trickling bytes cannot dodge the read timeout
+SCRAPE_PAGE_TIMEOUT = float(os.getenv("SCRAPE_PAGE_TIMEOUT", "8"))  # In seconds
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(2 * 1024 * 1024)))
+# Stop waiting for the remaining pages once this many usable pages arrived
+SCRAPE_ENOUGH_PAGES = int(os.getenv("SCRAPE_ENOUGH_PAGES", "4"))
+# Pages with less text than this are treated as unusable (blocked, empty, ...)
+SCRAPE_MIN_CHARS = int(os.getenv("SCRAPE_MIN_CHARS", "200"))
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+}
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+_async_host_limits = {}
+
+
+class ScrapeCancelled(Exception):
+    pass
+
+
+def _host_limit(url):
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(SCRAPE_PER_HOST_LIMIT)
+        return _host_limits[host]
+
+
+def _async_host_limit(url):
+    # Only used from the event loop thread, so no lock is needed
+    host = urlparse(url).netloc
+    if host not in _async_host_limits:
+        _async_host_limits[host] = asyncio.Semaphore(SCRAPE_PER_HOST_LIMIT)
+    return _async_host_limits[host]
+
+
+def read_limited(response, cancelled, max_bytes=SCRAPE_MAX_BYTES, page_timeout=SCRAPE_PAGE_TIMEOUT):
+    deadline = time.monotonic() + page_timeout
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=16 * 1024):
+        if cancelled.is_set():
+            raise ScrapeCancelled()
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"page took longer than {page_timeout}s")
+        body.extend(chunk)
+        if len(body) >= max_bytes:
+            print(f"Truncated {response.url} at {max_bytes} bytes")
+            break
+    return bytes(body[:max_bytes])
+
+
+def scape_website(url, cancelled=None):
+    cancelled = cancelled or threading.Event()
+    cached = page_cache.get(url) if page_cache is not None else None
+    if cached is not None and cached["fresh"]:
+        return cached["text"]
+    headers = dict(HEADERS)
+    if cached is not None:
+        headers.update(page_cache.conditional_headers(cached))
+    with _host_limit(url):
+        if cancelled.is_set():
+            raise ScrapeCancelled()
+        with get_session().get(
+            url,
+            headers=headers,
+            timeout=(SCRAPE_CONNECT_TIMEOUT, SCRAPE_READ_TIMEOUT),
+            stream=True,
+        ) as response:
+            count_call("pages", response.status_code in (200, 304))
+            if response.status_code == 304 and cached is not None:
+                page_cache.mark_revalidated(url)
+                return cached["text"]
+            if response.status_code != 200:
+                print(f"Error: {response.status_code} for {url}")
+                return ""
+            content = read_limited(response, cancelled)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    print('Loaded', url)
+    text = html_to_text(content)
+    if page_cache is not None and text:
+        page_cache.put(url, text, etag, last_modified, changed=cached is not None)
+    return text
+
+
+def html_to_text(content):
+    # Main content only: menus, cookie banners, footers and scripts are dropped
+    return extract_main_text(content)
+
+
+async def read_limited_async(response, max_bytes=SCRAPE_MAX_BYTES):
+    body = bytearray()
+    async for chunk in response.content.iter_chunked(16 * 1024):
+        body.extend(chunk)
+        if len(body) >= max_bytes:
+            print(f"Truncated {response.url} at {max_bytes} bytes")
+            break
+    return bytes(body[:max_bytes])
+
+
+async def scrape_website_async(url):
+    # Abandoned pages are cancelled rather than flagged, and the page
+    # timeout is aiohttp's total timeout
+    import aiohttp
+    # The page cache is SQLite behind a lock; its calls run in a worker thread
+    cached = await asyncio.to_thread(page_cache.get, url) if page_cache is not None else None
+    if cached is not None and cached["fresh"]:
+        return cached["text"]
+    headers = dict(HEADERS)
+    if cached is not None:
+        headers.update(page_cache.conditional_headers(cached))
+    timeout = aiohttp.ClientTimeout(total=SCRAPE_PAGE_TIMEOUT, sock_connect=SCRAPE_CONNECT_TIMEOUT,
+                                    sock_read=SCRAPE_READ_TIMEOUT)
+    async with _async_host_limit(url):
+        async with get_async_session().get(url, headers=headers, timeout=timeout) as response:
+            count_call("pages", response.status in (200, 304))
+            if response.status == 304 and cached is not None:
+                await asyncio.to_thread(page_cache.mark_revalidated, url)
+                return cached["text"]
+            if response.status != 200:
+                print(f"Error: {response.status} for {url}")
+                return ""
+            content = await read_limited_async(response)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    print('Loaded', url)
+    # Parsing is CPU work; keep it off the event loop
+    text = await asyncio.to_thread(html_to_text, content)
+    if page_cache is not None and text:
+        await asyncio.to_thread(page_cache.put, url, text, etag, last_modified, changed=cached is not None)
+    return text
+
+
+def scrape_websites(urls, enough_pages=SCRAPE_ENOUGH_PAGES, max_workers=SCRAPE_MAX_WORKERS):
+    # Returns the usable page texts in the order of urls. Pages that fail or
+    # time out are skipped; once enough_pages are in, or the stage deadline
+    # passes, the rest are abandoned.
+    if not urls:
+        return []
+    cancelled = threading.Event()
+    results = {}
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    try:
+        futures = {executor.submit(propagate(scape_website), url, cancelled): i for i, url in enumerate(urls)}
+        for future in as_completed(futures, timeout=remaining("scraping")):
+            i = futures[future]
+            try:
+                text = future.result()
+            except ScrapeCancelled:
+                continue
+            except Exception as e:
+                print(f"Skipped {urls[i]}: {e!r}")
+                continue
+            if len(text) >= SCRAPE_MIN_CHARS:
+                results[i] = text
+            if enough_pages and len(results) >= enough_pages:
+                break
+    except FutureTimeout:
+        mark_partial("scraping")
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    print(f"Scraped {len(results)}/{len(urls)} pages in {time.perf_counter() - start:.2f}s")
+    if page_cache is not None:
+        print("page cache:", page_cache.get_stats())
+    return [results[i] for i in sorted(results)]
+
+
+async def scrape_websites_async(urls, enough_pages=SCRAPE_ENOUGH_PAGES, max_workers=SCRAPE_MAX_WORKERS):
+    if not urls:
+        return []
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    results = {}
+    start = time.perf_counter()
+
+    async def scrape(i, url):
+        async with semaphore:
+            try:
+                return i, await scrape_website_async(url)
+            except Exception as e:
+                print(f"Skipped {url}: {e!r}")
+                return i, ""
+
+    tasks = [asyncio.create_task(scrape(i, url)) for i, url in enumerate(urls)]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=remaining("scraping")):
+            i, text = await next_done
+            if len(text) >= SCRAPE_MIN_CHARS:
+                results[i] = text
+            if enough_pages and len(results) >= enough_pages:
+                break
+    except asyncio.TimeoutError:
+        mark_partial("scraping")
+    finally:
+        for task in tasks:
+            task.cancel()
+    print(f"Scraped {len(results)}/{len(urls)} pages in {time.perf_counter() - start:.2f}s")
+    if page_cache is not None:
+        print("page cache:", page_cache.get_stats())
+    return [results[i] for i in sorted(results)]
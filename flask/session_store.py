@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from ttl_cache import CACHE_DIR
+
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "64"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(6 * 3600)))  # In seconds
+# Expired sessions are swept at most this often, from create()
+SESSION_PURGE_INTERVAL = int(os.getenv("SESSION_PURGE_INTERVAL", "300"))  # In seconds
+# "" keeps sessions in this process only; "disk" or "redis" shares them
+# between workers so any of them can serve /get_detail.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "")
+SESSION_DIR = os.getenv("SESSION_DIR", os.path.join(CACHE_DIR, "sessions"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Keys of a session state that can be shared with other workers; anything
+# else (the vector index) only lives in the memory of the creating process.
+SHARED_KEYS = ["place_details", "contexts", "user_prompt", "user_language", "chunks"]
+
+
+class SessionNotFound(ValueError):
+    pass
+
+
+class DiskSessionBackend:
+    def __init__(self, directory=SESSION_DIR, ttl=SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def get(self, session_id):
+        path = self._path(session_id)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, session_id, value):
+        # Write then rename so readers never see a partial file
+        tmp_path = f"{self._path(session_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(session_id))
+
+    def purge_expired(self):
+        # Sessions nobody asked for again are otherwise never deleted; also
+        # clears temporary files left by writers that died mid-write
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) + self.ttl < now:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+class RedisSessionBackend:
+    def __init__(self, url=REDIS_URL, ttl=SESSION_TTL):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, session_id):
+        value = self.client.get(f"session:{session_id}")
+        return value.decode("utf-8") if value is not None else None
+
+    def put(self, session_id, value):
+        self.client.setex(f"session:{session_id}", self.ttl, value)
+
+    def purge_expired(self):
+        # Redis expires the keys itself
+        return 0
+
+
+def get_session_backend(name=SESSION_BACKEND):
+    if name == "disk":
+        return DiskSessionBackend()
+    if name == "redis":
+        return RedisSessionBackend()
+    return None
+
+
+def estimate_size(state):
+    shared = {key: state.get(key) for key in SHARED_KEYS}
+    return len(json.dumps(shared, ensure_ascii=False)) + state.get("index_bytes", 0)
+
+
+class SessionStore:
+    # Per-search state (vector index, place details, prompt, language) keyed
+    # by the session id that /get_ideas returns. Sessions expire ttl seconds
+    # after they were stored; least recently used ones are evicted earlier
+    # once either the entry count or the estimated memory is exceeded.
+
+    def __init__(self, max_entries=SESSION_MAX_ENTRIES, max_bytes=SESSION_MAX_BYTES, backend=None, ttl=SESSION_TTL,
+                 purge_interval=SESSION_PURGE_INTERVAL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.sessions = OrderedDict()
+        self.sizes = {}
+        self.expires_at = {}
+        self.total_bytes = 0
+        self.last_purge = time.time()
+        self.lock = threading.Lock()
+
+    def create(self, state):
+        if time.time() - self.last_purge >= self.purge_interval:
+            self.purge_expired()
+        session_id = uuid.uuid4().hex
+        self.put(session_id, state)
+        return session_id
+
+    def put(self, session_id, state, share=True):
+        size = estimate_size(state)
+        with self.lock:
+            if session_id in self.sessions:
+                self.total_bytes -= self.sizes[session_id]
+            self.sessions[session_id] = state
+            self.sessions.move_to_end(session_id)
+            self.sizes[session_id] = size
+            self.expires_at[session_id] = time.time() + self.ttl
+            self.total_bytes += size
+            self._evict()
+        if share and self.backend is not None:
+            self.backend.put(session_id, json.dumps({key: state.get(key) for key in SHARED_KEYS}, ensure_ascii=False))
+
+    def get(self, session_id):
+        if not session_id:
+            return None
+        with self.lock:
+            if session_id in self.sessions:
+                if self.expires_at[session_id] <= time.time():
+                    self._remove(session_id)
+                    return None
+                self.sessions.move_to_end(session_id)
+                return self.sessions[session_id]
+        if self.backend is None:
+            return None
+        value = self.backend.get(session_id)
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def _evict(self):
+        while self.sessions and (len(self.sessions) > self.max_entries or self.total_bytes > self.max_bytes):
+            if len(self.sessions) == 1:
+                break
+            self._remove(next(iter(self.sessions)))
+
+    def _remove(self, session_id):
+        del self.sessions[session_id]
+        del self.expires_at[session_id]
+        self.total_bytes -= self.sizes.pop(session_id)
+
+    def purge_expired(self):
+        now = time.time()
+        with self.lock:
+            self.last_purge = now
+            for session_id in [k for k, expires_at in self.expires_at.items() if expires_at <= now]:
+                self._remove(session_id)
+        if self.backend is not None:
+            removed = self.backend.purge_expired()
+            if removed:
+                print(f"Purged {removed} expired session files")
+
+
+session_store = SessionStore(backend=get_session_backend())
@@ -0,0 +1,128 @@
+import ast
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from deadline import mark_partial, remaining
+from rate_limiter import estimate_tokens, nebius_limiter
+from tracing import propagate, record_llm_call
+
+EXTRACTION_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "8"))
+NUM_CHUNKS = 100
+
+
+def get_spot_prompt(user_prompt, chunk):
+    docs_text = f"\n{'-' * 100}\n".join([f"Chunk {i + 1}:\n\n" + d for i, d in enumerate(chunk[:NUM_CHUNKS])])
+    context_prompt = docs_text
+    return f"""
+            User prompt:
+            {user_prompt}
+
+            Context prompt:
+            {context_prompt}
+
+            Extract at most 5 recommended travel spots the user wants to find according to the user prompt. 
+            Only mention the NAMES of the spots and nothing else. 
+            Every spot should be a physical location and NOT an event or carnival. 
+            If the spot doesnt match the user's intent, DO NOT include that spot.
+            DO NOT repeat any names. 
+            Return a python list with each element containing a tuple, (spot name, category). 
+            Category is the type of spot (eg restaurant, park, museum, zoo, shrine, statue, etc). 
+            If there are no new spots in the context prompt, output an empty list. 
+            Return only a python list.             
+            """
+
+
+def parse_spots(res_str):
+    # Returns the (spot name, category) tuples, or an empty list for a
+    # malformed response so one bad page cannot fail the whole request
+    res_str = res_str.replace("```python", "").replace("```", "").strip()
+    try:
+        formatted_res = ast.literal_eval(res_str)
+    except (ValueError, SyntaxError) as e:
+        print(f"Dropped malformed spot list: {e!r}: {res_str[:200]}")
+        return []
+    if not isinstance(formatted_res, (list, tuple)):
+        return []
+    return [
+        (spot[0].strip(), spot[1].strip()) for spot in formatted_res
+        if isinstance(spot, (list, tuple)) and len(spot) == 2
+        and all(isinstance(value, str) and value.strip() for value in spot)
+    ]
+
+
+def extract_spots(llm, user_prompt, chunks_text, limiter=nebius_limiter, max_workers=EXTRACTION_MAX_WORKERS):
+    # One extraction call per scraped page, all in flight at once (within the
+    # rate limits). Returns the unique spots in arrival order; pages still
+    # pending at the stage deadline are dropped.
+    def extract(i, chunk):
+        loc_prompt = get_spot_prompt(user_prompt, chunk)
+        limiter.acquire(estimate_tokens(loc_prompt))
+        start = time.perf_counter()
+        response = llm.complete(loc_prompt)
+        record_llm_call("nebius", response)
+        res_str = str(response)
+        return i, res_str, time.perf_counter() - start
+
+    chunks_text = [chunk for chunk in chunks_text if chunk]
+    spots = {}
+    if not chunks_text:
+        return []
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks_text))))
+    try:
+        extract = propagate(extract)
+        futures = [executor.submit(extract, i, chunk) for i, chunk in enumerate(chunks_text)]
+        for future in as_completed(futures, timeout=remaining("spot_extraction")):
+            try:
+                i, res_str, elapsed = future.result()
+            except Exception as e:
+                print(f"Spot extraction failed for a page: {e!r}")
+                continue
+            add_page_spots(spots, i, res_str, elapsed)
+    except FutureTimeout:
+        mark_partial("spot_extraction")
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return list(spots)
+
+
+async def extract_spots_async(llm, user_prompt, chunks_text, limiter=nebius_limiter,
+                              max_workers=EXTRACTION_MAX_WORKERS):
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def extract(i, chunk):
+        loc_prompt = get_spot_prompt(user_prompt, chunk)
+        async with semaphore:
+            await limiter.acquire_async(estimate_tokens(loc_prompt))
+            start = time.perf_counter()
+            try:
+                response = await llm.acomplete(loc_prompt)
+            except Exception as e:
+                print(f"Spot extraction failed for a page: {e!r}")
+                return i, None, time.perf_counter() - start
+        record_llm_call("nebius", response)
+        return i, str(response), time.perf_counter() - start
+
+    chunks_text = [chunk for chunk in chunks_text if chunk]
+    spots = {}
+    tasks = [asyncio.create_task(extract(i, chunk)) for i, chunk in enumerate(chunks_text)]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=remaining("spot_extraction")):
+            i, res_str, elapsed = await next_done
+            if res_str is not None:
+                add_page_spots(spots, i, res_str, elapsed)
+    except asyncio.TimeoutError:
+        mark_partial("spot_extraction")
+    finally:
+        for task in tasks:
+            task.cancel()
+    return list(spots)
+
+
+def add_page_spots(spots, i, res_str, elapsed):
+    page_spots = parse_spots(res_str)
+    print(f"Page {i}: {len(page_spots)} spots in {elapsed:.2f}s")
+    for spot in page_spots:
+        spots.setdefault(spot, None)
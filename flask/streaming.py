@@ -0,0 +1,91 @@
+import asyncio
+import json
+import queue
+import threading
+import traceback
+
+from flask import Response
+
+_END = object()
+
+
+def wants_stream(*sources, accept=None):
+    # Streaming is opt-in: stream=1 in the query string, form or JSON body,
+    # or an Accept header asking for server-sent events. accept defaults to
+    # the header of the current Flask request.
+    if accept is None:
+        from flask import request
+        accept = request.headers.get("Accept", "")
+    if "text/event-stream" in accept:
+        return True
+    return any(str(source.get("stream", "")).lower() in ("1", "true") for source in sources if source)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_events(run):
+    # Runs run(emit) on a worker thread and yields everything it emits as
+    # server-sent events, followed by a "done" event carrying its result.
+    events = queue.Queue()
+
+    def emit(event, data):
+        events.put((event, data))
+
+    def worker():
+        try:
+            events.put(("done", run(emit)))
+        except Exception as e:
+            events.put(("error", {"error": str(e), "stack_trace": traceback.format_exc()}))
+        finally:
+            events.put(_END)
+
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        item = events.get()
+        if item is _END:
+            return
+        yield sse_event(*item)
+
+
+def sse_response(run):
+    return Response(
+        stream_events(run),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def sse_response_async(request, run):
+    # stream_events for the aiohttp server: run(emit) is a coroutine running
+    # as its own task, and its events are written as they arrive
+    from aiohttp import web
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                           "X-Accel-Buffering": "no"})
+    await response.prepare(request)
+    events = asyncio.Queue()
+
+    def emit(event, data):
+        events.put_nowait((event, data))
+
+    async def worker():
+        try:
+            events.put_nowait(("done", await run(emit)))
+        except Exception as e:
+            events.put_nowait(("error", {"error": str(e), "stack_trace": traceback.format_exc()}))
+        finally:
+            events.put_nowait(_END)
+
+    task = asyncio.ensure_future(worker())
+    try:
+        while True:
+            item = await events.get()
+            if item is _END:
+                break
+            await response.write(sse_event(*item).encode("utf-8"))
+    finally:
+        # The client went away: stop the pipeline instead of finishing it
+        task.cancel()
+    await response.write_eof()
+    return response
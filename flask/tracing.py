@@ -0,0 +1,204 @@
+import cProfile
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+from ttl_cache import CACHE_DIR
+
+# Spans time the pipeline stages and feed both the Prometheus histograms
+# served on /metrics and the per-request trace that is logged as one JSON
+# line when the request finishes. External calls and LLM tokens are
+# counted the same way.
+load_dotenv()
+TRACE_LOG_ENABLED = os.getenv("TRACE_LOG_ENABLED", "1") != "0"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "10"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(CACHE_DIR, "profiles"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # In seconds
+
+METRICS = {
+    "voya_request_duration_seconds": ("histogram", "End-to-end latency of API requests."),
+    "voya_requests_total": ("counter", "API requests by endpoint and outcome."),
+    "voya_stage_duration_seconds": ("histogram", "Latency of each pipeline stage."),
+    "voya_external_calls_total": ("counter", "Calls to external APIs by outcome."),
+    "voya_llm_tokens_total": ("counter", "LLM tokens reported by the providers."),
+    "voya_image_bytes_total": ("counter", "Uploaded photo bytes received and sent to the vision model."),
+    "voya_photo_cache_total": ("counter", "Photo description cache lookups by result."),
+    "voya_result_cache_total": ("counter", "Semantic result cache lookups by result."),
+    "voya_hedged_calls_total": ("counter", "Hedged duplicates fired and won, and hedged calls that timed out."),
+    "voya_deadline_cutoffs_total": ("counter", "Stages cut short by the request deadline."),
+    "voya_partial_responses_total": ("counter", "Responses returned with partial results."),
+    "voya_ingested_chunks_total": ("counter", "Scraped chunks kept or dropped as exact or near duplicates."),
+    "voya_dedup_tokens_saved_total": ("counter", "Estimated embedding and extraction tokens saved by deduplication."),
+}
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_current = contextvars.ContextVar("trace", default=None)
+_profile_lock = threading.Lock()
+
+
+def observe(metric, labels, value):
+    key = (metric, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def increment(metric, labels, amount=1):
+    with _lock:
+        _counters[(metric, labels)] = _counters.get((metric, labels), 0) + amount
+
+
+def _add_to_trace(field, name, amount):
+    trace = _current.get()
+    if trace is not None:
+        with _lock:
+            trace[field][name] = trace[field].get(name, 0) + amount
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("voya_stage_duration_seconds", (("stage", name),), elapsed)
+        _add_to_trace("stages", name, elapsed)
+
+
+def count_call(api, ok=True):
+    increment("voya_external_calls_total", (("api", api), ("outcome", "ok" if ok else "error")))
+    _add_to_trace("calls", api, 1)
+
+
+def record_llm_call(api, response):
+    # Groq responses carry usage directly; llama-index completions keep the
+    # provider response in .raw
+    count_call(api)
+    raw = getattr(response, "raw", None) or response
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    for kind in ("prompt", "completion"):
+        value = usage.get(f"{kind}_tokens") if isinstance(usage, dict) else getattr(usage, f"{kind}_tokens", None)
+        if value:
+            increment("voya_llm_tokens_total", (("api", api), ("kind", kind)), value)
+            _add_to_trace("tokens", f"{api}_{kind}", value)
+
+
+def propagate(func):
+    # Worker threads do not inherit context variables; wrap functions handed
+    # to an executor so they see the submitting request's trace and deadline.
+    # Each call runs in its own copy, since a context cannot be entered by
+    # two threads at once.
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def _start_profiler():
+    # cProfile only sees the thread it runs on and only one can be active at
+    # a time, so at most one sampled request is profiled at once
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def _finish_profiler(profiler, endpoint, elapsed):
+    profiler.disable()
+    _profile_lock.release()
+    if elapsed < PROFILE_SLOW_SECONDS:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{endpoint.strip('/').replace('/', '_')}-{int(time.time() * 1000)}.prof")
+    profiler.dump_stats(path)
+    print(f"Slow request ({elapsed:.1f}s), profile written to {path}")
+
+
+@contextmanager
+def trace(endpoint):
+    record = {"stages": {}, "calls": {}, "tokens": {}}
+    token = _current.set(record)
+    profiler = _start_profiler()
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            _finish_profiler(profiler, endpoint, elapsed)
+        _current.reset(token)
+        observe("voya_request_duration_seconds", (("endpoint", endpoint),), elapsed)
+        increment("voya_requests_total", (("endpoint", endpoint), ("status", status)))
+        if TRACE_LOG_ENABLED:
+            # Stage times are summed over threads, so parallel stages can add
+            # up to more than the request itself
+            print(json.dumps({
+                "trace": endpoint,
+                "status": status,
+                "duration": round(elapsed, 4),
+                "stages": {name: round(value, 4) for name, value in record["stages"].items()},
+                "calls": record["calls"],
+                "tokens": record["tokens"],
+            }))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"')) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def render_metrics():
+    # Prometheus text exposition format
+    with _lock:
+        histograms = {key: {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+                      for key, value in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        if kind == "histogram":
+            for (name, labels), histogram in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+        else:
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
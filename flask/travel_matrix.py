@@ -0,0 +1,211 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from deadline import mark_partial, remaining
+from directions import get_dir_data, get_dir_data_async
+from geo import DEFAULT_ESTIMATION_MODEL, estimate_travel_times, haversine_matrix, k_nearest_pairs
+from http_session import get_session
+from tracing import propagate
+
+# Upper bound on Directions requests in flight for one matrix build.
+MATRIX_MAX_WORKERS = int(os.getenv("MATRIX_MAX_WORKERS", "8"))
+# When place locations are known, only each place's k nearest neighbours are
+# routed through the Directions API; 0 routes every pair.
+MATRIX_K_NEAREST = int(os.getenv("MATRIX_K_NEAREST", "3"))
+
+
+def get_needed_pairs(n, start=0):
+    # Every leg the planner may use: any stop to any other stop, except legs
+    # leading back to the starting point (if any).
+    return [(i, j) for i in range(n) for j in range(n) if i != j and j != start]
+
+
+def get_matrix_pairs(n, pairs, locations, k_nearest, estimation_model, round_trip=False):
+    # The pairs to route, plus straight-line estimates for the rest when
+    # locations are known. Round trips also need the legs back to the start.
+    estimates = None
+    start = None if round_trip else 0
+    if locations is not None and k_nearest:
+        distances = haversine_matrix(locations)
+        estimates = estimate_travel_times(distances, estimation_model)
+        if pairs is None:
+            pairs = k_nearest_pairs(distances, k_nearest, start)
+    if pairs is None:
+        pairs = get_needed_pairs(n, start)
+    return pairs, estimates
+
+
+def finish_matrix(places, departure_timestamp, durations, legs, timings, estimates, start, round_trip=False):
+    n = len(places)
+    estimated = set()
+    if estimates is not None:
+        # Pairs that were not routed (or failed) get the straight-line estimate
+        for i, j in get_needed_pairs(n, None if round_trip else 0):
+            if durations[i][j] is None:
+                durations[i][j] = int(estimates[i][j])
+                estimated.add((i, j))
+    return {
+        "places": places,
+        "departure_timestamp": departure_timestamp,
+        "durations": durations,
+        "legs": legs,
+        "timings": timings,
+        "estimated": estimated,
+        "elapsed": time.perf_counter() - start,
+    }
+
+
+def build_travel_matrix(places, departure_timestamp, pairs=None, max_workers=MATRIX_MAX_WORKERS,
+                        locations=None, k_nearest=MATRIX_K_NEAREST, estimation_model=DEFAULT_ESTIMATION_MODEL,
+                        round_trip=False):
+    n = len(places)
+    pairs, estimates = get_matrix_pairs(n, pairs, locations, k_nearest, estimation_model, round_trip)
+    durations = [[0 if i == j else None for j in range(n)] for i in range(n)]
+    legs = {}
+    timings = {}
+    session = get_session()
+
+    def fetch_leg(i, j):
+        start = time.perf_counter()
+        try:
+            dir_data = get_dir_data(places[i], places[j], departure_timestamp, session=session)
+        except Exception as e:
+            print(f"Error: {e} for route {places[i]} -> {places[j]}")
+            dir_data = None
+        return i, j, dir_data, time.perf_counter() - start
+
+    start = time.perf_counter()
+    if pairs:
+        # Legs still missing at the stage deadline are left to the estimates
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pairs))))
+        try:
+            futures = [executor.submit(propagate(fetch_leg), i, j) for i, j in pairs]
+            for future in as_completed(futures, timeout=remaining("travel_matrix")):
+                i, j, dir_data, elapsed = future.result()
+                timings[(i, j)] = elapsed
+                if dir_data is not None:
+                    durations[i][j] = dir_data["overall_duration"]
+                    legs[(i, j)] = dir_data
+        except FutureTimeout:
+            mark_partial("travel_matrix")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    return finish_matrix(places, departure_timestamp, durations, legs, timings, estimates, start, round_trip)
+
+
+async def build_travel_matrix_async(places, departure_timestamp, pairs=None, max_workers=MATRIX_MAX_WORKERS,
+                                    locations=None, k_nearest=MATRIX_K_NEAREST,
+                                    estimation_model=DEFAULT_ESTIMATION_MODEL, round_trip=False):
+    n = len(places)
+    pairs, estimates = get_matrix_pairs(n, pairs, locations, k_nearest, estimation_model, round_trip)
+    durations = [[0 if i == j else None for j in range(n)] for i in range(n)]
+    legs = {}
+    timings = {}
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def fetch_leg(i, j):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                dir_data = await get_dir_data_async(places[i], places[j], departure_timestamp)
+            except Exception as e:
+                print(f"Error: {e!r} for route {places[i]} -> {places[j]}")
+                dir_data = None
+            return i, j, dir_data, time.perf_counter() - start
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(fetch_leg(i, j)) for i, j in pairs]
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=remaining("travel_matrix")):
+            i, j, dir_data, elapsed = await next_done
+            timings[(i, j)] = elapsed
+            if dir_data is not None:
+                durations[i][j] = dir_data["overall_duration"]
+                legs[(i, j)] = dir_data
+    except asyncio.TimeoutError:
+        mark_partial("travel_matrix")
+    finally:
+        for task in tasks:
+            task.cancel()
+    return finish_matrix(places, departure_timestamp, durations, legs, timings, estimates, start, round_trip)
+
+
+def get_leg(matrix, i, j):
+    # Estimated legs carry no transit steps, so they are routed on demand
+    # once the optimizer has actually chosen them.
+    if (i, j) not in matrix["legs"]:
+        places = matrix["places"]
+        try:
+            dir_data = get_dir_data(places[i], places[j], matrix["departure_timestamp"])
+        except Exception as e:
+            dir_data = get_estimated_leg(matrix, i, j, e)
+        if dir_data is None:
+            raise ValueError(f"No transit route found from {places[i]} to {places[j]}")
+        matrix["legs"][(i, j)] = dir_data
+    return matrix["legs"][(i, j)]
+
+
+def get_estimated_leg(matrix, i, j, error):
+    # A leg that could not be routed in time keeps its estimated duration
+    # and is shown without transit steps
+    print(f"Routing {matrix['places'][i]} -> {matrix['places'][j]} failed: {error!r}, using the estimate")
+    mark_partial("travel_matrix")
+    return {"overall_duration": matrix["durations"][i][j], "steps": []}
+
+
+def prefetch_legs(day_matrices, orders, max_workers=MATRIX_MAX_WORKERS):
+    # Routes the estimated legs of every (matrix, order) pair up front on one
+    # thread pool, so that get_leg does not route them one at a time while
+    # the itinerary is rendered
+    missing = [(matrix, i, j) for matrix, order in zip(day_matrices, orders)
+               for i, j in zip(order, order[1:]) if (i, j) not in matrix["legs"]]
+    if not missing:
+        return
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(missing)))) as executor:
+        futures = [executor.submit(propagate(get_dir_data), matrix["places"][i], matrix["places"][j],
+                                   matrix["departure_timestamp"], session=session) for matrix, i, j in missing]
+        for (matrix, i, j), future in zip(missing, futures):
+            try:
+                dir_data = future.result()
+            except Exception as e:
+                dir_data = get_estimated_leg(matrix, i, j, e)
+            if dir_data is None:
+                raise ValueError(f"No transit route found from {matrix['places'][i]} to {matrix['places'][j]}")
+            matrix["legs"][(i, j)] = dir_data
+
+
+async def prefetch_legs_async(matrix, order):
+    # Routes the estimated legs of the chosen order up front, so that get_leg
+    # never blocks the event loop
+    places = matrix["places"]
+    missing = [(i, j) for i, j in zip(order, order[1:]) if (i, j) not in matrix["legs"]]
+    results = await asyncio.gather(*(
+        get_dir_data_async(places[i], places[j], matrix["departure_timestamp"]) for i, j in missing),
+        return_exceptions=True)
+    for (i, j), dir_data in zip(missing, results):
+        if isinstance(dir_data, Exception):
+            dir_data = get_estimated_leg(matrix, i, j, dir_data)
+        if dir_data is None:
+            raise ValueError(f"No transit route found from {places[i]} to {places[j]}")
+        matrix["legs"][(i, j)] = dir_data
+
+
+def format_matrix_report(matrix):
+    places = matrix["places"]
+    timings = matrix["timings"]
+    lines = []
+    for (i, j), elapsed in sorted(timings.items(), key=lambda item: -item[1]):
+        status = "ok" if (i, j) in matrix["legs"] else "failed"
+        lines.append(f"\t{places[i]} -> {places[j]}: {elapsed * 1000:.0f} ms ({status})")
+    total = sum(timings.values())
+    if matrix["estimated"]:
+        lines.append(f"Estimated {len(matrix['estimated'])} legs from straight-line distance")
+    lines.append(
+        f"Fetched {len(timings)} legs in {matrix['elapsed']:.2f}s wall clock "
+        f"({total:.2f}s if sequential)"
+    )
+    return "\n".join(lines)
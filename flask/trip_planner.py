@@ -0,0 +1,372 @@
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from deadline import call_with_deadline, call_with_deadline_async, is_partial
+from generate_itinerary import (apply_stay_descriptions, build_itinerary_entries, complete_json, complete_json_async,
+                                get_stay_times)
+from geo import cluster_locations, get_lat_lng
+from route_optimizer import optimize_route, route_cost
+from tracing import span
+from travel_matrix import (MATRIX_MAX_WORKERS, build_travel_matrix, build_travel_matrix_async, format_matrix_report,
+                           prefetch_legs, prefetch_legs_async)
+from ttl_cache import TTLCache
+
+# Plans a trip of several days from one saved list of places. The first
+# place is where every day starts (and, by default, ends); the others are
+# grouped into days by location and each day is routed within its time
+# window. All days are planned on one travel matrix, routed at the first
+# day's departure and kept for later requests over the same places and
+# departure, and the whole trip is described by one LLM call.
+load_dotenv()
+TRIP_DAY_START = os.getenv("TRIP_DAY_START", "09:00")
+TRIP_DAY_END = os.getenv("TRIP_DAY_END", "18:00")
+TRIP_MAX_DAYS = int(os.getenv("TRIP_MAX_DAYS", "14"))
+# Share of a day's window that grouping fills with stays; the rest is left for travel
+TRIP_STAY_SHARE = float(os.getenv("TRIP_STAY_SHARE", "0.75"))
+TRIP_MATRIX_CACHE_TTL = int(os.getenv("TRIP_MATRIX_CACHE_TTL", str(24 * 3600)))  # In seconds
+TRIP_MATRIX_CACHE_SIZE = int(os.getenv("TRIP_MATRIX_CACHE_SIZE", "64"))
+
+# Request fields passed on to get_trip_plan
+TRIP_OPTIONS = ("dates", "start_date", "end_date", "day_start", "day_end", "windows", "stay_times", "locations",
+                "return_to_start", "optimizer")
+
+# Matrices have tuple keys, so they are only kept in memory
+trip_matrix_cache = TTLCache(
+    "trip_matrix",
+    ttl=TRIP_MATRIX_CACHE_TTL,
+    max_entries=TRIP_MATRIX_CACHE_SIZE,
+    persistent=False,
+)
+
+
+class InvalidTrip(ValueError):
+    # A request the planner cannot work with, answered with a 400
+    pass
+
+
+def get_trip_dates(dates=None, start_date=None, end_date=None):
+    if not dates:
+        if not start_date:
+            raise InvalidTrip("Either dates or start_date is required")
+        first = datetime.strptime(start_date, "%Y-%m-%d")
+        last = datetime.strptime(end_date or start_date, "%Y-%m-%d")
+        dates = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+    if not 0 < len(dates) <= TRIP_MAX_DAYS:
+        raise InvalidTrip(f"A trip must have between 1 and {TRIP_MAX_DAYS} days")
+    return dates
+
+
+def get_day_windows(dates, day_start=TRIP_DAY_START, day_end=TRIP_DAY_END, windows=None):
+    # (departure timestamp, length in seconds) of every day; windows
+    # optionally gives a [start, end] pair of "HH:MM" times per day
+    windows = windows or [[day_start, day_end]] * len(dates)
+    if len(windows) != len(dates):
+        raise InvalidTrip("windows must have one entry per date")
+    day_windows = []
+    for date_str, (start, end) in zip(dates, windows):
+        departure = datetime.strptime(f"{date_str} {start}", "%Y-%m-%d %H:%M")
+        finish = datetime.strptime(f"{date_str} {end}", "%Y-%m-%d %H:%M")
+        if finish <= departure:
+            raise InvalidTrip(f"The window of {date_str} ends before it starts")
+        day_windows.append((int(departure.timestamp()), (finish - departure).total_seconds()))
+    return day_windows
+
+
+def sort_trip_places(places, stay_times, locations):
+    # Puts the places in name order, the order of the shared matrix, so that
+    # requests listing the same places in any order share it. Returns the
+    # reordered lists and the new index of the starting point.
+    keys = [place.strip().lower() for place in places]
+    if len(set(keys)) != len(keys):
+        raise InvalidTrip("places must not repeat")
+    order = sorted(range(len(places)), key=lambda i: keys[i])
+    names = [places[i] for i in order]
+    stay_times = [stay_times[i] for i in order]
+    if locations is not None:
+        locations = [locations[i] for i in order]
+    return names, stay_times, locations, order.index(0)
+
+
+def validate_locations(places, locations):
+    # locations are optional, but when given every place needs numeric
+    # coordinates, in the Places API or the Directions API shape
+    if locations is None:
+        return
+    if not isinstance(locations, list) or len(locations) != len(places):
+        raise InvalidTrip("locations must have one entry per place")
+    for place, location in zip(places, locations):
+        try:
+            coordinates = get_lat_lng(location)
+        except (KeyError, TypeError):
+            coordinates = None
+        if coordinates is None or not all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                                          for value in coordinates):
+            raise InvalidTrip(f"The location of {place} needs a numeric latitude and longitude")
+
+
+def get_matrix_key(names, departure_timestamp, locations):
+    # Transit times depend on the day and hour, so a matrix is only reused
+    # for trips leaving at the same time. Legs that were not routed were
+    # estimated from the locations, so those are part of the key too.
+    if locations is not None:
+        coordinates = [[round(value, 5) for value in get_lat_lng(location)] for location in locations]
+        locations = hashlib.sha256(json.dumps(coordinates).encode()).hexdigest()
+    return json.dumps([[name.strip().lower() for name in names], departure_timestamp, locations])
+
+
+def get_cached_matrix(key, names):
+    matrix = trip_matrix_cache.get(key)
+    if matrix is not None:
+        print(f"Reusing the travel matrix of {len(names)} places")
+    return matrix
+
+
+def cache_matrix(key, matrix):
+    print(format_matrix_report(matrix))
+    # A matrix cut short by the deadline is mostly estimates, so it is not kept
+    if not is_partial():
+        trip_matrix_cache.set(key, matrix)
+    print("trip matrix cache:", trip_matrix_cache.get_stats())
+
+
+def get_shared_matrix(names, locations, departure_timestamp, max_workers=MATRIX_MAX_WORKERS):
+    key = get_matrix_key(names, departure_timestamp, locations)
+    matrix = get_cached_matrix(key, names)
+    if matrix is None:
+        matrix = build_travel_matrix(names, departure_timestamp, max_workers=max_workers, locations=locations,
+                                     round_trip=True)
+        cache_matrix(key, matrix)
+    return matrix
+
+
+async def get_shared_matrix_async(names, locations, departure_timestamp, max_workers=MATRIX_MAX_WORKERS):
+    key = get_matrix_key(names, departure_timestamp, locations)
+    matrix = get_cached_matrix(key, names)
+    if matrix is None:
+        matrix = await build_travel_matrix_async(names, departure_timestamp, max_workers=max_workers,
+                                                 locations=locations, round_trip=True)
+        cache_matrix(key, matrix)
+    return matrix
+
+
+def get_day_matrix(matrix, departure_timestamp):
+    # The matrix as seen by one day of one request. Its legs were routed at
+    # the matrix departure, so other days route theirs at their own
+    # departure. Legs routed on demand, estimates included, go into this
+    # copy and never into the cached matrix.
+    legs = dict(matrix["legs"]) if departure_timestamp == matrix["departure_timestamp"] else {}
+    return dict(matrix, departure_timestamp=departure_timestamp, legs=legs)
+
+
+def get_day_time(durations, stay_times, order, return_to_start):
+    # Seconds from leaving the start to the end of the last stay (or to
+    # being back at the start)
+    stays = order[:-1] if return_to_start else order
+    return route_cost(durations, order) + sum(stay_times[i] for i in stays) * 3600
+
+
+def route_day(durations, start, stops, return_to_start, optimizer):
+    # Best order of the day's stops; round trips end with the start again
+    nodes = [start] + stops
+    if not stops:
+        return nodes + ([start] if return_to_start else [])
+    sub_durations = [[durations[a][b] for b in nodes] for a in nodes]
+    route = optimize_route(sub_durations, end=0 if return_to_start else None, method=optimizer)
+    return [nodes[i] for i in route["order"]]
+
+
+def get_removal_saving(durations, stay_times, order, stop):
+    p = order.index(stop)
+    saving = stay_times[stop] * 3600 + route_cost(durations, order[p - 1:p + 1])
+    if p + 1 < len(order):
+        saving += route_cost(durations, order[p:p + 2]) - route_cost(durations, [order[p - 1], order[p + 1]])
+    return saving
+
+
+def fit_day(durations, stay_times, start, stops, seconds, return_to_start, optimizer):
+    # Routes the day, dropping the stops that save the most time until it
+    # fits the window. Returns the order and the dropped stops.
+    stops = list(stops)
+    dropped = []
+    order = route_day(durations, start, stops, return_to_start, optimizer)
+    while stops and get_day_time(durations, stay_times, order, return_to_start) > seconds:
+        stop = max(stops, key=lambda i: get_removal_saving(durations, stay_times, order, i))
+        stops.remove(stop)
+        dropped.append(stop)
+        order = route_day(durations, start, stops, return_to_start, optimizer)
+    return order, dropped
+
+
+def insert_stops(durations, stay_times, orders, stops, day_windows, return_to_start):
+    # Cheapest insertion of the left over stops into days with time to
+    # spare. Returns the stops that fit nowhere.
+    unscheduled = []
+    for stop in stops:
+        best = None
+        for d, order in enumerate(orders):
+            current = get_day_time(durations, stay_times, order, return_to_start)
+            for p in range(1, len(order) if return_to_start else len(order) + 1):
+                candidate = order[:p] + [stop] + order[p:]
+                total = get_day_time(durations, stay_times, candidate, return_to_start)
+                if total <= day_windows[d][1] and (best is None or total - current < best[0]):
+                    best = (total - current, d, candidate)
+        if best is None:
+            unscheduled.append(stop)
+        else:
+            orders[best[1]] = best[2]
+    return unscheduled
+
+
+def split_by_location(stops, stay_times, locations, day_windows):
+    # Groups nearby stops, then gives the groups with the most to see to the
+    # longest days
+    capacity = TRIP_STAY_SHARE * max(seconds for _, seconds in day_windows) / 3600
+    labels = cluster_locations([locations[i] for i in stops], len(day_windows),
+                               weights=[stay_times[i] for i in stops], capacity=capacity)
+    groups = [[stop for stop, label in zip(stops, labels) if label == c] for c in range(len(day_windows))]
+    groups.sort(key=lambda group: -sum(stay_times[i] for i in group))
+    days = [None] * len(day_windows)
+    for d, group in zip(sorted(range(len(day_windows)), key=lambda d: -day_windows[d][1]), groups):
+        days[d] = group
+    return days, [stop for stop, label in zip(stops, labels) if label < 0]
+
+
+def split_by_route(durations, stay_times, start, stops, day_windows, return_to_start):
+    # Without locations: one route through every stop, cut into days
+    # wherever a day's window is full
+    order = optimize_route(durations, stay_times, start=start)["order"][1:]
+    days = []
+    overflow = []
+    for _, seconds in day_windows:
+        day = []
+        while order:
+            candidate = [start] + day + [order[0]] + ([start] if return_to_start else [])
+            if get_day_time(durations, stay_times, candidate, return_to_start) <= seconds:
+                day.append(order.pop(0))
+            elif not day:
+                overflow.append(order.pop(0))
+            else:
+                break
+        days.append(day)
+    return days, overflow + order
+
+
+def plan_days(durations, stay_times, start, locations, day_windows, return_to_start=True, optimizer="auto"):
+    # The order of every day, in matrix indices, and the stops that did not
+    # fit in the trip
+    stops = [i for i in range(len(durations)) if i != start]
+    if locations is not None:
+        days, overflow = split_by_location(stops, stay_times, locations, day_windows)
+    else:
+        days, overflow = split_by_route(durations, stay_times, start, stops, day_windows, return_to_start)
+    orders = []
+    for day, (_, seconds) in zip(days, day_windows):
+        order, dropped = fit_day(durations, stay_times, start, day, seconds, return_to_start, optimizer)
+        orders.append(order)
+        overflow += dropped
+    unscheduled = insert_stops(durations, stay_times, orders, overflow, day_windows, return_to_start)
+    print(f"Planned {len(stops) - len(unscheduled)} of {len(stops)} stops over {len(orders)} days: {orders}")
+    return orders, unscheduled
+
+
+def render_trip(names, orders, unscheduled, day_matrices, stay_times, dates, day_windows, on_event):
+    # The itinerary of every day, plus for every day the (entry, place)
+    # indices of its stays
+    trip = {
+        "title": f"Itinerary for a {len(dates)} day trip from {dates[0]} to {dates[-1]}",
+        "days": [],
+        "unscheduled": [names[i] for i in unscheduled],
+    }
+    day_stays = []
+    if on_event is not None:
+        on_event("title", {"title": trip["title"], "unscheduled": trip["unscheduled"]})
+    for date_str, (departure_timestamp, _), order, matrix in zip(dates, day_windows, orders, day_matrices):
+        day = {"date": date_str, "title": f"Day trip on {date_str}", "itinerary": []}
+        stays = []
+        if len(set(order)) > 1:
+            entries, stays = build_itinerary_entries(names, order, matrix, stay_times, departure_timestamp)
+            day["itinerary"] = entries
+        trip["days"].append(day)
+        day_stays.append(stays)
+        if on_event is not None:
+            on_event("day", day)
+    return trip, day_stays
+
+
+def get_trip_description_prompt(trip, day_stays, names):
+    plan = {day["date"]: list(dict.fromkeys(names[i] for _, i in stays))
+            for day, stays in zip(trip["days"], day_stays) if stays}
+    return f"""
+    A traveller is visiting these attractions over {len(trip["days"])} days, listed by date:
+    {json.dumps(plan, ensure_ascii=False)}
+
+    Return a json object with three keys: "title", a one line title for the whole trip such as "Three days in Hong Kong, 2024-11-26 to 2024-11-28", "day_titles", an object mapping each date to a one line title for that day, and "descriptions", an object mapping each attraction name, exactly as written above, to a one to two line description of the attraction.
+    """
+
+
+def apply_trip_descriptions(trip, day_stays, names, res, on_event):
+    day_titles = res.get("day_titles") if isinstance(res.get("day_titles"), dict) else {}
+    for day, stays in zip(trip["days"], day_stays):
+        apply_stay_descriptions(day, stays, names, {"title": day_titles.get(day["date"]),
+                                                    "descriptions": res.get("descriptions")}, None)
+    if isinstance(res.get("title"), str) and res["title"].strip():
+        trip["title"] = res["title"].strip()
+    if on_event is not None:
+        on_event("descriptions", {"title": trip["title"], "day_titles": day_titles,
+                                  "descriptions": res.get("descriptions") or {}})
+    return trip
+
+
+def get_trip_setup(places, dates, start_date, end_date, day_start, day_end, windows, stay_times, locations):
+    if not places or len(places) < 2:
+        raise InvalidTrip("A trip needs a starting point and at least one place to visit")
+    validate_locations(places, locations)
+    dates = get_trip_dates(dates, start_date, end_date)
+    day_windows = get_day_windows(dates, day_start or TRIP_DAY_START, day_end or TRIP_DAY_END, windows)
+    stay_times = get_stay_times(places, stay_times)
+    names, stay_times, locations, start = sort_trip_places(places, stay_times, locations)
+    return dates, day_windows, names, stay_times, locations, start
+
+
+def get_trip_plan(places, dates=None, start_date=None, end_date=None, day_start=None, day_end=None, windows=None,
+                  stay_times=None, locations=None, return_to_start=True, optimizer="auto",
+                  max_workers=MATRIX_MAX_WORKERS, on_event=None):
+    # places[0] is the starting point of every day, as in get_itinerary_sub
+    dates, day_windows, names, stay_times, locations, start = get_trip_setup(
+        places, dates, start_date, end_date, day_start, day_end, windows, stay_times, locations)
+    with span("travel_matrix"):
+        matrix = get_shared_matrix(names, locations, day_windows[0][0], max_workers)
+    with span("route_optimization"):
+        orders, unscheduled = plan_days(matrix["durations"], stay_times, start, locations, day_windows,
+                                        return_to_start, optimizer)
+    day_matrices = [get_day_matrix(matrix, departure_timestamp) for departure_timestamp, _ in day_windows]
+    prefetch_legs(day_matrices, orders, max_workers)
+    trip, day_stays = render_trip(names, orders, unscheduled, day_matrices, stay_times, dates, day_windows, on_event)
+    with span("stay_descriptions"):
+        res = call_with_deadline("stay_descriptions", {}, complete_json,
+                                 get_trip_description_prompt(trip, day_stays, names))
+    return apply_trip_descriptions(trip, day_stays, names, res, on_event)
+
+
+async def get_trip_plan_async(places, dates=None, start_date=None, end_date=None, day_start=None, day_end=None,
+                              windows=None, stay_times=None, locations=None, return_to_start=True, optimizer="auto",
+                              max_workers=MATRIX_MAX_WORKERS, on_event=None):
+    dates, day_windows, names, stay_times, locations, start = get_trip_setup(
+        places, dates, start_date, end_date, day_start, day_end, windows, stay_times, locations)
+    with span("travel_matrix"):
+        matrix = await get_shared_matrix_async(names, locations, day_windows[0][0], max_workers)
+    with span("route_optimization"):
+        orders, unscheduled = await asyncio.to_thread(plan_days, matrix["durations"], stay_times, start, locations,
+                                                      day_windows, return_to_start, optimizer)
+    day_matrices = [get_day_matrix(matrix, departure_timestamp) for departure_timestamp, _ in day_windows]
+    await asyncio.gather(*(prefetch_legs_async(day_matrix, order) for day_matrix, order in zip(day_matrices, orders)))
+    trip, day_stays = render_trip(names, orders, unscheduled, day_matrices, stay_times, dates, day_windows, on_event)
+    with span("stay_descriptions"):
+        res = await call_with_deadline_async("stay_descriptions", {}, complete_json_async(
+            get_trip_description_prompt(trip, day_stays, names)))
+    return apply_trip_descriptions(trip, day_stays, names, res, on_event)
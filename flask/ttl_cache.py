@@ -0,0 +1,120 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# App Engine only allows writes under /tmp, so caches default there.
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "voya_cache"))
+# Expired entries are swept every CACHE_PURGE_EVERY writes, which also trims
+# the disk tier to CACHE_MAX_ROWS rows (0 for no limit), dropping the
+# entries closest to expiry first.
+CACHE_PURGE_EVERY = int(os.getenv("CACHE_PURGE_EVERY", "256"))
+CACHE_MAX_ROWS = int(os.getenv("CACHE_MAX_ROWS", "100000"))
+
+
+class TTLCache:
+    # In-memory LRU in front of an optional SQLite table that survives
+    # restarts and is shared by every worker process on the instance.
+    # Values must be JSON serializable.
+
+    def __init__(self, name, ttl, max_entries=1024, persistent=True, max_rows=CACHE_MAX_ROWS,
+                 purge_every=CACHE_PURGE_EVERY):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.purge_every = max(1, purge_every)
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "writes": 0, "purged": 0}
+        self.db = None
+        if persistent:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self.path = os.path.join(CACHE_DIR, f"{name}.sqlite3")
+            self.db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (expires_at)")
+            self.db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value
+                del self.memory[key]
+                self.stats["expired"] += 1
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT expires_at, value FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    expires_at, value = row
+                    if expires_at > now:
+                        value = json.loads(value)
+                        self._remember(key, expires_at, value)
+                        self.stats["disk_hits"] += 1
+                        return value
+                    self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.db.commit()
+                    self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            self._remember(key, expires_at, value)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO entries (key, expires_at, value) VALUES (?, ?, ?)",
+                    (key, expires_at, json.dumps(value)),
+                )
+                self.db.commit()
+            self.stats["writes"] += 1
+            if self.stats["writes"] % self.purge_every == 0:
+                self._purge(time.time())
+
+    def purge_expired(self):
+        with self.lock:
+            self._purge(time.time())
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self.memory)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def _purge(self, now):
+        expired = [k for k, (expires_at, _) in self.memory.items() if expires_at <= now]
+        for key in expired:
+            del self.memory[key]
+        purged = len(expired)
+        if self.db is not None:
+            purged += self.db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,)).rowcount
+            if self.max_rows:
+                purged += self.db.execute(
+                    "DELETE FROM entries WHERE key IN "
+                    "(SELECT key FROM entries ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                ).rowcount
+            self.db.commit()
+        self.stats["purged"] += purged
+
+    def _remember(self, key, expires_at, value):
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
@@ -8,7 +8,7 @@ export default async function handler(req: NextRequest) {
   }
 
   try {
-    const { places } = await req.json();
+    const { places, locations } = await req.json();
 
     if (!Array.isArray(places) || places.length === 0) {
       return NextResponse.json(
@@ -17,6 +17,16 @@ export default async function handler(req: NextRequest) {
       );
     }
 
+    // Coordinates let the backend skip routing distant pairs; they are only
+    // useful when every place has one
+    const hasLocations =
+      Array.isArray(locations) &&
+      locations.length === places.length &&
+      locations.every(
+        (location) =>
+          typeof location?.latitude === 'number' && typeof location?.longitude === 'number'
+      );
+
     const response = await fetch(
       'https://metallama3-dot-gen-lang-client-0695819598.ue.r.appspot.com/get_itinerary',
       {
@@ -24,7 +34,7 @@ export default async function handler(req: NextRequest) {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ places }),
+        body: JSON.stringify(hasLocations ? { places, locations } : { places }),
       }
     );
 
@@ -8,10 +8,11 @@ export default async function handler(req: NextRequest) {
   }
 
   try {
-    const { placeName } = await req.json();
+    const { placeName, sessionId } = await req.json();
     
     const detailsFormData = new FormData();
     detailsFormData.append('place', placeName);
+    if (sessionId) detailsFormData.append('session_id', sessionId);
     
     const detailsResponse = await fetch(
       'https://metallama3-dot-gen-lang-client-0695819598.ue.r.appspot.com/get_detail',